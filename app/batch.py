@@ -0,0 +1,181 @@
+"""
+Preguntas por lotes para cargas offline (auditorías, generación de FAQs)
+Las preguntas se embeben en una sola llamada, las búsquedas se resuelven
+juntas y las generaciones se programan con concurrencia limitada contra
+Ollama. No usa ni modifica la memoria del chat.
+"""
+
+import json
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from langchain.docstore.document import Document
+
+logger = logging.getLogger(__name__)
+
+
+def read_questions(text: str, max_questions: int,
+                   parse_filters: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """Leer un JSONL de preguntas
+
+    Cada línea es un objeto con `question` y opcionalmente `id` y `filters`
+    (mismas claves que el formulario de /chat), o directamente una cadena.
+    Lanza ValueError indicando la línea con el problema.
+    """
+    questions = []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            raise ValueError(f"Línea {line_number}: JSON inválido")
+        if isinstance(item, str):
+            item = {"question": item}
+        if not isinstance(item, dict) or not str(item.get("question") or "").strip():
+            raise ValueError(f"Línea {line_number}: falta 'question'")
+
+        filters = item.get("filters") or {}
+        if not isinstance(filters, dict):
+            raise ValueError(f"Línea {line_number}: 'filters' debe ser un objeto")
+        # Los valores llegan como en un formulario: texto, salvo listas de etiquetas
+        filters = {key: value if isinstance(value, list) else str(value) for key, value in filters.items()}
+        questions.append({
+            "index": len(questions),
+            "id": item.get("id", len(questions)),
+            "question": str(item["question"]).strip(),
+            "filters": parse_filters(filters) if parse_filters and filters else filters
+        })
+        if len(questions) > max_questions:
+            raise ValueError(f"El lote supera el máximo de {max_questions} preguntas")
+    return questions
+
+
+class BatchRunner:
+    """Ejecuta un lote de preguntas: recuperación conjunta y generación concurrente"""
+
+    def __init__(self, knowledge_base, llm, prompt, k: int = 5, fetch_k: int = 10,
+                 lambda_mult: float = 0.7, reranker=None, rerank_candidates: int = 20,
+                 concurrency: int = 2):
+        self.knowledge_base = knowledge_base
+        self.llm = llm
+        self.prompt = prompt
+        self.k = k
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.concurrency = max(1, concurrency)
+
+    def retrieve(self, questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Embeddings en una llamada y búsquedas agrupadas por filtros"""
+        texts = [item["question"] for item in questions]
+
+        started = time.perf_counter()
+        query_embeddings = self.knowledge_base.embeddings.embed_documents(texts)
+        embed_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        if self.reranker is None:
+            documents = self.knowledge_base.search_many(
+                texts, k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult,
+                filters=[item["filters"] for item in questions], query_embeddings=query_embeddings
+            )
+        else:
+            candidates = self.knowledge_base.search_many(
+                texts, k=self.rerank_candidates, fetch_k=self.rerank_candidates * 2,
+                lambda_mult=self.lambda_mult,
+                filters=[item["filters"] for item in questions], query_embeddings=query_embeddings
+            )
+            documents = [self.reranker.rerank(text, docs) for text, docs in zip(texts, candidates)]
+        search_ms = (time.perf_counter() - started) * 1000
+
+        return {"documents": documents, "embed_ms": embed_ms, "search_ms": search_ms}
+
+    async def run(self, questions: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """Generar resultados en orden de finalización, cerrando con un resumen"""
+        started = time.perf_counter()
+        try:
+            retrieval = await asyncio.to_thread(self.retrieve, questions)
+        except Exception as e:
+            # La respuesta ya está en curso: el fallo se informa como una línea más
+            logger.error(f"❌ Error en la recuperación del lote: {e}")
+            yield {"error": f"Error en la recuperación: {e}", "summary": {"questions": len(questions), "errors": len(questions)}}
+            return
+        # Coste de recuperación repartido entre las preguntas del lote
+        retrieval_ms = (retrieval["embed_ms"] + retrieval["search_ms"]) / max(1, len(questions))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [
+            asyncio.create_task(self._answer(item, documents, semaphore, retrieval_ms))
+            for item, documents in zip(questions, retrieval["documents"])
+        ]
+
+        errors = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                if "error" in result:
+                    errors += 1
+                yield result
+        finally:
+            # Si el cliente se desconecta no se siguen generando respuestas que nadie leerá
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.info(f"🛑 Lote interrumpido: {len(pending)} preguntas canceladas")
+
+        yield {
+            "summary": {
+                "questions": len(questions),
+                "errors": errors,
+                "concurrency": self.concurrency,
+                "embed_ms": round(retrieval["embed_ms"], 1),
+                "search_ms": round(retrieval["search_ms"], 1),
+                "total_ms": round((time.perf_counter() - started) * 1000, 1)
+            }
+        }
+
+    async def _answer(self, item: Dict[str, Any], documents: List[Document],
+                      semaphore: asyncio.Semaphore, retrieval_ms: float) -> Dict[str, Any]:
+        queued = time.perf_counter()
+        result = {
+            "index": item["index"],
+            "id": item["id"],
+            "question": item["question"],
+            "sources": [self._source(doc) for doc in documents]
+        }
+
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                prompt = self.prompt.format(
+                    context="\n\n".join(doc.page_content for doc in documents),
+                    question=item["question"],
+                    chat_history=""
+                )
+                result["answer"] = await self.llm.ainvoke(prompt)
+            except Exception as e:
+                logger.error(f"❌ Error en la pregunta {item['id']} del lote: {e}")
+                result["error"] = str(e)
+            finished = time.perf_counter()
+
+        result["timings"] = {
+            "retrieval_ms": round(retrieval_ms, 1),
+            "queue_ms": round((started - queued) * 1000, 1),
+            "generation_ms": round((finished - started) * 1000, 1),
+            "total_ms": round(retrieval_ms + (finished - queued) * 1000, 1)
+        }
+        return result
+
+    @staticmethod
+    def _source(doc: Document) -> Dict[str, Any]:
+        return {
+            "doc_id": doc.metadata.get("doc_id"),
+            "filename": doc.metadata.get("filename", "Desconocido"),
+            "page": doc.metadata.get("page"),
+            "score": doc.metadata.get("rerank_score", doc.metadata.get("score"))
+        }
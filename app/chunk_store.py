@@ -0,0 +1,92 @@
+"""
+Almacén comprimido de texto de chunks
+Cada versión de documento se guarda en un segmento con sus chunks comprimidos
+individualmente; los vectores solo guardan (offset, longitud) dentro del segmento
+"""
+
+import os
+import zlib
+import shutil
+import logging
+from collections import defaultdict
+from typing import List, Tuple, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkStore:
+    """Almacén de texto direccionado por offsets"""
+
+    def __init__(self, root_dir: str, compression_level: int = 6):
+        self.root_dir = root_dir
+        self.compression_level = compression_level
+        os.makedirs(root_dir, exist_ok=True)
+
+    def segment_path(self, doc_id: str, version: int) -> str:
+        return os.path.join(self.root_dir, doc_id, f"v{version}.seg")
+
+    def write_segment(self, doc_id: str, version: int, texts: List[str]) -> List[Tuple[int, int]]:
+        """Escribir los chunks de una versión y devolver sus (offset, longitud)"""
+        path = self.segment_path(doc_id, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        locations = []
+        offset = 0
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for text in texts:
+                data = zlib.compress(text.encode("utf-8"), self.compression_level)
+                f.write(data)
+                locations.append((offset, len(data)))
+                offset += len(data)
+        os.replace(tmp_path, path)
+        return locations
+
+    def read_many(self, locations: List[Tuple[str, int, int, int]]) -> List[str]:
+        """Leer varios chunks (doc_id, version, offset, longitud) abriendo cada segmento una vez"""
+        by_segment: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+        for i, (doc_id, version, _, _) in enumerate(locations):
+            by_segment[(doc_id, version)].append(i)
+
+        texts = [""] * len(locations)
+        for (doc_id, version), positions in by_segment.items():
+            path = self.segment_path(doc_id, version)
+            try:
+                with open(path, "rb") as f:
+                    for i in sorted(positions, key=lambda p: locations[p][2]):
+                        _, _, offset, length = locations[i]
+                        f.seek(offset)
+                        texts[i] = zlib.decompress(f.read(length)).decode("utf-8")
+            except (OSError, zlib.error) as e:
+                logger.warning(f"⚠️ Segmento ilegible {path}: {e}")
+        return texts
+
+    def read_segment(self, doc_id: str, version: int) -> List[str]:
+        """Leer todos los chunks de una versión, en orden
+
+        Los chunks son flujos zlib consecutivos: cada uno termina donde empieza
+        el siguiente, así que no hacen falta los offsets.
+        """
+        with open(self.segment_path(doc_id, version), "rb") as f:
+            data = f.read()
+        texts = []
+        while data:
+            decompressor = zlib.decompressobj()
+            texts.append(decompressor.decompress(data).decode("utf-8"))
+            data = decompressor.unused_data
+        return texts
+
+    def delete_segment(self, doc_id: str, version: int):
+        path = self.segment_path(doc_id, version)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def delete_document(self, doc_id: str):
+        shutil.rmtree(os.path.join(self.root_dir, doc_id), ignore_errors=True)
+
+    def size_bytes(self) -> int:
+        """Tamaño total en disco del almacén"""
+        total = 0
+        for root, _, files in os.walk(self.root_dir):
+            total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return total
@@ -3,9 +3,10 @@ Procesador de documentos profesional para RAG - Versión simplificada
 Optimizado para coherencia y precisión
 """
 
+import io
 import os
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from pathlib import Path
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -17,6 +18,8 @@ from langchain_community.document_loaders import (
 from langchain.docstore.document import Document
 from langchain_community.vectorstores import Chroma
 
+from .extraction import MediaExtractor, IMAGE_EXTENSIONS, AUDIO_EXTENSIONS, MIN_TEXT_LAYER_CHARS
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,11 +27,14 @@ logger = logging.getLogger(__name__)
 class DocumentProcessor:
     """Procesador profesional de documentos para RAG"""
     
-    def __init__(self, llm, embeddings, chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(self, llm, embeddings, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 extractor: Optional[MediaExtractor] = None):
         self.llm = llm
         self.embeddings = embeddings
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        # Extractor de OCR/transcripción para imágenes, audio y PDFs escaneados
+        self.extractor = extractor
         
         # Splitter optimizado para diferentes tipos de contenido
         self.text_splitter = RecursiveCharacterTextSplitter(
@@ -51,25 +57,34 @@ class DocumentProcessor:
         extension = file_path_obj.suffix.lower()
         
         try:
-            if extension == '.pdf':
-                loader = PyPDFLoader(str(file_path))
-            elif extension == '.txt':
-                loader = TextLoader(str(file_path), encoding='utf-8')
-            elif extension in ['.docx', '.doc']:
-                loader = UnstructuredWordDocumentLoader(str(file_path))
+            if extension in IMAGE_EXTENSIONS + AUDIO_EXTENSIONS:
+                if self.extractor is None:
+                    logger.warning(f"Sin extractor de medios configurado: {extension}")
+                    return []
+                if extension in IMAGE_EXTENSIONS:
+                    documents = self.extractor.extract_image(str(file_path))
+                else:
+                    documents = self.extractor.extract_audio(str(file_path))
             else:
-                logger.warning(f"Tipo de archivo no soportado: {extension}")
-                return []
-            
-            documents = loader.load()
+                if extension == '.pdf':
+                    loader = PyPDFLoader(str(file_path))
+                elif extension == '.txt':
+                    loader = TextLoader(str(file_path), encoding='utf-8')
+                elif extension in ['.docx', '.doc']:
+                    loader = UnstructuredWordDocumentLoader(str(file_path))
+                else:
+                    logger.warning(f"Tipo de archivo no soportado: {extension}")
+                    return []
+                
+                documents = loader.load()
+                if extension == '.pdf':
+                    self._ocr_scanned_pages(str(file_path), documents)
             
-            # Agregar metadata enriquecida
+            # Metadata mínima: los datos por documento viven en el registro
             for doc in documents:
                 doc.metadata.update({
                     'filename': file_path_obj.name,
-                    'file_type': extension,
-                    'file_size': file_path_obj.stat().st_size,
-                    'source_path': str(file_path)
+                    'file_type': extension
                 })
             
             logger.info(f"✅ Cargado: {file_path_obj.name} ({len(documents)} páginas)")
@@ -79,6 +94,60 @@ class DocumentProcessor:
             logger.error(f"❌ Error cargando {file_path}: {str(e)}")
             return []
     
+    def _ocr_scanned_pages(self, file_path: str, documents: List[Document]):
+        """Completar con OCR las páginas de un PDF que no tienen capa de texto"""
+        if self.extractor is None:
+            return
+        
+        scanned = {
+            doc.metadata.get('page', i): doc
+            for i, doc in enumerate(documents)
+            if len(doc.page_content.strip()) < MIN_TEXT_LAYER_CHARS
+        }
+        if not scanned:
+            return
+        
+        texts = self.extractor.ocr_pdf_pages(file_path, sorted(scanned))
+        for page, text in texts.items():
+            scanned[page].page_content = text
+            scanned[page].metadata['extraction'] = 'ocr'
+    
+    def load_bytes(self, data: bytes, filename: str) -> List[Document]:
+        """Cargar un documento desde memoria (p. ej. un miembro de un zip) sin escribirlo a disco"""
+        extension = Path(filename).suffix.lower()
+        
+        try:
+            if extension == '.pdf':
+                from pypdf import PdfReader
+                reader = PdfReader(io.BytesIO(data))
+                documents = [
+                    Document(page_content=page.extract_text() or "", metadata={'page': i})
+                    for i, page in enumerate(reader.pages)
+                ]
+            elif extension == '.txt':
+                documents = [Document(page_content=data.decode('utf-8', errors='replace'), metadata={})]
+            elif extension == '.docx':
+                import docx
+                word_document = docx.Document(io.BytesIO(data))
+                text = "\n".join(paragraph.text for paragraph in word_document.paragraphs)
+                documents = [Document(page_content=text, metadata={})]
+            else:
+                logger.warning(f"Tipo de archivo no soportado en memoria: {extension}")
+                return []
+            
+            for doc in documents:
+                doc.metadata.update({
+                    'filename': filename,
+                    'file_type': extension
+                })
+            
+            logger.info(f"✅ Cargado: {filename} ({len(documents)} páginas)")
+            return documents
+            
+        except Exception as e:
+            logger.error(f"❌ Error cargando {filename}: {str(e)}")
+            return []
+    
     def load_directory(self, directory_path: str) -> List[Document]:
         """Cargar todos los documentos de un directorio"""
         documents = []
@@ -119,17 +188,41 @@ class DocumentProcessor:
         # Dividir en chunks
         chunks = self.text_splitter.split_documents(processed_docs)
         
-        # Enriquecer metadata de chunks
+        # Posición del chunk dentro del documento
         for i, chunk in enumerate(chunks):
-            chunk.metadata.update({
-                'chunk_id': i,
-                'chunk_size': len(chunk.page_content),
-                'content_preview': chunk.page_content[:100] + "..."
-            })
+            chunk.metadata['chunk_id'] = i
         
         logger.info(f"📝 Documentos procesados: {len(chunks)} chunks creados")
         return chunks
     
+    def summarize(self, texts: List[str], filename: str, max_chars: int = 6000) -> Optional[str]:
+        """Generar un resumen del documento a partir de una muestra de sus chunks
+
+        Se toman el inicio y chunks repartidos por todo el documento hasta
+        `max_chars`, para que el coste no dependa de su longitud.
+        """
+        if self.llm is None or not texts:
+            return None
+        
+        budget = max(1, max_chars // max(1, len(texts[0])))
+        step = max(1, len(texts) // budget)
+        sample = []
+        for text in texts[::step]:
+            if sum(len(part) for part in sample) + len(text) > max_chars and sample:
+                break
+            sample.append(text)
+        
+        prompt = f"""Resume en español el siguiente documento ({filename}) en un párrafo de 5 a 8 líneas.
+Indica de qué trata, su tipo (guía, protocolo, informe, artículo...) y los temas principales que cubre.
+
+Contenido:
+{chr(10).join(sample)}
+
+Resumen:"""
+        summary = self.llm.invoke(prompt).strip()
+        logger.info(f"🧾 Resumen generado para {filename} ({len(sample)} de {len(texts)} chunks)")
+        return summary or None
+    
     def _clean_text(self, text: str) -> str:
         """Limpiar y normalizar texto"""
         import re
@@ -0,0 +1,446 @@
+"""
+Registro de documentos indexados
+Guarda en SQLite el estado de cada documento y su historial de versiones
+"""
+
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    chunk_count INTEGER NOT NULL,
+    uploaded_at REAL NOT NULL,
+    indexed_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS document_versions (
+    doc_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    chunk_count INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    archived INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (doc_id, version)
+);
+
+CREATE TABLE IF NOT EXISTS document_tags (
+    doc_id TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (doc_id, tag)
+);
+
+CREATE TABLE IF NOT EXISTS document_summaries (
+    doc_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    summary TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO meta (key, value) VALUES ('index_generation', 0);
+
+-- Estadísticas del catálogo por tipo, mantenidas por triggers en cada alta,
+-- cambio o baja de documentos: /api/documents las lee sin recorrer DATA_DIR.
+-- (Sin OR IGNORE: dentro de un UPSERT prevalecería el conflicto de la sentencia externa)
+CREATE TABLE IF NOT EXISTS document_type_stats (
+    file_type TEXT PRIMARY KEY,
+    documents INTEGER NOT NULL DEFAULT 0,
+    total_size INTEGER NOT NULL DEFAULT 0,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    last_indexed_at REAL
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_documents_stats_insert AFTER INSERT ON documents BEGIN
+    INSERT INTO document_type_stats (file_type) SELECT NEW.file_type
+        WHERE NOT EXISTS (SELECT 1 FROM document_type_stats WHERE file_type = NEW.file_type);
+    UPDATE document_type_stats SET
+        documents = documents + 1,
+        total_size = total_size + NEW.file_size,
+        chunks = chunks + NEW.chunk_count,
+        last_indexed_at = MAX(COALESCE(last_indexed_at, 0), NEW.indexed_at)
+    WHERE file_type = NEW.file_type;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_documents_stats_update AFTER UPDATE ON documents BEGIN
+    UPDATE document_type_stats SET
+        documents = documents - 1,
+        total_size = total_size - OLD.file_size,
+        chunks = chunks - OLD.chunk_count
+    WHERE file_type = OLD.file_type;
+    INSERT INTO document_type_stats (file_type) SELECT NEW.file_type
+        WHERE NOT EXISTS (SELECT 1 FROM document_type_stats WHERE file_type = NEW.file_type);
+    UPDATE document_type_stats SET
+        documents = documents + 1,
+        total_size = total_size + NEW.file_size,
+        chunks = chunks + NEW.chunk_count,
+        last_indexed_at = MAX(COALESCE(last_indexed_at, 0), NEW.indexed_at)
+    WHERE file_type = NEW.file_type;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_documents_stats_delete AFTER DELETE ON documents BEGIN
+    UPDATE document_type_stats SET
+        documents = documents - 1,
+        total_size = total_size - OLD.file_size,
+        chunks = chunks - OLD.chunk_count
+    WHERE file_type = OLD.file_type;
+END;
+
+CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents(filename);
+CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(content_hash);
+CREATE INDEX IF NOT EXISTS idx_documents_type ON documents(file_type);
+CREATE INDEX IF NOT EXISTS idx_documents_uploaded ON documents(uploaded_at);
+CREATE INDEX IF NOT EXISTS idx_tags_tag ON document_tags(tag);
+"""
+
+
+class DocumentRegistry:
+    """Registro persistente de documentos y versiones"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Registros anteriores a las estadísticas: calcularlas una vez
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'catalog_stats'").fetchone() is None:
+                self._rebuild_stats(conn)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('catalog_stats', 1)")
+
+    @contextmanager
+    def _connect(self):
+        """Abrir una conexión serializada y confirmar al salir"""
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+    def generation(self) -> int:
+        """Generación del índice: cambia con cada ingesta, borrado o cambio de etiquetas"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'index_generation'").fetchone()
+        return row["value"]
+
+    def invalidate(self):
+        """Incrementar la generación sin cambiar documentos (p. ej. tras un mantenimiento)"""
+        with self._connect() as conn:
+            self._bump_generation(conn)
+
+    @staticmethod
+    def _bump_generation(conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'index_generation'")
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Obtener el registro activo de un documento"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_many(self, doc_ids) -> Dict[str, Dict[str, Any]]:
+        """Obtener varios documentos activos en una sola consulta"""
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return {}
+        placeholders = ",".join("?" * len(doc_ids))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM documents WHERE doc_id IN ({placeholders})", doc_ids
+            ).fetchall()
+        return {row["doc_id"]: dict(row) for row in rows}
+
+    def find_by_hash(self, content_hash: str) -> List[Dict[str, Any]]:
+        """Documentos activos con exactamente este contenido"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM documents WHERE content_hash = ?", (content_hash,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list_documents(self) -> List[Dict[str, Any]]:
+        """Listar todos los documentos activos"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM documents ORDER BY filename").fetchall()
+        return [dict(row) for row in rows]
+
+    def next_version(self, doc_id: str) -> int:
+        """Número de la siguiente versión de un documento"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT MAX(version) AS version FROM document_versions WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+        return (row["version"] or 0) + 1
+
+    def register(self, doc_id: str, filename: str, file_type: str, file_size: int,
+                 content_hash: str, version: int, chunk_count: int):
+        """Registrar una versión como la versión activa del documento"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO document_versions
+                   (doc_id, version, content_hash, file_size, chunk_count, created_at, archived)
+                   VALUES (?, ?, ?, ?, ?, COALESCE((SELECT created_at FROM document_versions
+                                                     WHERE doc_id = ? AND version = ?), ?), 0)""",
+                (doc_id, version, content_hash, file_size, chunk_count, doc_id, version, now)
+            )
+            conn.execute(
+                """INSERT INTO documents
+                   (doc_id, filename, file_type, file_size, content_hash, version, chunk_count, uploaded_at, indexed_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(doc_id) DO UPDATE SET
+                       filename = excluded.filename,
+                       file_type = excluded.file_type,
+                       file_size = excluded.file_size,
+                       content_hash = excluded.content_hash,
+                       version = excluded.version,
+                       chunk_count = excluded.chunk_count,
+                       indexed_at = excluded.indexed_at""",
+                (doc_id, filename, file_type, file_size, content_hash, version, chunk_count, now, now)
+            )
+            self._bump_generation(conn)
+
+    def mark_archived(self, doc_id: str, version: int):
+        """Marcar una versión como archivada (disponible para rollback)"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE document_versions SET archived = 1 WHERE doc_id = ? AND version = ?",
+                (doc_id, version)
+            )
+
+    def get_version(self, doc_id: str, version: int) -> Optional[Dict[str, Any]]:
+        """Obtener una versión concreta de un documento"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM document_versions WHERE doc_id = ? AND version = ?", (doc_id, version)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def versions(self, doc_id: str) -> List[Dict[str, Any]]:
+        """Historial de versiones de un documento (más reciente primero)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM document_versions WHERE doc_id = ? ORDER BY version DESC", (doc_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def version_keys(self) -> Set[Tuple[str, int]]:
+        """Pares (doc_id, versión) del historial de los documentos existentes"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT v.doc_id, v.version FROM document_versions v
+                   JOIN documents d ON d.doc_id = v.doc_id"""
+            ).fetchall()
+        return {(row["doc_id"], row["version"]) for row in rows}
+
+    def duplicate_groups(self) -> List[List[Dict[str, Any]]]:
+        """Documentos activos que comparten contenido (mismo hash) bajo nombres distintos"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT * FROM documents WHERE content_hash IN (
+                       SELECT content_hash FROM documents WHERE content_hash != ''
+                       GROUP BY content_hash HAVING COUNT(*) > 1
+                   ) ORDER BY content_hash, uploaded_at"""
+            ).fetchall()
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(row["content_hash"], []).append(dict(row))
+        return list(groups.values())
+
+    def drop_versions(self, doc_id: str, versions: List[int]):
+        """Eliminar versiones archivadas del historial"""
+        if not versions:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM document_versions WHERE doc_id = ? AND version = ?",
+                [(doc_id, version) for version in versions]
+            )
+
+    def delete(self, doc_id: str):
+        """Eliminar un documento y todo su historial"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM document_versions WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM document_tags WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM document_summaries WHERE doc_id = ?", (doc_id,))
+            self._bump_generation(conn)
+
+    def set_tags(self, doc_id: str, tags: List[str]):
+        """Reemplazar las etiquetas de un documento"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM document_tags WHERE doc_id = ?", (doc_id,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO document_tags (doc_id, tag) VALUES (?, ?)",
+                [(doc_id, tag) for tag in tags]
+            )
+            self._bump_generation(conn)
+
+    def get_tags(self, doc_id: str) -> List[str]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT tag FROM document_tags WHERE doc_id = ? ORDER BY tag", (doc_id,)
+            ).fetchall()
+        return [row["tag"] for row in rows]
+
+    def catalog_stats(self) -> Dict[str, Any]:
+        """Totales del catálogo por tipo de archivo (una fila por tipo, sin recorrer documentos)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM document_type_stats WHERE documents > 0 ORDER BY file_type"
+            ).fetchall()
+        types = {row["file_type"]: dict(row) for row in rows}
+        return {
+            "documents": sum(row["documents"] for row in types.values()),
+            "total_size": sum(row["total_size"] for row in types.values()),
+            "chunks": sum(row["chunks"] for row in types.values()),
+            "last_indexed_at": max((row["last_indexed_at"] or 0 for row in types.values()), default=None) or None,
+            "types": types
+        }
+
+    def rebuild_stats(self):
+        """Recalcular las estadísticas del catálogo desde la tabla de documentos"""
+        with self._connect() as conn:
+            self._rebuild_stats(conn)
+
+    @staticmethod
+    def _rebuild_stats(conn):
+        conn.execute("DELETE FROM document_type_stats")
+        conn.execute(
+            """INSERT INTO document_type_stats (file_type, documents, total_size, chunks, last_indexed_at)
+               SELECT file_type, COUNT(*), SUM(file_size), SUM(chunk_count), MAX(indexed_at)
+               FROM documents GROUP BY file_type"""
+        )
+
+    def page_documents(self, limit: int = 50, cursor: Optional[str] = None,
+                       file_type: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Página de documentos por nombre a partir de `cursor` (el último nombre de la página anterior)
+
+        Paginación por clave sobre el índice de `filename`: el coste no crece
+        con la posición de la página. Devuelve (documentos, siguiente cursor).
+        """
+        conditions, params = [], []
+        if cursor is not None:
+            conditions.append("filename > ?")
+            params.append(cursor)
+        if file_type:
+            file_type = file_type.lower()
+            conditions.append("file_type = ?")
+            params.append(file_type if file_type.startswith(".") else f".{file_type}")
+        where = " AND ".join(conditions) if conditions else "1 = 1"
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM documents WHERE {where} ORDER BY filename LIMIT ?", params + [limit + 1]
+            ).fetchall()
+        documents = [dict(row) for row in rows[:limit]]
+        next_cursor = documents[-1]["filename"] if len(rows) > limit else None
+        return documents, next_cursor
+
+    def document_count(self) -> int:
+        """Número de documentos, de las estadísticas del catálogo (una fila por tipo)"""
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(documents), 0) AS n FROM document_type_stats").fetchone()["n"]
+
+    def set_summary(self, doc_id: str, version: int, summary: str) -> bool:
+        """Guardar el resumen de una versión, solo si sigue siendo la activa"""
+        with self._connect() as conn:
+            current = conn.execute("SELECT version FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            if current is None or current["version"] != version:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO document_summaries (doc_id, version, summary, created_at) VALUES (?, ?, ?, ?)",
+                (doc_id, version, summary, time.time())
+            )
+            # La búsqueda en dos niveles depende de los resúmenes
+            self._bump_generation(conn)
+        return True
+
+    def get_summaries(self, doc_ids) -> Dict[str, str]:
+        """Resúmenes vigentes (de la versión activa) de varios documentos"""
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return {}
+        placeholders = ",".join("?" * len(doc_ids))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""SELECT s.doc_id, s.summary FROM document_summaries s
+                    JOIN documents d ON d.doc_id = s.doc_id AND d.version = s.version
+                    WHERE s.doc_id IN ({placeholders})""",
+                doc_ids
+            ).fetchall()
+        return {row["doc_id"]: row["summary"] for row in rows}
+
+    def missing_summaries(self) -> List[str]:
+        """Documentos sin resumen de su versión activa"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT d.doc_id FROM documents d
+                   LEFT JOIN document_summaries s ON s.doc_id = d.doc_id AND s.version = d.version
+                   WHERE s.doc_id IS NULL ORDER BY d.indexed_at"""
+            ).fetchall()
+        return [row["doc_id"] for row in rows]
+
+    def resolve_filters(self, filters: Dict[str, Any]) -> List[str]:
+        """Resolver filtros de metadata a la lista de doc_ids que los cumplen
+
+        Filtros soportados: `filename` (exacto o patrón con * y ?), `file_type`,
+        `date_from`/`date_to` (timestamps de carga) y `tags` (cualquiera de ellos).
+        Todas las condiciones usan índices secundarios del registro.
+        """
+        conditions, params = [], []
+
+        filename = filters.get("filename")
+        if filename:
+            if any(c in filename for c in "*?"):
+                conditions.append("d.filename GLOB ?")
+            else:
+                conditions.append("d.filename = ?")
+            params.append(filename)
+
+        if filters.get("file_type"):
+            file_type = filters["file_type"].lower()
+            conditions.append("d.file_type = ?")
+            params.append(file_type if file_type.startswith(".") else f".{file_type}")
+
+        if filters.get("date_from") is not None:
+            conditions.append("d.uploaded_at >= ?")
+            params.append(filters["date_from"])
+
+        if filters.get("date_to") is not None:
+            conditions.append("d.uploaded_at < ?")
+            params.append(filters["date_to"])
+
+        tags = filters.get("tags") or []
+        if tags:
+            placeholders = ",".join("?" * len(tags))
+            conditions.append(
+                f"d.doc_id IN (SELECT doc_id FROM document_tags WHERE tag IN ({placeholders}))"
+            )
+            params.extend(tags)
+
+        where = " AND ".join(conditions) if conditions else "1 = 1"
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT d.doc_id FROM documents d WHERE {where}", params).fetchall()
+        return [row["doc_id"] for row in rows]
@@ -0,0 +1,240 @@
+"""
+Extracción de texto de imágenes, PDFs escaneados y audio
+OCR con Tesseract y transcripción con Whisper en pools de procesos dedicados,
+con caché de resultados por hash de contenido y configuración de extracción
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional
+
+from langchain.docstore.document import Document
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.tif']
+AUDIO_EXTENSIONS = ['.mp3', '.wav', '.m4a', '.aac', '.ogg', '.flac', '.mp4', '.avi', '.mov', '.mkv', '.wmv']
+
+# Una página con menos texto que esto se considera escaneada
+MIN_TEXT_LAYER_CHARS = 20
+
+# ----------------------------------------------------------------------
+# Funciones ejecutadas en los procesos de trabajo
+# ----------------------------------------------------------------------
+
+_whisper_model = None
+
+
+def _ocr_image(path: str, lang: str) -> str:
+    import pytesseract
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return pytesseract.image_to_string(image, lang=lang)
+
+
+def _ocr_pdf_page(path: str, page: int, lang: str, dpi: int) -> str:
+    import pytesseract
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(path, dpi=dpi, first_page=page + 1, last_page=page + 1)
+    return "\n".join(pytesseract.image_to_string(image, lang=lang) for image in images)
+
+
+def _transcribe(path: str, model_name: str, language: str) -> str:
+    global _whisper_model
+    import whisper
+
+    # El modelo se carga una vez por proceso de trabajo
+    if _whisper_model is None:
+        _whisper_model = whisper.load_model(model_name, device="cpu")
+    result = _whisper_model.transcribe(path, language=language, fp16=False)
+    return result.get("text", "")
+
+
+def extractor_from_env(data_dir: str, workers: Optional[int] = None) -> Optional["MediaExtractor"]:
+    """Crear el extractor según ENABLE_OCR / ENABLE_WHISPER y el resto de variables de entorno"""
+    enable_ocr = os.getenv("ENABLE_OCR", "true").lower() == "true"
+    enable_whisper = os.getenv("ENABLE_WHISPER", "true").lower() == "true"
+    if not enable_ocr and not enable_whisper:
+        return None
+    return MediaExtractor(
+        cache_dir=os.getenv("EXTRACTION_CACHE_DIR", os.path.join(data_dir, ".cache", "extraction")),
+        workers=int(os.getenv("EXTRACTION_WORKERS", "2")) if workers is None else workers,
+        ocr_lang=os.getenv("OCR_LANG", "spa+eng"),
+        whisper_model=os.getenv("WHISPER_MODEL", "base"),
+        enable_ocr=enable_ocr,
+        enable_whisper=enable_whisper
+    )
+
+
+class MediaExtractor:
+    """Extractor de texto para medios sin capa de texto"""
+
+    def __init__(self, cache_dir: str, workers: int = 2, ocr_lang: str = "spa+eng",
+                 whisper_model: str = "base", whisper_language: str = "es",
+                 enable_ocr: bool = True, enable_whisper: bool = True, dpi: int = 300):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.ocr_lang = ocr_lang
+        self.whisper_model = whisper_model
+        self.whisper_language = whisper_language
+        self.enable_ocr = enable_ocr
+        self.enable_whisper = enable_whisper
+        self.dpi = dpi
+
+        self._ocr_pool: Optional[ProcessPoolExecutor] = None
+        self._audio_pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self.stats = {"cache_hits": 0, "ocr_pages": 0, "transcriptions": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    def extract_image(self, path: str) -> List[Document]:
+        """OCR de una imagen"""
+        if not self.enable_ocr:
+            logger.warning(f"OCR deshabilitado, se omite {os.path.basename(path)}")
+            return []
+
+        content_hash = self._hash(path)
+        text = self._cached(content_hash, self._ocr_key())
+        if text is None:
+            text = self._run(self._get_ocr_pool(), _ocr_image, path, self.ocr_lang)
+            self.stats["ocr_pages"] += 1
+            self._store(content_hash, self._ocr_key(), text)
+        return [Document(page_content=text, metadata={'page': 0, 'extraction': 'ocr'})]
+
+    def extract_audio(self, path: str) -> List[Document]:
+        """Transcripción de un archivo de audio o video"""
+        if not self.enable_whisper:
+            logger.warning(f"Transcripción deshabilitada, se omite {os.path.basename(path)}")
+            return []
+
+        content_hash = self._hash(path)
+        text = self._cached(content_hash, self._whisper_key())
+        if text is None:
+            text = self._run(self._get_audio_pool(), _transcribe, path, self.whisper_model, self.whisper_language)
+            self.stats["transcriptions"] += 1
+            self._store(content_hash, self._whisper_key(), text)
+        return [Document(page_content=text, metadata={'page': 0, 'extraction': 'whisper'})]
+
+    def ocr_pdf_pages(self, path: str, pages: List[int]) -> Dict[int, str]:
+        """OCR en paralelo de páginas de un PDF sin capa de texto"""
+        if not self.enable_ocr or not pages:
+            return {}
+
+        content_hash = self._hash(path)
+        results, pending = {}, []
+        for page in pages:
+            text = self._cached(content_hash, self._ocr_key(page))
+            if text is None:
+                pending.append(page)
+            else:
+                results[page] = text
+
+        if pending:
+            pool = self._get_ocr_pool()
+            if pool is None:
+                texts = [_ocr_pdf_page(path, page, self.ocr_lang, self.dpi) for page in pending]
+            else:
+                futures = [pool.submit(_ocr_pdf_page, path, page, self.ocr_lang, self.dpi) for page in pending]
+                texts = [future.result() for future in futures]
+            for page, text in zip(pending, texts):
+                self._store(content_hash, self._ocr_key(page), text)
+                results[page] = text
+            self.stats["ocr_pages"] += len(pending)
+            logger.info(f"🔎 OCR de {len(pending)} páginas escaneadas en {os.path.basename(path)}")
+
+        return results
+
+    def shutdown(self):
+        for pool in (self._ocr_pool, self._audio_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+
+    def _get_ocr_pool(self) -> Optional[ProcessPoolExecutor]:
+        """Pool de OCR; con workers=0 se ejecuta en el proceso actual"""
+        if self.workers <= 0:
+            return None
+        with self._pool_lock:
+            if self._ocr_pool is None:
+                self._ocr_pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._ocr_pool
+
+    def _get_audio_pool(self) -> Optional[ProcessPoolExecutor]:
+        """Pool de transcripción de un solo proceso: el modelo Whisper es pesado"""
+        if self.workers <= 0:
+            return None
+        with self._pool_lock:
+            if self._audio_pool is None:
+                self._audio_pool = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+            return self._audio_pool
+
+    @staticmethod
+    def _run(pool: Optional[ProcessPoolExecutor], func, *args) -> str:
+        if pool is None:
+            return func(*args)
+        return pool.submit(func, *args).result()
+
+    @staticmethod
+    def _hash(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _ocr_key(self, page: Optional[int] = None) -> str:
+        """Clave de caché del OCR: cambia con el idioma y, en PDFs, con la resolución"""
+        if page is None:
+            return f"ocr:{self.ocr_lang}"
+        return f"ocr-p{page}:{self.ocr_lang}:{self.dpi}dpi"
+
+    def _whisper_key(self) -> str:
+        """Clave de caché de la transcripción: cambia con el modelo y el idioma"""
+        return f"whisper:{self.whisper_model}:{self.whisper_language or 'auto'}"
+
+    def _cache_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, content_hash[:2], f"{content_hash}.json")
+
+    def _load_entry(self, content_hash: str) -> Dict[str, str]:
+        path = self._cache_path(content_hash)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _cached(self, content_hash: str, key: str) -> Optional[str]:
+        text = self._load_entry(content_hash).get(key)
+        if text is not None:
+            self.stats["cache_hits"] += 1
+        return text
+
+    def _store(self, content_hash: str, key: str, text: str):
+        with self._cache_lock:
+            entry = self._load_entry(content_hash)
+            entry[key] = text
+            path = self._cache_path(content_hash)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
@@ -0,0 +1,624 @@
+"""
+Base de conocimiento con documentos direccionables
+Cada documento tiene un ID estable y sus chunks se indexan con IDs deterministas,
+lo que permite eliminar, reemplazar y restaurar versiones sin reconstruir el índice.
+
+Los datos por documento viven solo en el registro; cada chunk guarda en Chroma
+únicamente su vector y (doc_id, página, offset, longitud). El texto se lee del
+almacén comprimido solo para los resultados finales.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import Chroma
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+from .chunk_store import ChunkStore
+from .document_processor import DocumentProcessor
+from .document_registry import DocumentRegistry
+from .extraction import IMAGE_EXTENSIONS, AUDIO_EXTENSIONS
+from .summaries import SummaryIndex
+from .vector_filter import query_documents
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ['.pdf', '.txt', '.docx', '.doc'] + IMAGE_EXTENSIONS + AUDIO_EXTENSIONS
+
+
+def document_id(filename: str) -> str:
+    """ID estable de un documento a partir de su nombre de archivo"""
+    return hashlib.sha1(filename.encode("utf-8")).hexdigest()[:16]
+
+
+def file_hash(file_path: str) -> str:
+    """Hash SHA-256 del contenido de un archivo"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def collection_for_model(model: str) -> str:
+    """Nombre de la colección Chroma asociada a un modelo de embeddings"""
+    return f"docs_{model.replace(':', '_')}"
+
+
+def parse_chunk_id(chunk_id: str) -> Tuple[str, int, int]:
+    """Descomponer un ID `{doc_id}:v{version}:{n}`"""
+    doc_id, version, index = chunk_id.split(":")
+    return doc_id, int(version[1:]), int(index)
+
+
+def prepare_document(filename: str, content_hash: str, file_size: int,
+                     chunks: List[Document], source_path: Optional[str] = None) -> Dict[str, Any]:
+    """Documento listo para embeddings: solo datos serializables entre procesos"""
+    return {
+        "doc_id": document_id(filename),
+        "filename": filename,
+        "content_hash": content_hash,
+        "file_size": file_size,
+        "source_path": source_path,
+        "texts": [chunk.page_content for chunk in chunks],
+        "pages": [int(chunk.metadata.get('page', 0)) for chunk in chunks]
+    }
+
+
+class KnowledgeBase:
+    """Gestión de documentos indexados con versionado y borrado selectivo"""
+
+    def __init__(self, vectorstore: Chroma, processor: DocumentProcessor,
+                 data_dir: str, vector_dir: str, max_versions: int = 5,
+                 summaries: bool = False, summary_max_chars: int = 6000, summary_backfill_interval: float = 60):
+        self.vectorstore = vectorstore
+        self.embeddings = vectorstore.embeddings
+        self.processor = processor
+        self.data_dir = data_dir
+        self.vector_dir = vector_dir
+        self.max_versions = max_versions
+
+        self.registry = DocumentRegistry(os.path.join(vector_dir, "registry.sqlite3"))
+        self.chunk_store = ChunkStore(os.path.join(vector_dir, "chunks"))
+        self.versions_dir = os.path.join(vector_dir, "versions")
+        self.staging_dir = os.path.join(data_dir, ".incoming")
+        os.makedirs(self.versions_dir, exist_ok=True)
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+        # Serializa las escrituras sobre el índice y el registro
+        self._lock = threading.RLock()
+
+        # Resúmenes por documento en una colección aparte (búsqueda en dos niveles)
+        self.summaries: Optional[SummaryIndex] = None
+        if summaries:
+            self.summaries = SummaryIndex(
+                vectorstore._client.get_or_create_collection(f"{vectorstore._collection.name}_summaries"),
+                self.registry, self.chunk_store, processor, self.embeddings, summary_max_chars,
+                backfill_interval=summary_backfill_interval
+            )
+
+    # ------------------------------------------------------------------
+    # Ingesta
+    # ------------------------------------------------------------------
+
+    def is_indexed(self, file_path: str, filename: Optional[str] = None) -> bool:
+        """Comprobar sin leer el archivo si ya está indexado tal cual
+
+        Compara tamaño y fecha de modificación con el registro: si el tamaño
+        coincide y el archivo no se modificó después de indexarlo, no hace
+        falta calcular su hash.
+        """
+        current = self.registry.get(document_id(filename or os.path.basename(file_path)))
+        if not current:
+            return False
+        stat = os.stat(file_path)
+        return stat.st_size == current["file_size"] and stat.st_mtime <= current["indexed_at"]
+
+    def ingest(self, source_path: str, filename: Optional[str] = None,
+               tags: Optional[List[str]] = None, content_hash: Optional[str] = None) -> Dict[str, Any]:
+        """Indexar un archivo como nueva versión de su documento
+
+        `source_path` puede ser un archivo temporal; al indexarlo se mueve a DATA_DIR.
+        Si el contenido no cambió respecto a la versión activa, o ya está indexado
+        bajo otro nombre, no se parsea ni se calculan embeddings.
+        Las etiquetas, si se indican, reemplazan a las existentes.
+        `content_hash` evita volver a leer el archivo si ya se calculó al recibirlo.
+        Si la ingesta falla, el archivo temporal se elimina.
+        """
+        try:
+            return self._ingest(source_path, filename, tags, content_hash)
+        except BaseException:
+            self._discard_staged(source_path)
+            raise
+
+    def _ingest(self, source_path: str, filename: Optional[str], tags: Optional[List[str]],
+                content_hash: Optional[str]) -> Dict[str, Any]:
+        filename = filename or os.path.basename(source_path)
+        doc_id = document_id(filename)
+        content_hash = content_hash or file_hash(source_path)
+
+        current = self.registry.get(doc_id)
+        if current and current["content_hash"] == content_hash:
+            self._discard_staged(source_path)
+            if tags is not None:
+                self.registry.set_tags(doc_id, tags)
+            return self._result(current, "unchanged", "Sin cambios: el documento ya está indexado")
+
+        duplicate = self.find_duplicate(doc_id, filename, content_hash)
+        if duplicate:
+            self._discard_staged(source_path)
+            return duplicate
+
+        # Parseo y embeddings ocurren fuera del lock; solo la escritura se serializa
+        chunks = self.processor.process_documents(self.processor.load_document(source_path))
+        if not chunks:
+            self._discard_staged(source_path)
+            return self._error(doc_id, filename, "No se pudieron crear fragmentos del documento")
+
+        prepared = prepare_document(filename, content_hash, os.path.getsize(source_path), chunks, source_path)
+        self.embed(prepared)
+        return self.commit(prepared, tags)
+
+    def find_duplicate(self, doc_id: str, filename: str, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Resultado `duplicate` si el contenido ya está indexado bajo otro documento"""
+        duplicates = [doc for doc in self.registry.find_by_hash(content_hash) if doc["doc_id"] != doc_id]
+        if not duplicates:
+            return None
+        return {
+            "doc_id": doc_id,
+            "filename": filename,
+            "status": "duplicate",
+            "duplicate_of": duplicates[0]["doc_id"],
+            "message": f"Contenido idéntico a {duplicates[0]['filename']}, no se indexó de nuevo"
+        }
+
+    def embed(self, prepared: Dict[str, Any], batch_size: int = 64) -> Dict[str, Any]:
+        """Calcular los embeddings de un documento preparado, por lotes"""
+        texts = prepared["texts"]
+        vectors = []
+        for i in range(0, len(texts), batch_size):
+            vectors.extend(self.embeddings.embed_documents(texts[i:i + batch_size]))
+        prepared["vectors"] = vectors
+        return prepared
+
+    def commit(self, prepared: Dict[str, Any], tags: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Escribir un documento preparado y con embeddings como su nueva versión activa
+
+        Si `source_path` es None (p. ej. un miembro de un zip) no se copia ningún archivo.
+        El contenido ya indexado bajo otro documento se vuelve a comprobar aquí,
+        bajo el lock, para que dos ingestas concurrentes no lo dupliquen.
+        """
+        doc_id, filename = prepared["doc_id"], prepared["filename"]
+        source_path = prepared["source_path"]
+        target_path = os.path.join(self.data_dir, filename)
+        texts = prepared["texts"]
+
+        with self._lock:
+            duplicate = self.find_duplicate(doc_id, filename, prepared["content_hash"])
+            if duplicate:
+                if source_path is not None:
+                    self._discard_staged(source_path)
+                return duplicate
+
+            current = self.registry.get(doc_id)
+            version = self.registry.next_version(doc_id)
+
+            staged = source_path is not None and os.path.abspath(source_path) != os.path.abspath(target_path)
+            if current:
+                # Si el archivo ya fue sobrescrito en DATA_DIR solo se archivan sus vectores
+                self._archive_version(current, keep_file=staged)
+                self._delete_vectors(doc_id, current["version"], current["chunk_count"])
+            else:
+                # Restos de una ingesta interrumpida o vectores heredados sin ID
+                self._delete_unregistered_vectors(doc_id, filename)
+
+            if staged:
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                if self._in_staging(source_path):
+                    shutil.move(source_path, target_path)
+                else:
+                    shutil.copy2(source_path, target_path)
+
+            locations = self.chunk_store.write_segment(doc_id, version, texts)
+            self.vectorstore._collection.upsert(
+                ids=self._chunk_ids(doc_id, version, len(texts)),
+                embeddings=prepared["vectors"],
+                metadatas=[
+                    {
+                        'doc_id': doc_id,
+                        'page': page,
+                        'offset': offset,
+                        'length': length
+                    }
+                    for page, (offset, length) in zip(prepared["pages"], locations)
+                ]
+            )
+            self.registry.register(
+                doc_id=doc_id,
+                filename=filename,
+                file_type=Path(filename).suffix.lower(),
+                file_size=prepared["file_size"],
+                content_hash=prepared["content_hash"],
+                version=version,
+                chunk_count=len(texts)
+            )
+            if tags is not None:
+                self.registry.set_tags(doc_id, tags)
+            self._prune_versions(doc_id)
+
+        if self.summaries:
+            self.summaries.schedule(doc_id)
+        logger.info(f"✅ Indexado: {filename} v{version} -> {len(texts)} chunks")
+        return self._result(self.registry.get(doc_id), "success",
+                            f"Procesado exitosamente: {len(texts)} fragmentos creados (v{version})")
+
+    def replace(self, doc_id: str, source_path: str, content_hash: Optional[str] = None) -> Dict[str, Any]:
+        """Reemplazar el contenido de un documento existente"""
+        current = self.registry.get(doc_id)
+        if not current:
+            raise KeyError(doc_id)
+        return self.ingest(source_path, current["filename"], content_hash=content_hash)
+
+    def delete(self, doc_id: str) -> Dict[str, Any]:
+        """Eliminar un documento: sus vectores, su archivo y su historial"""
+        with self._lock:
+            current = self.registry.get(doc_id)
+            if not current:
+                raise KeyError(doc_id)
+
+            removed = self._delete_vectors(doc_id, current["version"], current["chunk_count"])
+
+            file_path = os.path.join(self.data_dir, current["filename"])
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+            shutil.rmtree(os.path.join(self.versions_dir, doc_id), ignore_errors=True)
+            self.chunk_store.delete_document(doc_id)
+            self.registry.delete(doc_id)
+            if self.summaries:
+                self.summaries.delete(doc_id)
+
+        logger.info(f"🗑️ Documento eliminado: {current['filename']} ({removed} chunks)")
+        return {"doc_id": doc_id, "filename": current["filename"], "chunks_removed": removed}
+
+    def rollback(self, doc_id: str, version: int) -> Dict[str, Any]:
+        """Restaurar una versión archivada sin volver a calcular embeddings"""
+        with self._lock:
+            current = self.registry.get(doc_id)
+            if not current:
+                raise KeyError(doc_id)
+            if current["version"] == version:
+                return self._result(current, "unchanged", f"La versión v{version} ya está activa")
+
+            target = self.registry.get_version(doc_id, version)
+            snapshot_dir = os.path.join(self.versions_dir, doc_id)
+            snapshot_file = os.path.join(snapshot_dir, f"v{version}.json")
+            if not target or not target["archived"] or not os.path.exists(snapshot_file):
+                raise ValueError(f"La versión v{version} no está disponible para restaurar")
+
+            with open(snapshot_file, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if not snapshot["file"]:
+                raise ValueError(f"El archivo original de la versión v{version} no se conservó")
+            embeddings = np.load(os.path.join(snapshot_dir, f"v{version}.npy"))
+
+            self._archive_version(current)
+            self._delete_vectors(doc_id, current["version"], current["chunk_count"])
+
+            if snapshot["ids"]:
+                self.vectorstore._collection.upsert(
+                    ids=snapshot["ids"],
+                    embeddings=embeddings.tolist(),
+                    metadatas=snapshot["metadatas"]
+                )
+            shutil.copyfile(
+                os.path.join(snapshot_dir, snapshot["file"]),
+                os.path.join(self.data_dir, current["filename"])
+            )
+
+            self.registry.register(
+                doc_id=doc_id,
+                filename=current["filename"],
+                file_type=current["file_type"],
+                file_size=target["file_size"],
+                content_hash=target["content_hash"],
+                version=version,
+                chunk_count=target["chunk_count"]
+            )
+
+        if self.summaries:
+            self.summaries.schedule(doc_id)
+        logger.info(f"⏪ Rollback: {current['filename']} v{current['version']} -> v{version}")
+        return self._result(self.registry.get(doc_id), "success", f"Restaurada la versión v{version}")
+
+    def versions(self, doc_id: str) -> List[Dict[str, Any]]:
+        """Historial de versiones de un documento"""
+        if not self.registry.get(doc_id):
+            raise KeyError(doc_id)
+        return self.registry.versions(doc_id)
+
+    def search(self, query: str, k: int = 5, fetch_k: int = 10,
+               lambda_mult: Optional[float] = 0.7,
+               filters: Optional[Dict[str, Any]] = None,
+               max_documents: Optional[int] = None) -> List[Document]:
+        """Búsqueda semántica con MMR; el texto se lee solo para los k finales
+
+        Los filtros se resuelven en el registro y se aplican como pre-filtro
+        de la búsqueda vectorial, de modo que solo se exploran esos documentos.
+        Con `max_documents` y el índice de resúmenes activo, la búsqueda se
+        limita a los documentos cuyo resumen es más cercano a la consulta.
+        """
+        doc_ids = self._filter_documents(filters)
+        if doc_ids is not None and not doc_ids:
+            return []
+
+        query_embedding = self.embeddings.embed_query(query)
+        if max_documents:
+            doc_ids = self._narrow_to_documents(query_embedding, doc_ids, max_documents)
+
+        try:
+            results = self._query([query_embedding], fetch_k, doc_ids)
+        except Exception as e:
+            logger.warning(f"⚠️ Búsqueda vectorial fallida: {e}")
+            return []
+
+        return self.hydrate(self._select(query_embedding, results, 0, k, lambda_mult))
+
+    def search_many(self, queries: List[str], k: int = 5, fetch_k: int = 10,
+                    lambda_mult: Optional[float] = 0.7,
+                    filters: Optional[List[Optional[Dict[str, Any]]]] = None,
+                    query_embeddings: Optional[List[List[float]]] = None) -> List[List[Document]]:
+        """Búsqueda de varias consultas a la vez
+
+        Las consultas se embeben en una sola llamada (salvo que se pasen
+        `query_embeddings`) y las que comparten filtros se resuelven en una
+        única consulta a Chroma. Devuelve una lista de documentos por consulta.
+        """
+        if query_embeddings is None:
+            query_embeddings = self.embeddings.embed_documents(queries) if queries else []
+        filters = filters or [None] * len(queries)
+
+        groups: Dict[str, List[int]] = {}
+        for i, query_filters in enumerate(filters):
+            groups.setdefault(json.dumps(query_filters or {}, sort_keys=True), []).append(i)
+
+        results_by_query: List[List[Document]] = [[] for _ in queries]
+        for indexes in groups.values():
+            doc_ids = self._filter_documents(filters[indexes[0]])
+            if doc_ids is not None and not doc_ids:
+                continue
+            try:
+                results = self._query([query_embeddings[i] for i in indexes], fetch_k, doc_ids)
+            except Exception as e:
+                logger.warning(f"⚠️ Búsqueda vectorial fallida: {e}")
+                continue
+            for position, i in enumerate(indexes):
+                hits = self._select(query_embeddings[i], results, position, k, lambda_mult)
+                results_by_query[i] = self.hydrate(hits)
+
+        return results_by_query
+
+    def search_summaries(self, query: str, k: int = 5,
+                         filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Resúmenes de los documentos más cercanos a la consulta"""
+        if not self.summaries:
+            return []
+        doc_ids = self._filter_documents(filters)
+        if doc_ids is not None and not doc_ids:
+            return []
+
+        top = self.summaries.top_documents(self.embeddings.embed_query(query), k, doc_ids)
+        summaries = self.registry.get_summaries(hit["doc_id"] for hit in top)
+        records = self.registry.get_many(summaries.keys())
+
+        documents = []
+        for hit in top:
+            record = records.get(hit["doc_id"])
+            if record is None or hit["doc_id"] not in summaries:
+                continue
+            documents.append(Document(
+                page_content=f"Resumen de {record['filename']}: {summaries[hit['doc_id']]}",
+                metadata={
+                    'doc_id': hit["doc_id"],
+                    'filename': record['filename'],
+                    'file_type': record['file_type'],
+                    'uploaded_at': record['uploaded_at'],
+                    'level': 'summary',
+                    'score': hit["distance"]
+                }
+            ))
+        return documents
+
+    def hydrate(self, hits: List[Tuple[str, Dict[str, Any], float]]) -> List[Document]:
+        """Convertir resultados (id, metadata, distancia) en documentos con texto"""
+        # Chunks heredados sin dirección en el almacén no se pueden hidratar
+        hits = [hit for hit in hits if 'offset' in hit[1]]
+
+        locations = []
+        for chunk_id, metadata, _ in hits:
+            doc_id, version, _ = parse_chunk_id(chunk_id)
+            locations.append((doc_id, version, metadata['offset'], metadata['length']))
+        texts = self.chunk_store.read_many(locations)
+        records = self.registry.get_many({metadata['doc_id'] for _, metadata, _ in hits})
+
+        documents = []
+        for (chunk_id, metadata, distance), text in zip(hits, texts):
+            record = records.get(metadata['doc_id'])
+            if not record or not text:
+                continue
+            documents.append(Document(
+                page_content=text,
+                metadata={
+                    'doc_id': metadata['doc_id'],
+                    'chunk_id': chunk_id,
+                    'filename': record['filename'],
+                    'file_type': record['file_type'],
+                    'uploaded_at': record['uploaded_at'],
+                    'page': metadata['page'],
+                    'offset': metadata['offset'],
+                    'length': metadata['length'],
+                    'score': distance
+                }
+            ))
+        return documents
+
+    def staging_path(self, filename: str) -> str:
+        """Ruta temporal para recibir un archivo antes de indexarlo"""
+        return os.path.join(self.staging_dir, f"{os.urandom(8).hex()}_{filename}")
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+
+    def _filter_documents(self, filters: Optional[Dict[str, Any]]) -> Optional[set]:
+        """doc_ids que cumplen unos filtros (None: todos; vacío si ninguno los cumple)"""
+        if not filters:
+            return None
+        return set(self.registry.resolve_filters(filters))
+
+    def _query(self, query_embeddings: List[List[float]], n_results: int,
+               doc_ids: Optional[set]) -> Dict[str, Any]:
+        """Consulta vectorial limitada a `doc_ids`, con la misma forma de resultado que Chroma"""
+        return query_documents(
+            self.vectorstore._collection, query_embeddings, n_results, doc_ids,
+            include=["metadatas", "distances", "embeddings"]
+        )
+
+    def _narrow_to_documents(self, query_embedding: List[float], allowed: Optional[set],
+                             max_documents: int) -> Optional[set]:
+        """Primer nivel: restringir la búsqueda a los documentos con resumen más cercano
+
+        Los documentos cuyo resumen aún no existe se incluyen siempre; si son
+        demasiados, o el corpus es pequeño, se busca sobre todo el índice. Ni
+        el total (estadísticas del catálogo) ni los pendientes (en memoria)
+        recorren el registro.
+        """
+        if not self.summaries:
+            return allowed
+        if allowed is not None and len(allowed) <= max_documents:
+            return allowed
+        if self.summaries.pending_count() > max_documents and allowed is None:
+            return allowed
+        if self.registry.document_count() <= max_documents:
+            return allowed
+
+        pending = self.summaries.pending(allowed)
+        if len(pending) > max_documents:
+            return allowed
+
+        top = self.summaries.top_documents(query_embedding, max_documents, allowed)
+        doc_ids = {hit["doc_id"] for hit in top} | pending
+        return doc_ids or allowed
+
+    @staticmethod
+    def _select(query_embedding: List[float], results: Dict[str, Any], position: int,
+                k: int, lambda_mult: Optional[float]) -> List[Tuple[str, Dict[str, Any], float]]:
+        """Elegir con MMR los k resultados de la consulta `position` de una respuesta de Chroma"""
+        ids = results["ids"][position]
+        if not ids:
+            return []
+        metadatas = results["metadatas"][position]
+        distances = results["distances"][position]
+
+        if lambda_mult is not None and len(ids) > k:
+            selected = maximal_marginal_relevance(
+                np.array(query_embedding, dtype=np.float32),
+                results["embeddings"][position],
+                k=k,
+                lambda_mult=lambda_mult
+            )
+        else:
+            selected = range(min(k, len(ids)))
+
+        return [(ids[i], metadatas[i], distances[i]) for i in selected]
+
+    @staticmethod
+    def _chunk_ids(doc_id: str, version: int, count: int) -> List[str]:
+        return [f"{doc_id}:v{version}:{i}" for i in range(count)]
+
+    def _delete_vectors(self, doc_id: str, version: int, count: int) -> int:
+        ids = self._chunk_ids(doc_id, version, count)
+        if ids:
+            self.vectorstore.delete(ids=ids)
+        return len(ids)
+
+    def _delete_unregistered_vectors(self, doc_id: str, filename: str):
+        for where in ({"doc_id": doc_id}, {"filename": filename}):
+            try:
+                self.vectorstore._collection.delete(where=where)
+            except Exception as e:
+                logger.warning(f"No se pudieron limpiar vectores previos de {filename}: {e}")
+
+    def _archive_version(self, record: Dict[str, Any], keep_file: bool = True):
+        """Guardar vectores y archivo de la versión activa para un rollback barato"""
+        doc_id, version = record["doc_id"], record["version"]
+        snapshot_dir = os.path.join(self.versions_dir, doc_id)
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+        ids = self._chunk_ids(doc_id, version, record["chunk_count"])
+        stored = self.vectorstore.get(ids=ids, include=["embeddings", "metadatas"])
+
+        # Chroma no garantiza el orden de los resultados
+        order = {chunk_id: i for i, chunk_id in enumerate(stored["ids"])}
+        found = [chunk_id for chunk_id in ids if chunk_id in order]
+        embeddings = [stored["embeddings"][order[chunk_id]] for chunk_id in found]
+
+        file_copy = None
+        file_path = os.path.join(self.data_dir, record["filename"])
+        if keep_file and os.path.exists(file_path):
+            file_copy = f"v{version}{Path(record['filename']).suffix.lower()}"
+            shutil.copyfile(file_path, os.path.join(snapshot_dir, file_copy))
+
+        np.save(os.path.join(snapshot_dir, f"v{version}.npy"), np.asarray(embeddings, dtype=np.float32))
+        with open(os.path.join(snapshot_dir, f"v{version}.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "ids": found,
+                "metadatas": [stored["metadatas"][order[chunk_id]] for chunk_id in found],
+                "file": file_copy
+            }, f, ensure_ascii=False)
+
+        self.registry.mark_archived(doc_id, version)
+
+    def _prune_versions(self, doc_id: str):
+        """Conservar solo las `max_versions` versiones archivadas más recientes"""
+        archived = [v["version"] for v in self.registry.versions(doc_id) if v["archived"]]
+        expired = archived[self.max_versions:]
+
+        snapshot_dir = os.path.join(self.versions_dir, doc_id)
+        for version in expired:
+            self.chunk_store.delete_segment(doc_id, version)
+            for name in os.listdir(snapshot_dir) if os.path.isdir(snapshot_dir) else []:
+                if Path(name).stem == f"v{version}":
+                    os.remove(os.path.join(snapshot_dir, name))
+        self.registry.drop_versions(doc_id, expired)
+
+    def _in_staging(self, path: str) -> bool:
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.staging_dir)
+
+    def _discard_staged(self, source_path: str):
+        """Eliminar un archivo temporal descartado (nunca un archivo del usuario)"""
+        if self._in_staging(source_path) and os.path.exists(source_path):
+            os.remove(source_path)
+
+    @staticmethod
+    def _error(doc_id: str, filename: str, message: str) -> Dict[str, Any]:
+        return {"doc_id": doc_id, "filename": filename, "status": "error", "message": message}
+
+    @staticmethod
+    def _result(record: Dict[str, Any], status: str, message: str) -> Dict[str, Any]:
+        return {
+            "doc_id": record["doc_id"],
+            "filename": record["filename"],
+            "version": record["version"],
+            "chunks": record["chunk_count"],
+            "status": status,
+            "message": message
+        }
@@ -1,19 +1,37 @@
 import os
-from fastapi import FastAPI, Request, UploadFile, File, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Request, Response, BackgroundTasks, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredFileLoader
-from langchain_ollama import OllamaEmbeddings, OllamaLLM
+from langchain_ollama import OllamaEmbeddings
 from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import HumanMessage, AIMessage
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
-import shutil
+import json
+import time
+import asyncio
 import logging
-from .models_config import MODELS, DEFAULT_MODEL
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from typing import Optional
+from .models_config import MODELS, DEFAULT_MODEL, embedding_model_from_env
+from .model_router import ModelPool, ModelStats, QuestionRouter
+from .document_processor import DocumentProcessor
+from .extraction import extractor_from_env
+from .knowledge_base import KnowledgeBase, SUPPORTED_EXTENSIONS, collection_for_model
+from .retrieval import KnowledgeBaseRetriever
+from .reranker import CrossEncoderReranker
+from .retrieval_cache import RetrievalCache
+from .batch import BatchRunner, read_questions
+from .maintenance import IndexMaintenance, MaintenanceScheduler, lock_index
+from .session_store import SessionStore, SessionChatMessageHistory, SessionCompactor, new_session_id
+from .uploads import (
+    RequestSizeLimit, ResumableUploads, UploadTooLarge, UploadOffsetMismatch, UploadMalformed, receive_multipart,
+    discard_uploads
+)
 
 # Configurar logging
 logging.basicConfig(
@@ -30,6 +48,36 @@ MODEL_NAME = os.getenv("OLLAMA_MODEL", DEFAULT_MODEL)
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://ollama:11434")
 DATA_DIR = os.getenv("DATA_DIR", "data")
 VECTOR_DIR = os.getenv("VECTOR_DIR", "vectorstore")
+MAX_DOCUMENT_VERSIONS = int(os.getenv("MAX_DOCUMENT_VERSIONS", "5"))
+MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "50"))
+MAX_REQUEST_SIZE_MB = int(os.getenv("MAX_REQUEST_SIZE_MB", "200"))
+MAX_RESUMABLE_FILE_SIZE_MB = int(os.getenv("MAX_RESUMABLE_FILE_SIZE_MB", "2048"))
+ENABLE_RERANKER = os.getenv("ENABLE_RERANKER", "false").lower() == "true"
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "3"))
+RERANK_BUDGET_MS = int(os.getenv("RERANK_BUDGET_MS", "400"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "512"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "2"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+EMBEDDING_MODEL = embedding_model_from_env()
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+ENABLE_MODEL_ROUTING = os.getenv("ENABLE_MODEL_ROUTING", "false").lower() == "true"
+ROUTER_FAST_MODEL = os.getenv("ROUTER_FAST_MODEL", "qwen2:1.5b")
+ROUTER_STRONG_MODEL = os.getenv("ROUTER_STRONG_MODEL", "llama3.1:8b")
+ROUTER_MAX_SIMPLE_WORDS = int(os.getenv("ROUTER_MAX_SIMPLE_WORDS", "15"))
+SESSION_DB = os.getenv("SESSION_DB", os.path.join(VECTOR_DIR, "sessions.sqlite3"))
+SESSION_KEEP_RECENT = int(os.getenv("SESSION_KEEP_RECENT", "6"))
+SESSION_COMPACT_TRIGGER = int(os.getenv("SESSION_COMPACT_TRIGGER", "12"))
+SESSION_COOKIE = "rag_session"
+ENABLE_SUMMARIES = os.getenv("ENABLE_SUMMARIES", "false").lower() == "true"
+SUMMARY_TOP_DOCUMENTS = int(os.getenv("SUMMARY_TOP_DOCUMENTS", "8"))
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "6000"))
+SUMMARY_BACKFILL_INTERVAL = float(os.getenv("SUMMARY_BACKFILL_INTERVAL", "60"))
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv("MAINTENANCE_INTERVAL_HOURS", "24"))
+MAINTENANCE_IDLE_SECONDS = int(os.getenv("MAINTENANCE_IDLE_SECONDS", "300"))
+MAINTENANCE_PRUNE_MISSING = os.getenv("MAINTENANCE_PRUNE_MISSING", "false").lower() == "true"
+MAINTENANCE_REBUILD_THRESHOLD = float(os.getenv("MAINTENANCE_REBUILD_THRESHOLD", "0.2"))
 
 # Validar que el modelo existe
 if MODEL_NAME not in MODELS:
@@ -47,28 +95,41 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
 
 # Inicialización de modelos
+# El modelo de chat se puede cambiar en caliente (POST /api/model); el de
+# embeddings es fijo (EMBEDDING_MODEL) para no tener que reindexar
 logger.info(f"🚀 Inicializando modelo: {MODELS[MODEL_NAME]['name']}")
-llm = OllamaLLM(
-    model=MODEL_NAME, 
+model_pool = ModelPool(
+    MODELS,
+    active=MODEL_NAME,
     base_url=OLLAMA_HOST,
     temperature=0.1,
+    keep_alive=OLLAMA_KEEP_ALIVE,
     system="""Eres un asistente médico especializado que SIEMPRE responde en español. 
     Tu función es ayudar con información médica basada en documentos proporcionados.
     Usa terminología médica apropiada en español y sé preciso en tus respuestas."""
 )
-embeddings = OllamaEmbeddings(model=MODEL_NAME, base_url=OLLAMA_HOST)
+llm = model_pool.get(MODEL_NAME)
+model_stats = ModelStats()
+model_switch_lock = asyncio.Lock()
+
+# Enrutado por pregunta: simples al modelo ligero, complejas al grande
+model_router = None
+if ENABLE_MODEL_ROUTING:
+    if ROUTER_FAST_MODEL in MODELS and ROUTER_STRONG_MODEL in MODELS:
+        model_router = QuestionRouter(ROUTER_FAST_MODEL, ROUTER_STRONG_MODEL, ROUTER_MAX_SIMPLE_WORDS)
+    else:
+        logger.warning(f"⚠️ Enrutado deshabilitado: {ROUTER_FAST_MODEL} o {ROUTER_STRONG_MODEL} no están en MODELS")
+
+logger.info(f"🔢 Modelo de embeddings: {EMBEDDING_MODEL}")
+embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_HOST)
 
 # Crear directorios necesarios
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(VECTOR_DIR, exist_ok=True)
 
-# Configurar text splitter profesional
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200,
-    length_function=len,
-    separators=["\n\n", "\n", ". ", ", ", " ", ""]
-)
+# Bloqueo compartido del índice mientras el servidor esté en marcha: los scripts
+# que lo abren directamente (ingesta, compactación) se niegan a ejecutarse
+index_lock = lock_index(VECTOR_DIR, exclusive=False)
 
 # Inicializar base vectorial de forma simple y robusta
 def initialize_vectorstore():
@@ -77,77 +138,116 @@ def initialize_vectorstore():
     vectorstore = Chroma(
         persist_directory=VECTOR_DIR, 
         embedding_function=embeddings,
-        collection_name=f"docs_{CURRENT_MODEL.replace(':', '_')}"  # Nombre único por modelo
+        collection_name=collection_for_model(EMBEDDING_MODEL)  # Nombre único por modelo de embeddings
     )
-    logger.info(f"✅ Vectorstore inicializado para modelo: {CURRENT_MODEL}")
+    logger.info(f"✅ Vectorstore inicializado para modelo: {EMBEDDING_MODEL}")
     return vectorstore
 
 vectorstore = initialize_vectorstore()
 
-def load_document(file_path):
-    """Cargar documento según su extensión"""
-    filename = os.path.basename(file_path)
-    file_extension = os.path.splitext(filename)[1].lower()
-    
-    try:
-        if file_extension == '.pdf':
-            loader = PyPDFLoader(file_path)
-        elif file_extension in ['.txt', '.md']:
-            loader = TextLoader(file_path, encoding='utf-8')
-        else:
-            # Para otros tipos, intentar como texto
-            loader = TextLoader(file_path, encoding='utf-8')
-        
-        return loader.load()
-    except Exception as e:
-        logger.error(f"Error cargando {filename}: {e}")
-        return []
+# Procesador de documentos y base de conocimiento con versionado
+# OCR de imágenes y PDFs escaneados, transcripción de audio (ENABLE_OCR / ENABLE_WHISPER)
+extractor = extractor_from_env(DATA_DIR)
+processor = DocumentProcessor(llm, embeddings, chunk_size=1000, chunk_overlap=200, extractor=extractor)
+knowledge_base = KnowledgeBase(
+    vectorstore,
+    processor,
+    data_dir=DATA_DIR,
+    vector_dir=VECTOR_DIR,
+    max_versions=MAX_DOCUMENT_VERSIONS,
+    summaries=ENABLE_SUMMARIES,
+    summary_max_chars=SUMMARY_MAX_CHARS,
+    summary_backfill_interval=SUMMARY_BACKFILL_INTERVAL
+)
+
+# Mantenimiento del índice (huérfanos, duplicados, VACUUM, reconstrucción ANN); se
+# crea antes de la carga inicial para recuperar una reconstrucción interrumpida
+index_maintenance = IndexMaintenance(knowledge_base, rebuild_threshold=MAINTENANCE_REBUILD_THRESHOLD)
 
 # Cargar documentos existentes al iniciar
 def load_existing_documents():
-    """Cargar todos los documentos del directorio data al iniciar"""
+    """Indexar los documentos del directorio data que no estén ya indexados"""
     if not os.path.exists(DATA_DIR):
         return
     
-    documents = []
+    indexed = 0
     for filename in os.listdir(DATA_DIR):
-        if filename.lower().endswith(('.pdf', '.txt', '.docx')):
-            file_path = os.path.join(DATA_DIR, filename)
-            docs = load_document(file_path)
-            
-            if docs:
-                # Agregar metadata mejorada
-                for doc in docs:
-                    doc.metadata.update({
-                        'filename': filename,
-                        'source_path': file_path
-                    })
-                documents.extend(docs)
-                logger.info(f"✅ Cargado: {filename}")
+        file_path = os.path.join(DATA_DIR, filename)
+        if os.path.isfile(file_path) and os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS:
+            # Solo se calcula el hash de los archivos nuevos o modificados
+            if knowledge_base.is_indexed(file_path):
+                continue
+            result = knowledge_base.ingest(file_path)
+            if result["status"] == "success":
+                indexed += 1
     
-    if documents:
-        # Dividir en chunks
-        chunks = text_splitter.split_documents(documents)
-        # Agregar al vectorstore
-        vectorstore.add_documents(chunks)
-        logger.info(f"📚 {len(chunks)} fragmentos agregados a la base de conocimiento")
+    if indexed:
+        logger.info(f"📚 {indexed} documentos agregados a la base de conocimiento")
 
 # Cargar documentos existentes
 load_existing_documents()
 
-# Memoria y chain
-memory = ConversationBufferMemory(
-    memory_key="chat_history", 
-    return_messages=True,
-    output_key="answer"
+# Resúmenes por documento en segundo plano, incluidos los que falten de ingestas previas
+if knowledge_base.summaries:
+    knowledge_base.summaries.start()
+    knowledge_base.summaries.backfill()
+
+# Mantenimiento del índice en los periodos sin peticiones; también bajo demanda
+# con POST /api/maintenance
+maintenance_scheduler = MaintenanceScheduler(
+    index_maintenance,
+    interval_hours=MAINTENANCE_INTERVAL_HOURS,
+    idle_seconds=MAINTENANCE_IDLE_SECONDS,
+    prune_missing=MAINTENANCE_PRUNE_MISSING
 )
+maintenance_scheduler.start()
 
-# Chain RAG con retriever optimizado y prompt en español
-retriever = vectorstore.as_retriever(
-    search_type="mmr",
-    search_kwargs={"k": 5, "fetch_k": 10, "lambda_mult": 0.7}
+# Cargas reanudables por partes (p. ej. PDFs escaneados grandes)
+resumable_uploads = ResumableUploads(
+    knowledge_base.staging_dir,
+    max_file_bytes=MAX_RESUMABLE_FILE_SIZE_MB * 1024 * 1024
+)
+resumable_uploads.cleanup()
+
+# Historial de conversación persistente por sesión, con compactación en segundo plano
+session_store = SessionStore(SESSION_DB)
+session_compactor = SessionCompactor(
+    session_store,
+    keep_recent=SESSION_KEEP_RECENT,
+    trigger=SESSION_COMPACT_TRIGGER
 )
 
+# Reranker opcional: permite enviar menos fragmentos (RERANK_TOP_N) al LLM
+reranker = None
+if ENABLE_RERANKER:
+    reranker = CrossEncoderReranker(
+        RERANKER_MODEL,
+        top_n=RERANK_TOP_N,
+        budget_ms=RERANK_BUDGET_MS
+    )
+    reranker.warm_up_async()
+
+# Caché de recuperación: reintentos y preguntas repetidas no recalculan embeddings ni búsqueda
+retrieval_cache = RetrievalCache(RETRIEVAL_CACHE_SIZE) if RETRIEVAL_CACHE_SIZE > 0 else None
+
+# Chain RAG con retriever optimizado y prompt en español
+def build_retriever(filters=None):
+    """Crear el retriever de la base de conocimiento, opcionalmente pre-filtrado"""
+    return KnowledgeBaseRetriever(
+        knowledge_base=knowledge_base,
+        k=5,
+        fetch_k=10,
+        lambda_mult=0.7,
+        filters=filters,
+        reranker=reranker,
+        rerank_candidates=RERANK_CANDIDATES,
+        cache=retrieval_cache,
+        max_documents=SUMMARY_TOP_DOCUMENTS if ENABLE_SUMMARIES else None,
+        summary_answers=ENABLE_SUMMARIES
+    )
+
+retriever = build_retriever()
+
 # Crear un prompt personalizado en español
 spanish_prompt = PromptTemplate(
     input_variables=["context", "question", "chat_history"],
@@ -183,172 +283,426 @@ Pregunta de seguimiento: {question}
 Pregunta independiente en español:"""
 )
 
-qa_chain = ConversationalRetrievalChain.from_llm(
-    llm=llm,
-    retriever=retriever,
-    memory=memory,
-    return_source_documents=True,
-    verbose=True,
-    combine_docs_chain_kwargs={"prompt": spanish_prompt},
-    condense_question_prompt=spanish_condense_prompt
-)
+def build_qa_chain(chain_retriever, chain_llm=None):
+    """Crear el chain conversacional sobre un retriever y un modelo dados
+
+    No lleva memoria: el historial de cada sesión se pasa en `chat_history`.
+    """
+    return ConversationalRetrievalChain.from_llm(
+        llm=chain_llm or llm,
+        retriever=chain_retriever,
+        return_source_documents=True,
+        verbose=True,
+        combine_docs_chain_kwargs={"prompt": spanish_prompt},
+        condense_question_prompt=spanish_condense_prompt
+    )
+
+# Un chain por modelo de chat, creado la primera vez que se usa
+qa_chains = {}
+
+def get_qa_chain(model_key, filters=None):
+    """Chain del modelo indicado; con filtros se crea uno específico para la petición"""
+    if filters:
+        return build_qa_chain(build_retriever(filters), model_pool.get(model_key))
+    if model_key not in qa_chains:
+        qa_chains[model_key] = build_qa_chain(retriever, model_pool.get(model_key))
+    return qa_chains[model_key]
+
+def resolve_session_id(request: Request, form=None) -> str:
+    """Sesión de la petición: campo `session_id`, cookie o una nueva"""
+    session_id = (form.get("session_id") if form is not None else None) or request.cookies.get(SESSION_COOKIE)
+    if session_id and len(session_id) <= 64 and session_id.isalnum():
+        return session_id
+    return new_session_id()
+
+def select_model(requested, question):
+    """Resolver el modelo de una petición: explícito, enrutado ("auto") o el activo
+
+    Devuelve (clave del modelo, motivo).
+    """
+    if requested and requested != "auto":
+        if requested not in MODELS:
+            raise HTTPException(status_code=400, detail=f"Modelo '{requested}' no disponible")
+        return requested, "solicitado"
+    if model_router is not None:
+        return model_router.route(question)
+    return model_pool.active, "modelo activo"
 
 logger.info("✅ Sistema RAG profesional inicializado correctamente")
 
+# Límite del cuerpo de cualquier petición, también sin Content-Length (chunked)
+app.add_middleware(RequestSizeLimit, max_bytes=MAX_REQUEST_SIZE_MB * 1024 * 1024)
+
+@app.middleware("http")
+async def track_activity(request: Request, call_next):
+    """Registrar actividad para el mantenimiento en reposo
+
+    Los sondeos de estado (GET bajo /api y /static) no cuentan como carga.
+    """
+    polling = request.method == "GET" and request.url.path.startswith(("/api/", "/static/"))
+    if not polling:
+        maintenance_scheduler.touch()
+    try:
+        return await call_next(request)
+    finally:
+        if not polling:
+            maintenance_scheduler.touch()
+
+@app.on_event("shutdown")
+def shutdown():
+    """Detener los procesos de extracción"""
+    if extractor is not None:
+        extractor.shutdown()
+
 @app.get("/", response_class=HTMLResponse)
 def chat_ui(request: Request):
     return templates.TemplateResponse("chat.html", {
         "request": request,
-        "current_model": MODELS[MODEL_NAME],
-        "available_models": MODELS
+        "current_model": MODELS[model_pool.active],
+        "available_models": MODELS,
+        "routing_enabled": model_router is not None
     })
 
 @app.get("/api/models")
 async def get_models():
     """Obtener información de modelos disponibles"""
     return {
-        "current_model": MODEL_NAME,
-        "current_model_info": MODELS[MODEL_NAME],
-        "available_models": MODELS
+        "current_model": model_pool.active,
+        "current_model_info": MODELS[model_pool.active],
+        "available_models": MODELS,
+        "embedding_model": EMBEDDING_MODEL,
+        "routing": {
+            "enabled": model_router is not None,
+            "fast_model": ROUTER_FAST_MODEL,
+            "strong_model": ROUTER_STRONG_MODEL,
+            "max_simple_words": ROUTER_MAX_SIMPLE_WORDS
+        }
     }
 
 @app.get("/api/model/current")
 async def get_current_model():
     """Obtener información del modelo actual"""
     return {
-        "model_key": MODEL_NAME,
-        "model_info": MODELS[MODEL_NAME],
+        "model_key": model_pool.active,
+        "model_info": MODELS[model_pool.active],
         "ollama_host": OLLAMA_HOST
     }
 
+@app.post("/api/model")
+async def switch_model(model: str = Form(...)):
+    """Cambiar el modelo activo sin reiniciar: se precalienta antes del cambio"""
+    if model not in MODELS:
+        raise HTTPException(status_code=400, detail=f"Modelo '{model}' no disponible")
+    
+    async with model_switch_lock:
+        try:
+            result = await run_in_threadpool(model_pool.switch, model)
+        except Exception as e:
+            logger.error(f"❌ No se pudo precalentar {model}: {e}")
+            raise HTTPException(status_code=503, detail=f"No se pudo cargar el modelo {model}: {e}")
+    
+    return {**result, "model_info": MODELS[model]}
+
+@app.get("/api/models/stats")
+async def get_model_stats():
+    """Latencia y throughput por modelo, para ajustar el enrutado"""
+    return {
+        "active_model": model_pool.active,
+        "routing_enabled": model_router is not None,
+        "models": model_stats.stats()
+    }
+
+def parse_tags(value) -> list:
+    """Convertir una lista separada por comas en etiquetas normalizadas"""
+    if not value:
+        return []
+    values = value if isinstance(value, (list, tuple)) else str(value).split(",")
+    return sorted({str(tag).strip().lower() for tag in values if str(tag).strip()})
+
+def parse_filters(form) -> dict:
+    """Extraer filtros de metadata (archivo, tipo, fechas de carga, etiquetas) del formulario"""
+    filters = {}
+    
+    for key in ("filename", "file_type"):
+        value = form.get(key)
+        if value and value.strip():
+            filters[key] = value.strip()
+    
+    for key in ("date_from", "date_to"):
+        value = form.get(key)
+        if not value or not value.strip():
+            continue
+        try:
+            parsed = datetime.fromisoformat(value.strip())
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Fecha inválida en {key}: {value}")
+        # Una fecha sin hora como límite superior incluye el día completo
+        if key == "date_to" and len(value.strip()) <= 10:
+            parsed += timedelta(days=1)
+        filters[key] = parsed.timestamp()
+    
+    tags = parse_tags(form.get("tags"))
+    if tags:
+        filters["tags"] = tags
+    
+    return filters
+
+async def receive_uploads(request: Request, accept) -> tuple:
+    """Recibir un formulario multipart en streaming al área temporal
+
+    Cada archivo se escribe y se le calcula el hash a medida que llega; los
+    límites de archivo y de petición cortan la escritura o la lectura.
+    Devuelve (campos de texto, archivos).
+    """
+    try:
+        return await receive_multipart(
+            request.stream(), request.headers.get("content-type"), knowledge_base.staging_path,
+            max_file_bytes=MAX_FILE_SIZE_MB * 1024 * 1024,
+            max_request_bytes=MAX_REQUEST_SIZE_MB * 1024 * 1024,
+            accept=accept
+        )
+    except UploadMalformed as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+@app.get("/api/reranker")
+async def get_reranker_stats():
+    """Estado y métricas del reranker"""
+    if reranker is None:
+        return {"enabled": False}
+    return {"enabled": True, **reranker.stats()}
+
+@app.get("/api/retrieval/cache")
+async def get_retrieval_cache_stats():
+    """Métricas de la caché de recuperación (tasa de aciertos, entradas obsoletas)"""
+    if retrieval_cache is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "index_generation": knowledge_base.registry.generation(),
+        **retrieval_cache.stats()
+    }
+
+@app.get("/api/maintenance")
+async def get_maintenance_status():
+    """Estado del mantenimiento y último informe (espacio recuperado, latencia)"""
+    return {
+        "running": index_maintenance.running,
+        "interval_hours": MAINTENANCE_INTERVAL_HOURS,
+        "idle_seconds": MAINTENANCE_IDLE_SECONDS,
+        "last_run_at": index_maintenance.last_run_at or None,
+        "last_report": index_maintenance.last_report
+    }
+
+@app.post("/api/maintenance")
+async def run_maintenance(background_tasks: BackgroundTasks, dry_run: bool = False, prune_missing: bool = False,
+                          rebuild: Optional[bool] = None, vacuum: bool = True):
+    """Lanzar una pasada de mantenimiento en segundo plano
+
+    dry_run: solo detectar; rebuild: forzar o evitar la reconstrucción del
+    índice ANN (por defecto, según la fracción de entradas borradas).
+    """
+    if index_maintenance.running:
+        raise HTTPException(status_code=409, detail="Ya hay un mantenimiento en curso")
+    background_tasks.add_task(
+        run_in_threadpool, index_maintenance.run,
+        dry_run=dry_run, prune_missing=prune_missing, rebuild=rebuild, vacuum=vacuum
+    )
+    return {"status": "started", "dry_run": dry_run}
+
+@app.get("/api/summaries")
+async def get_summary_index_status():
+    """Estado del índice de resúmenes (documentos resumidos, pendientes, en cola)"""
+    if knowledge_base.summaries is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "top_documents": SUMMARY_TOP_DOCUMENTS,
+        **await run_in_threadpool(knowledge_base.summaries.status)
+    }
+
 @app.post("/upload")
-async def upload_files(files: list[UploadFile] = File(...)):
-    """Cargar y procesar archivos de manera profesional"""
+async def upload_files(request: Request):
+    """Cargar y procesar archivos de manera profesional
+
+    Formulario multipart con uno o varios `files` y `tags` opcional.
+    """
+    def accept(filename: str):
+        # Validar tipo de archivo antes de escribir nada
+        file_extension = os.path.splitext(filename)[1].lower()
+        if file_extension not in SUPPORTED_EXTENSIONS:
+            return f"Tipo de archivo no soportado: {file_extension}"
     
+    fields, files = await receive_uploads(request, accept)
     if not files:
         raise HTTPException(status_code=400, detail="No se proporcionaron archivos")
     
     results = []
+    tag_list = parse_tags(fields["tags"]) if "tags" in fields else None
     
-    for file in files:
-        try:
-            # Validar tipo de archivo
-            allowed_extensions = ['.pdf', '.txt', '.docx', '.doc']
-            file_extension = os.path.splitext(file.filename)[1].lower()
-            
-            if file_extension not in allowed_extensions:
-                results.append({
-                    "filename": file.filename,
-                    "status": "error",
-                    "message": f"Tipo de archivo no soportado: {file_extension}"
-                })
-                continue
-            
-            # Guardar archivo
-            file_path = os.path.join(DATA_DIR, file.filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            # Cargar y procesar documento
-            documents = load_document(file_path)
-            
-            # Agregar metadata
-            for doc in documents:
-                doc.metadata.update({
-                    'filename': file.filename,
-                    'source_path': file_path
-                })
-            
-            # Dividir en chunks
-            chunks = text_splitter.split_documents(documents)
-            
-            # Agregar al vectorstore
-            vectorstore.add_documents(chunks)
-            
-            results.append({
-                "filename": file.filename,
-                "status": "success",
-                "chunks": len(chunks),
-                "message": f"Procesado exitosamente ({len(chunks)} fragmentos)"
-            })
-            
-            logger.info(f"📄 Archivo procesado: {file.filename} ({len(chunks)} fragmentos)")
-            
-        except Exception as e:
-            logger.error(f"Error procesando {file.filename}: {e}")
-            results.append({
-                "filename": file.filename,
-                "status": "error",
-                "message": f"Error: {str(e)}"
-            })
-    
-    return {"results": results}
-    
-    for file in files:
-        try:
-            # Validar tipo de archivo
-            allowed_extensions = ['.pdf', '.txt', '.docx', '.doc']
-            file_extension = os.path.splitext(file.filename)[1].lower()
-            
-            if file_extension not in allowed_extensions:
+    # Archivos aún sin entregar a la ingesta (que elimina los suyos si falla)
+    unprocessed = list(files)
+    try:
+        for file in files:
+            unprocessed.remove(file)
+            if "error" in file:
                 results.append({
-                    "filename": file.filename,
+                    "filename": file["filename"],
                     "status": "error",
-                    "message": f"Tipo de archivo no soportado: {file_extension}"
-                })
-                continue
-            
-            # Guardar archivo
-            file_path = os.path.join(DATA_DIR, file.filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            # Procesar documento
-            documents = processor.load_document(file_path)
-            
-            if not documents:
-                results.append({
-                    "filename": file.filename,
-                    "status": "error", 
-                    "message": "No se pudo procesar el documento"
+                    "message": file["error"]
                 })
                 continue
-            
-            # Crear chunks
-            chunks = processor.process_documents(documents)
-            
-            if chunks:
-                # Agregar a la base vectorial
-                vectorstore.add_documents(chunks)
+            try:
+                # Un archivo con el mismo nombre crea una nueva versión del documento;
+                # el hash calculado al recibirlo permite descartar contenido ya indexado
+                result = await run_in_threadpool(
+                    knowledge_base.ingest, file["staged_path"], file["filename"], tag_list, file["content_hash"]
+                )
+                results.append(result)
                 
-                results.append({
-                    "filename": file.filename,
-                    "status": "success",
-                    "message": f"Procesado exitosamente: {len(chunks)} fragmentos creados",
-                    "chunks": len(chunks),
-                    "pages": len(documents)
-                })
+                logger.info(f"📄 Archivo procesado: {file['filename']} ({result['message']})")
                 
-                logger.info(f"✅ Archivo procesado: {file.filename} -> {len(chunks)} chunks")
-            else:
+            except Exception as e:
+                logger.error(f"❌ Error procesando {file['filename']}: {str(e)}")
                 results.append({
-                    "filename": file.filename,
+                    "filename": file["filename"],
                     "status": "error",
-                    "message": "No se pudieron crear fragmentos del documento"
+                    "message": f"Error interno: {str(e)}"
                 })
-                
-        except Exception as e:
-            logger.error(f"❌ Error procesando {file.filename}: {str(e)}")
-            results.append({
-                "filename": file.filename,
-                "status": "error",
-                "message": f"Error interno: {str(e)}"
-            })
+    finally:
+        # Si se interrumpe la petición (p. ej. el cliente se desconecta)
+        discard_uploads(unprocessed)
     
     return {"results": results}
 
+@app.post("/api/uploads")
+async def create_resumable_upload(filename: str = Form(...), size: int = Form(...), tags: str = Form(None)):
+    """Iniciar una carga reanudable por partes"""
+    filename = os.path.basename(filename)
+    if os.path.splitext(filename)[1].lower() not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Tipo de archivo no soportado: {os.path.splitext(filename)[1]}")
+    try:
+        return resumable_uploads.create(filename, size, parse_tags(tags) if tags is not None else None)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+@app.get("/api/uploads/{upload_id}")
+async def get_resumable_upload(upload_id: str):
+    """Estado de una carga: cuántos bytes se recibieron (para reanudar)"""
+    try:
+        return resumable_uploads.get(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Carga no encontrada")
+
+@app.put("/api/uploads/{upload_id}")
+async def append_resumable_upload(upload_id: str, request: Request, offset: int = 0):
+    """Enviar una parte (cuerpo binario) que empieza en `offset`"""
+    try:
+        return await resumable_uploads.append(upload_id, offset, request.stream())
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Carga no encontrada")
+    except UploadOffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+@app.post("/api/uploads/{upload_id}/complete")
+async def complete_resumable_upload(upload_id: str):
+    """Cerrar una carga completa e indexar el documento"""
+    try:
+        state = resumable_uploads.get(upload_id)
+        staged_path = knowledge_base.staging_path(state["filename"])
+        state, content_hash = resumable_uploads.finish(upload_id, staged_path)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Carga no encontrada")
+    except UploadOffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return await run_in_threadpool(
+        knowledge_base.ingest, staged_path, state["filename"], state["tags"], content_hash
+    )
+
+@app.delete("/api/uploads/{upload_id}")
+async def abort_resumable_upload(upload_id: str):
+    """Cancelar una carga y liberar el espacio"""
+    resumable_uploads.discard(upload_id)
+    return {"upload_id": upload_id, "status": "aborted"}
+
+@app.get("/api/documents/{doc_id}")
+async def get_document(doc_id: str):
+    """Obtener el registro de un documento indexado"""
+    document = knowledge_base.registry.get(doc_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    document["tags"] = knowledge_base.registry.get_tags(doc_id)
+    document["summary"] = knowledge_base.registry.get_summaries([doc_id]).get(doc_id)
+    return document
+
+@app.put("/api/documents/{doc_id}/tags")
+async def set_document_tags(doc_id: str, tags: str = Form("")):
+    """Reemplazar las etiquetas de un documento (lista separada por comas)"""
+    if not knowledge_base.registry.get(doc_id):
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    tag_list = parse_tags(tags)
+    knowledge_base.registry.set_tags(doc_id, tag_list)
+    return {"doc_id": doc_id, "tags": tag_list}
+
+@app.delete("/api/documents/{doc_id}")
+async def delete_document(doc_id: str):
+    """Eliminar un documento y exactamente sus vectores"""
+    try:
+        return await run_in_threadpool(knowledge_base.delete, doc_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+
+@app.put("/api/documents/{doc_id}")
+async def replace_document(doc_id: str, request: Request):
+    """Reemplazar el contenido de un documento creando una nueva versión
+
+    Formulario multipart con un único `file`.
+    """
+    current = knowledge_base.registry.get(doc_id)
+    if not current:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    
+    def accept(filename: str):
+        if os.path.splitext(filename)[1].lower() != current["file_type"]:
+            return f"El reemplazo debe ser de tipo {current['file_type']}"
+    
+    _, files = await receive_uploads(request, accept)
+    if len(files) != 1:
+        discard_uploads(files)
+        raise HTTPException(status_code=400, detail="Se esperaba exactamente un archivo 'file'")
+    file = files[0]
+    if "error" in file:
+        raise HTTPException(status_code=file["status_code"], detail=file["error"])
+    # Si la ingesta falla, ella misma elimina el archivo temporal
+    result = await run_in_threadpool(knowledge_base.replace, doc_id, file["staged_path"], file["content_hash"])
+    if result["status"] == "error":
+        raise HTTPException(status_code=422, detail=result["message"])
+    return result
+
+@app.get("/api/documents/{doc_id}/versions")
+async def get_document_versions(doc_id: str):
+    """Historial de versiones de un documento"""
+    try:
+        return {"doc_id": doc_id, "versions": knowledge_base.versions(doc_id)}
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+
+@app.post("/api/documents/{doc_id}/rollback/{version}")
+async def rollback_document(doc_id: str, version: int):
+    """Restaurar una versión archivada reutilizando sus embeddings"""
+    try:
+        return await run_in_threadpool(knowledge_base.rollback, doc_id, version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 @app.post("/chat")
-async def chat_endpoint(request: Request):
+async def chat_endpoint(request: Request, response: Response, background_tasks: BackgroundTasks):
     """Endpoint de chat profesional en español"""
     form = await request.form()
     question = form.get("message")
@@ -356,12 +710,39 @@ async def chat_endpoint(request: Request):
     if not question or not question.strip():
         raise HTTPException(status_code=400, detail="Pregunta vacía")
     
+    # Filtros opcionales que acotan la búsqueda a ciertos documentos
+    filters = parse_filters(form)
+    
+    # Modelo de la petición: explícito, "auto" (enrutado) o el activo
+    model_key, route_reason = select_model(form.get("model"), question.strip())
+    
+    # Historial de la sesión: resumen de lo antiguo y mensajes recientes
+    session_id = resolve_session_id(request, form)
+    history = SessionChatMessageHistory(session_store, session_id)
+    
     try:
         # Prefijo para reforzar respuesta en español
         spanish_question = f"Responde en español: {question.strip()}"
         
-        # Generar respuesta usando el chain
-        result = qa_chain({"question": spanish_question})
+        def answer() -> tuple:
+            # Generar respuesta usando el chain del modelo (pre-filtrado si hay filtros)
+            chain = get_qa_chain(model_key, filters)
+            started = time.perf_counter()
+            try:
+                result = chain({"question": spanish_question, "chat_history": history.messages})
+            except Exception:
+                model_stats.record(model_key, (time.perf_counter() - started) * 1000, 0, error=True)
+                raise
+            model_stats.record(model_key, (time.perf_counter() - started) * 1000, len(result["answer"]))
+            
+            history.add_messages([HumanMessage(content=question.strip()), AIMessage(content=result["answer"])])
+            return result, session_compactor.needs_compaction(session_id)
+        
+        # Recuperación, generación e historial (SQLite) bloquean: fuera del event loop
+        result, needs_compaction = await run_in_threadpool(answer)
+        if needs_compaction:
+            background_tasks.add_task(session_compactor.compact, session_id, model_pool.get())
+        response.set_cookie(SESSION_COOKIE, session_id, max_age=30 * 24 * 3600, httponly=True, samesite="lax")
         
         # Extraer información de fuentes
         sources = []
@@ -376,9 +757,13 @@ async def chat_endpoint(request: Request):
             "response": result["answer"],
             "sources": sources,
             "documents_found": len(sources),
+            "session_id": session_id,
             "metadata": {
-                "model": MODELS[MODEL_NAME]["name"],
-                "language": "español"
+                "model": MODELS[model_key]["name"],
+                "model_key": model_key,
+                "route_reason": route_reason,
+                "language": "español",
+                "filters": filters
             }
         }
         
@@ -386,57 +771,106 @@ async def chat_endpoint(request: Request):
         logger.error(f"❌ Error en chat: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error procesando pregunta: {str(e)}")
 
+@app.post("/api/batch")
+async def batch_endpoint(request: Request, concurrency: int = BATCH_CONCURRENCY, model: str = None):
+    """Responder un lote de preguntas en JSONL, devolviendo resultados JSONL en streaming
+
+    Acepta el JSONL como cuerpo de la petición o como archivo `file` de un
+    formulario multipart. No usa la memoria del chat.
+    """
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Falta el archivo 'file' con las preguntas")
+        raw = await upload.read()
+    else:
+        raw = await request.body()
+    
+    try:
+        questions = read_questions(raw.decode("utf-8"), BATCH_MAX_QUESTIONS, parse_filters)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not questions:
+        raise HTTPException(status_code=400, detail="El lote no contiene preguntas")
+    
+    if model and model not in MODELS:
+        raise HTTPException(status_code=400, detail=f"Modelo '{model}' no disponible")
+    
+    runner = BatchRunner(
+        knowledge_base,
+        model_pool.get(model),
+        spanish_prompt,
+        k=5,
+        fetch_k=10,
+        lambda_mult=0.7,
+        reranker=reranker,
+        rerank_candidates=RERANK_CANDIDATES,
+        concurrency=min(max(1, concurrency), BATCH_CONCURRENCY)
+    )
+    logger.info(f"📦 Lote de {len(questions)} preguntas (concurrencia {runner.concurrency})")
+    
+    async def stream():
+        # Cerrar el generador al desconectarse el cliente cancela las generaciones pendientes
+        async with aclosing(runner.run(questions)) as results:
+            async for result in results:
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/chat/clear")
-async def clear_chat():
-    """Limpiar historial de conversación"""
-    memory.clear()
-    return {"message": "Historial de conversación limpiado"}
+async def clear_chat(request: Request):
+    """Limpiar historial de conversación de la sesión"""
+    form = await request.form()
+    session_id = resolve_session_id(request, form)
+    session_store.delete(session_id)
+    return {"message": "Historial de conversación limpiado", "session_id": session_id}
 
 @app.get("/api/chat/summary")
-async def get_chat_summary():
-    """Obtener resumen de la conversación actual"""
-    chat_history = memory.chat_memory.messages
-    if not chat_history:
+async def get_chat_summary(request: Request, session_id: str = None):
+    """Obtener resumen de la conversación de la sesión"""
+    info = session_store.info(session_id or resolve_session_id(request))
+    if not info or not info["message_count"]:
         return {"summary": "No hay conversación activa", "message_count": 0}
     
-    summary = f"Conversación con {len(chat_history)} mensajes"
-    return {"summary": summary, "message_count": len(chat_history)}
+    context = session_store.context(info["session_id"])
+    return {
+        "summary": context["summary"] or f"Conversación con {info['message_count']} mensajes",
+        **info,
+        "compaction": session_compactor.stats
+    }
 
 @app.get("/api/documents")
-async def get_documents_info():
-    """Obtener información de documentos cargados"""
-    
-    # Contar documentos en el directorio
-    doc_count = 0
-    doc_types = {}
-    total_size = 0
-    
-    if os.path.exists(DATA_DIR):
-        for file_path in os.listdir(DATA_DIR):
-            full_path = os.path.join(DATA_DIR, file_path)
-            if os.path.isfile(full_path):
-                doc_count += 1
-                ext = os.path.splitext(file_path)[1].lower()
-                doc_types[ext] = doc_types.get(ext, 0) + 1
-                total_size += os.path.getsize(full_path)
-    
-    # Información del vectorstore
-    vector_info = {"chunks": 0, "status": "empty"}
-    try:
-        if hasattr(vectorstore, '_collection') and vectorstore._collection:
-            vector_info = {
-                "chunks": vectorstore._collection.count(),
-                "status": "active"
-            }
-    except Exception as e:
-        logger.warning(f"No se pudo obtener info del vectorstore: {e}")
-    
-    return {
+async def get_documents_info(limit: int = 0, cursor: str = None, file_type: str = None):
+    """Obtener información de documentos cargados
+
+    Los totales salen de las estadísticas del registro, que se actualizan con
+    cada ingesta y borrado, así que no se recorre DATA_DIR ni se consulta Chroma.
+    Con `limit` se añade una página de documentos; `next_cursor` pide la siguiente.
+    """
+    stats = knowledge_base.registry.catalog_stats()
+    info = {
         "documents": {
-            "count": doc_count,
-            "types": doc_types,
-            "total_size_mb": round(total_size / (1024*1024), 2)
+            "count": stats["documents"],
+            "types": {extension: row["documents"] for extension, row in stats["types"].items()},
+            "total_size_mb": round(stats["total_size"] / (1024*1024), 2),
+            "chunks_by_type": {extension: row["chunks"] for extension, row in stats["types"].items()},
+            "last_indexed_at": stats["last_indexed_at"]
+        },
+        "vectorstore": {
+            "chunks": stats["chunks"],
+            "status": "active" if stats["chunks"] else "empty"
         },
-        "vectorstore": vector_info,
         "data_directory": DATA_DIR
     }
+
+    if limit > 0:
+        documents, next_cursor = knowledge_base.registry.page_documents(min(limit, 500), cursor, file_type)
+        info["items"] = [
+            {key: document[key] for key in (
+                "doc_id", "filename", "file_type", "file_size", "chunk_count", "version", "uploaded_at", "indexed_at"
+            )}
+            for document in documents
+        ]
+        info["next_cursor"] = next_cursor
+    return info
@@ -0,0 +1,708 @@
+"""
+Mantenimiento del índice en línea
+Detecta restos que el uso normal va acumulando (vectores sin documento,
+chunks heredados duplicados, segmentos y snapshots huérfanos, directorios
+HNSW de colecciones borradas, documentos cuyo archivo ya no está en DATA_DIR),
+los elimina, reconstruye el índice ANN si los borrados acumulados superan un
+umbral, compacta el registro con VACUUM y reporta el espacio recuperado y la
+latencia de búsqueda antes y después.
+
+Las búsquedas se siguen atendiendo durante todo el proceso. Las escrituras
+(ingestas, borrados, rollbacks) esperan al lock de la base de conocimiento
+solo mientras se limpian los restos y al final de la reconstrucción, no
+durante la copia.
+
+chroma.sqlite3 no se compacta en línea: Chroma lo tiene abierto. Su VACUUM
+(`compact_chroma_sqlite`) solo se ejecuta con el índice bloqueado en
+exclusiva (`lock_index`), es decir, con el servidor parado.
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+import shutil
+import struct
+import sqlite3
+import zipfile
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+from .knowledge_base import KnowledgeBase, SUPPORTED_EXTENSIONS, parse_chunk_id
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+REPORT_FILE = "maintenance.json"
+UUID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+VERSION_PATTERN = re.compile(r"^v(\d+)$")
+# Listas largas del informe se recortan a este número de elementos
+REPORT_SAMPLE = 50
+# Espera antes de borrar la colección sustituida, para que terminen las búsquedas en curso
+RETIRE_GRACE_SECONDS = 5
+# Fracción de entradas HNSW borradas (o por borrar) a partir de la que se reconstruye
+REBUILD_THRESHOLD = 0.2
+# Fracción de páginas libres de chroma.sqlite3 a partir de la que se recomienda compactarlo
+COMPACT_THRESHOLD = 0.25
+# Bloqueo entre procesos del directorio del índice: compartido para el servidor,
+# exclusivo para los scripts que lo abren con el servidor parado
+INDEX_LOCK_FILE = ".index.lock"
+
+
+class IndexInUse(RuntimeError):
+    """Otro proceso tiene abierto el directorio del índice"""
+
+
+def lock_index(vector_dir: str, exclusive: bool = True):
+    """Bloquear `vector_dir` frente a otros procesos; el bloqueo dura lo que el archivo devuelto
+
+    El servidor toma el bloqueo compartido al arrancar; los scripts que escriben
+    en el índice sin pasar por él lo piden exclusivo, y fallan con IndexInUse
+    mientras el servidor esté en marcha.
+    """
+    os.makedirs(vector_dir, exist_ok=True)
+    handle = open(os.path.join(vector_dir, INDEX_LOCK_FILE), "a")
+    try:
+        fcntl.flock(handle, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        handle.close()
+        if exclusive:
+            raise IndexInUse(f"El índice en {vector_dir} está en uso: detén el servidor (docker-compose stop app)")
+        raise IndexInUse(f"Un script tiene bloqueado el índice en {vector_dir}; espera a que termine")
+    return handle
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def store_sizes(vector_dir: str) -> Dict[str, int]:
+    """Bytes en disco por componente del directorio del índice
+
+    El total es la suma de estos componentes: otras bases del directorio
+    (p. ej. el historial de sesiones) crecen con el uso y no cuentan.
+    """
+    sizes = {"chroma.sqlite3": 0, "ann_index": 0, "registry.sqlite3": 0, "chunks": 0, "versions": 0}
+    for name in os.listdir(vector_dir) if os.path.isdir(vector_dir) else []:
+        path = os.path.join(vector_dir, name)
+        if name.startswith("chroma.sqlite3"):
+            sizes["chroma.sqlite3"] += os.path.getsize(path)
+        elif name.startswith("registry.sqlite3"):
+            sizes["registry.sqlite3"] += os.path.getsize(path)
+        elif UUID_PATTERN.match(name):
+            sizes["ann_index"] += directory_size(path)
+        elif name in ("chunks", "versions"):
+            sizes[name] = directory_size(path)
+    sizes["total"] = sum(sizes.values())
+    return sizes
+
+
+def sqlite_free_bytes(path: str) -> int:
+    """Bytes en páginas libres de una base SQLite (lo que recuperaría un VACUUM)"""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
+        try:
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return 0
+    return free_pages * page_size
+
+
+def compact_chroma_sqlite(vector_dir: str) -> Dict[str, int]:
+    """VACUUM de chroma.sqlite3; el llamante debe tener el índice bloqueado en exclusiva"""
+    path = os.path.join(vector_dir, "chroma.sqlite3")
+    before = store_sizes(vector_dir)["chroma.sqlite3"]
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    after = store_sizes(vector_dir)["chroma.sqlite3"]
+    logger.info(f"🗜️ chroma.sqlite3 compactado: {before / 1048576:.2f} → {after / 1048576:.2f} MB")
+    return {"before": before, "after": after}
+
+
+class IndexMaintenance:
+    """Comprobaciones de integridad y compactación de la base de conocimiento"""
+
+    def __init__(self, knowledge_base: KnowledgeBase, probes: int = 30,
+                 rebuild_threshold: float = REBUILD_THRESHOLD):
+        self.kb = knowledge_base
+        self.probes = probes
+        self.rebuild_threshold = rebuild_threshold
+        self.report_path = os.path.join(knowledge_base.vector_dir, REPORT_FILE)
+        self.last_report: Optional[Dict[str, Any]] = self._load_report()
+        # Última pasada real (las simulaciones no cuentan para la programación)
+        self.last_run_at = (self.last_report or {}).get("finished_at", 0)
+        self._running = threading.Lock()
+        self._retired_collection: Optional[str] = None
+        self._recover_interrupted_rebuild()
+
+    @property
+    def running(self) -> bool:
+        return self._running.locked()
+
+    def run(self, dry_run: bool = False, prune_missing: bool = False,
+            rebuild: Optional[bool] = None, vacuum: bool = True) -> Optional[Dict[str, Any]]:
+        """Ejecutar una pasada completa; None si ya hay una en curso
+
+        Con `dry_run` solo se detecta y se informa. `prune_missing` elimina
+        del índice los documentos cuyo archivo ya no existe en DATA_DIR.
+        `rebuild` fuerza (True) o evita (False) la reconstrucción del índice
+        ANN; por defecto solo se reconstruye si `dead_ratio` supera el umbral.
+        """
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            started = time.time()
+            logger.info(f"🧰 Mantenimiento del índice{' (simulación)' if dry_run else ''}")
+            probe_vectors = self._probe_vectors()
+            report: Dict[str, Any] = {
+                "started_at": started,
+                "dry_run": dry_run,
+                "size_before": store_sizes(self.kb.vector_dir),
+                "latency_before": self._measure_latency(probe_vectors)
+            }
+
+            findings = self.scan()
+            report["findings"] = self._summarize(findings)
+            if not dry_run:
+                report["actions"] = self._repair(findings, prune_missing, rebuild, vacuum)
+                report["size_after"] = store_sizes(self.kb.vector_dir)
+                report["latency_after"] = self._measure_latency(probe_vectors)
+                # chroma.sqlite3 no se compacta en línea (la copia lo hace crecer hasta
+                # que sus páginas libres se reutilizan): se informa aparte
+                report["reclaimed_mb"] = round(sum(
+                    report["size_before"][key] - report["size_after"][key]
+                    for key in report["size_before"] if key not in ("chroma.sqlite3", "total")
+                ) / 1048576, 2)
+                report["chroma_sqlite_growth_mb"] = round(
+                    (report["size_after"]["chroma.sqlite3"] - report["size_before"]["chroma.sqlite3"]) / 1048576, 2
+                )
+            report["chroma_sqlite_free_mb"] = round(
+                sqlite_free_bytes(os.path.join(self.kb.vector_dir, "chroma.sqlite3")) / 1048576, 2
+            )
+            chroma_size = store_sizes(self.kb.vector_dir)["chroma.sqlite3"]
+            report["compaction_recommended"] = bool(
+                chroma_size and report["chroma_sqlite_free_mb"] * 1048576 / chroma_size >= COMPACT_THRESHOLD
+            )
+            if report["compaction_recommended"]:
+                logger.warning(
+                    f"⚠️ chroma.sqlite3 tiene {report['chroma_sqlite_free_mb']} MB libres: compáctalo con el "
+                    "servidor parado (scripts/maintenance.py --compact-sqlite)"
+                )
+
+            report["finished_at"] = time.time()
+            report["duration_s"] = round(report["finished_at"] - started, 2)
+            self._save_report(report)
+            logger.info(
+                f"✅ Mantenimiento terminado en {report['duration_s']} s"
+                + (f", {report['reclaimed_mb']} MB recuperados" if not dry_run else "")
+            )
+            return report
+        finally:
+            self._running.release()
+
+    # ------------------------------------------------------------------
+    # Detección
+    # ------------------------------------------------------------------
+
+    def scan(self) -> Dict[str, Any]:
+        """Comparar el índice con el registro y con DATA_DIR sin modificar nada"""
+        registry = self.kb.registry
+        documents = registry.list_documents()
+        active = self._active_chunk_ids(documents)
+        versions = registry.version_keys()
+
+        collection = self.kb.vectorstore._collection
+        vector_ids = self._collection_ids(collection)
+        orphan_vectors = [chunk_id for chunk_id in vector_ids if chunk_id not in active]
+        ann_elements = self._ann_elements(collection)
+
+        orphan_summaries = []
+        if self.kb.summaries:
+            doc_ids = {doc["doc_id"] for doc in documents}
+            orphan_summaries = [doc_id for doc_id in self._collection_ids(self.kb.summaries.collection)
+                                if doc_id not in doc_ids]
+
+        missing, unverifiable = self._missing_files(documents)
+        indexed_names = {doc["filename"] for doc in documents}
+        unindexed = [
+            name for name in (os.listdir(self.kb.data_dir) if os.path.isdir(self.kb.data_dir) else [])
+            if os.path.isfile(os.path.join(self.kb.data_dir, name))
+            and os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS
+            and name not in indexed_names
+        ]
+
+        return {
+            "vectors": len(vector_ids),
+            # Entradas del grafo HNSW, incluidas las marcadas como borradas (None si no se pudo leer)
+            "ann_elements": ann_elements,
+            "dead_ratio": self._dead_ratio(len(vector_ids), len(orphan_vectors), ann_elements),
+            "orphan_vectors": orphan_vectors,
+            # IDs sin el formato `{doc_id}:v{n}:{i}`: chunks de cargas anteriores al registro
+            "legacy_vectors": sum(1 for chunk_id in orphan_vectors if not self._is_chunk_id(chunk_id)),
+            "orphan_segments": self._orphan_paths(self.kb.chunk_store.root_dir, versions, suffix=".seg"),
+            "orphan_snapshots": self._orphan_paths(self.kb.versions_dir, versions),
+            "orphan_summaries": orphan_summaries,
+            "orphan_index_dirs": self._orphan_index_dirs(),
+            "missing_files": missing,
+            "unverifiable_files": unverifiable,
+            "unindexed_files": unindexed,
+            "duplicate_documents": [[doc["filename"] for doc in group] for group in registry.duplicate_groups()]
+        }
+
+    def _active_chunk_ids(self, documents: List[Dict[str, Any]]) -> Set[str]:
+        return {
+            chunk_id
+            for doc in documents
+            for chunk_id in KnowledgeBase._chunk_ids(doc["doc_id"], doc["version"], doc["chunk_count"])
+        }
+
+    @staticmethod
+    def _dead_ratio(vectors: int, orphans: int, ann_elements: Optional[int]) -> float:
+        """Fracción del grafo HNSW ocupada por entradas borradas tras eliminar los huérfanos
+
+        hnswlib solo marca los borrados: siguen ocupando memoria y se recorren en
+        cada búsqueda hasta que se reconstruye el índice. Si no se pudo leer el
+        número de entradas, se estima con los huérfanos.
+        """
+        if ann_elements and ann_elements >= vectors:
+            return round((ann_elements - vectors + orphans) / ann_elements, 3)
+        return round(orphans / vectors, 3) if vectors else 0.0
+
+    def _ann_elements(self, collection) -> Optional[int]:
+        """Entradas del índice HNSW persistido de la colección, contando las borradas"""
+        try:
+            conn = sqlite3.connect(
+                f"file:{os.path.join(self.kb.vector_dir, 'chroma.sqlite3')}?mode=ro", uri=True, timeout=30
+            )
+            try:
+                row = conn.execute(
+                    "SELECT id FROM segments WHERE collection = ? AND scope = 'VECTOR'", (str(collection.id),)
+                ).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                return None
+            # Cabecera de hnswlib: offsetLevel0, max_elements y cur_element_count (size_t)
+            with open(os.path.join(self.kb.vector_dir, row[0], "header.bin"), "rb") as f:
+                return struct.unpack("<QQQ", f.read(24))[2]
+        except (sqlite3.Error, OSError, struct.error):
+            return None
+
+    @staticmethod
+    def _is_chunk_id(chunk_id: str) -> bool:
+        try:
+            parse_chunk_id(chunk_id)
+            return True
+        except ValueError:
+            return False
+
+    @staticmethod
+    def _collection_ids(collection) -> List[str]:
+        ids, offset = [], 0
+        while True:
+            batch = collection.get(include=[], limit=BATCH_SIZE, offset=offset)
+            if not batch["ids"]:
+                return ids
+            ids.extend(batch["ids"])
+            offset += len(batch["ids"])
+
+    @staticmethod
+    def _orphan_paths(root_dir: str, versions: Set, suffix: Optional[str] = None) -> List[str]:
+        """Archivos `{root}/{doc_id}/v{n}.*` de versiones que ya no están en el registro
+
+        Los `.tmp` son restos de escrituras interrumpidas y siempre sobran.
+        """
+        orphans = []
+        for doc_id in os.listdir(root_dir) if os.path.isdir(root_dir) else []:
+            doc_dir = os.path.join(root_dir, doc_id)
+            if not os.path.isdir(doc_dir):
+                continue
+            for name in os.listdir(doc_dir):
+                path = os.path.join(doc_dir, name)
+                if name.endswith(".tmp"):
+                    orphans.append(path)
+                    continue
+                stem, extension = os.path.splitext(name)
+                match = VERSION_PATTERN.match(stem)
+                if match is None or (suffix and extension != suffix):
+                    continue
+                if (doc_id, int(match.group(1))) not in versions:
+                    orphans.append(path)
+        return orphans
+
+    def _orphan_index_dirs(self) -> List[str]:
+        """Directorios HNSW de segmentos que Chroma ya no referencia (colecciones borradas)"""
+        vector_dir = self.kb.vector_dir
+        try:
+            conn = sqlite3.connect(os.path.join(vector_dir, "chroma.sqlite3"), timeout=30)
+            try:
+                segments = {row[0] for row in conn.execute("SELECT id FROM segments")}
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ No se pudieron leer los segmentos de Chroma: {e}")
+            return []
+        if not segments:
+            return []
+        return [
+            os.path.join(vector_dir, name) for name in os.listdir(vector_dir)
+            if UUID_PATTERN.match(name) and os.path.isdir(os.path.join(vector_dir, name)) and name not in segments
+        ]
+
+    def _missing_files(self, documents: List[Dict[str, Any]]):
+        """Documentos cuyo archivo ya no está en DATA_DIR
+
+        Los nombres con `/` pueden ser rutas dentro de DATA_DIR o miembros de zip
+        (`carpeta/archivo.zip/miembro`); estos se comprueban dentro del zip si
+        este está en DATA_DIR; si se indexaron desde otra ruta no se pueden
+        verificar y nunca se consideran huérfanos.
+        """
+        missing, unverifiable = [], []
+        zip_members: Dict[str, Optional[Set[str]]] = {}
+        for doc in documents:
+            filename = doc["filename"]
+            if os.path.exists(os.path.join(self.kb.data_dir, filename)):
+                continue
+            marker = filename.lower().find(".zip/")
+            if marker < 0:
+                missing.append(doc)
+                continue
+
+            archive, member = filename[:marker + 4], filename[marker + 5:]
+            if archive not in zip_members:
+                zip_path = os.path.join(self.kb.data_dir, archive)
+                try:
+                    with zipfile.ZipFile(zip_path) as zf:
+                        zip_members[archive] = set(zf.namelist())
+                except (OSError, zipfile.BadZipFile):
+                    zip_members[archive] = None
+            if zip_members[archive] is None:
+                unverifiable.append(doc)
+            elif member not in zip_members[archive]:
+                missing.append(doc)
+        return missing, unverifiable
+
+    @staticmethod
+    def _summarize(findings: Dict[str, Any]) -> Dict[str, Any]:
+        """Versión serializable del resultado de `scan` (conteos y muestras)"""
+        summary = {}
+        for key, value in findings.items():
+            if key in ("missing_files", "unverifiable_files"):
+                summary[key] = len(value)
+                summary[f"{key}_sample"] = [doc["filename"] for doc in value[:REPORT_SAMPLE]]
+            elif key in ("unindexed_files", "duplicate_documents"):
+                summary[key] = len(value)
+                summary[f"{key}_sample"] = value[:REPORT_SAMPLE]
+            elif isinstance(value, list):
+                summary[key] = len(value)
+            else:
+                summary[key] = value
+        return summary
+
+    # ------------------------------------------------------------------
+    # Reparación
+    # ------------------------------------------------------------------
+
+    def _repair(self, findings: Dict[str, Any], prune_missing: bool, rebuild: Optional[bool],
+                vacuum: bool) -> Dict[str, Any]:
+        kb = self.kb
+        actions: Dict[str, Any] = {}
+
+        if prune_missing:
+            pruned = 0
+            for doc in findings["missing_files"]:
+                try:
+                    kb.delete(doc["doc_id"])
+                    pruned += 1
+                except KeyError:
+                    pass
+            actions["documents_pruned"] = pruned
+
+        with kb._lock:
+            # Revalidar con el lock tomado: una escritura pudo registrar IDs entretanto
+            documents = kb.registry.list_documents()
+            active = self._active_chunk_ids(documents)
+            versions = kb.registry.version_keys()
+
+            stale = [chunk_id for chunk_id in findings["orphan_vectors"] if chunk_id not in active]
+            for start in range(0, len(stale), BATCH_SIZE):
+                kb.vectorstore._collection.delete(ids=stale[start:start + BATCH_SIZE])
+            actions["vectors_removed"] = len(stale)
+
+            if kb.summaries and findings["orphan_summaries"]:
+                doc_ids = {doc["doc_id"] for doc in documents}
+                orphans = [doc_id for doc_id in findings["orphan_summaries"] if doc_id not in doc_ids]
+                if orphans:
+                    kb.summaries.collection.delete(ids=orphans)
+                actions["summaries_removed"] = len(orphans)
+
+            actions["segments_removed"] = self._remove_files(
+                self._orphan_paths(kb.chunk_store.root_dir, versions, suffix=".seg")
+            )
+            actions["snapshots_removed"] = self._remove_files(self._orphan_paths(kb.versions_dir, versions))
+
+            # Los resultados en caché pueden apuntar a vectores eliminados
+            kb.registry.invalidate()
+            # Recalcular las estadísticas del catálogo por si alguna escritura externa las desvió
+            kb.registry.rebuild_stats()
+            if vacuum:
+                actions["vacuumed"] = self._vacuum()
+
+        if rebuild is None:
+            rebuild = findings["dead_ratio"] >= self.rebuild_threshold
+        actions["ann_index_rebuilt"] = self._rebuild_collection() if rebuild else False
+
+        # La colección sustituida se borra fuera del lock, cuando ya nadie la usa
+        if self._retired_collection:
+            time.sleep(RETIRE_GRACE_SECONDS)
+            self._drop_collection(self._retired_collection)
+            self._retired_collection = None
+
+        # Tras reconstruir, los segmentos de la colección anterior quedan sin referencia
+        index_dirs = self._orphan_index_dirs()
+        for path in index_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+        actions["index_dirs_removed"] = len(index_dirs)
+
+        return actions
+
+    @staticmethod
+    def _remove_files(paths: List[str]) -> int:
+        removed = 0
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+                parent = os.path.dirname(path)
+                if not os.listdir(parent):
+                    os.rmdir(parent)
+            except OSError as e:
+                logger.warning(f"⚠️ No se pudo eliminar {path}: {e}")
+        return removed
+
+    def _rebuild_collection(self) -> bool:
+        """Copiar la colección a una nueva (HNSW sin huecos de borrados) y sustituirla
+
+        La copia se hace sin el lock de escritura. Después, con el lock tomado,
+        se añaden los vectores que se escribieron entretanto, se quitan los que
+        se borraron y se cambia la referencia (los IDs de chunk incluyen la
+        versión, así que un ID presente en ambas tiene el mismo vector). La
+        anterior se renombra a `__old` y se borra después de un margen, para que
+        terminen las búsquedas que ya la tenían.
+        """
+        kb = self.kb
+        client = kb.vectorstore._client
+        source = kb.vectorstore._collection
+        name, rebuild_name = source.name, f"{source.name}__rebuild"
+        self._drop_collection(rebuild_name)
+
+        try:
+            target = client.create_collection(rebuild_name, metadata=source.metadata)
+            offset = 0
+            while True:
+                batch = source.get(include=["embeddings", "metadatas"], limit=BATCH_SIZE, offset=offset)
+                if not batch["ids"]:
+                    break
+                target.add(ids=batch["ids"], embeddings=batch["embeddings"], metadatas=batch["metadatas"])
+                offset += len(batch["ids"])
+        except Exception as e:
+            logger.error(f"❌ No se pudo reconstruir el índice ANN: {e}")
+            self._drop_collection(rebuild_name)
+            return False
+
+        with kb._lock:
+            try:
+                source_ids = set(self._collection_ids(source))
+                target_ids = set(self._collection_ids(target))
+                added = sorted(source_ids - target_ids)
+                for start in range(0, len(added), BATCH_SIZE):
+                    batch = source.get(ids=added[start:start + BATCH_SIZE], include=["embeddings", "metadatas"])
+                    target.add(ids=batch["ids"], embeddings=batch["embeddings"], metadatas=batch["metadatas"])
+                removed = sorted(target_ids - source_ids)
+                for start in range(0, len(removed), BATCH_SIZE):
+                    target.delete(ids=removed[start:start + BATCH_SIZE])
+                if target.count() != source.count():
+                    raise RuntimeError(f"copia incompleta ({target.count()} de {source.count()} vectores)")
+            except Exception as e:
+                logger.error(f"❌ No se pudo reconstruir el índice ANN: {e}")
+                self._drop_collection(rebuild_name)
+                return False
+
+            # Las búsquedas nuevas usan la copia desde aquí; la anterior sigue existiendo
+            kb.vectorstore._collection = target
+            self._drop_collection(f"{name}__old")
+            source.modify(name=f"{name}__old")
+            target.modify(name=name)
+
+        self._retired_collection = f"{name}__old"
+        logger.info(f"🔁 Índice ANN reconstruido: {target.count()} vectores "
+                    f"({len(added)} añadidos y {len(removed)} quitados durante la copia)")
+        return True
+
+    def _drop_collection(self, name: str):
+        try:
+            self.kb.vectorstore._client.delete_collection(name)
+        except Exception:
+            pass  # No existe
+
+    def _recover_interrupted_rebuild(self):
+        """Completar o deshacer una reconstrucción interrumpida
+
+        Si la original ya se había renombrado a `__old`, al arrancar se creó una
+        colección vacía con su nombre; entonces se adopta la copia `__rebuild`
+        (el renombrado ocurre tras verificarla, así que está completa) o, si no
+        existe, la original. Los restos se borran.
+        """
+        client = self.kb.vectorstore._client
+        name = self.kb.vectorstore._collection.name
+        leftovers = []
+        for suffix in ("__rebuild", "__old"):
+            try:
+                leftovers.append(client.get_collection(f"{name}{suffix}"))
+            except Exception:
+                continue
+        if not leftovers:
+            return
+
+        if self.kb.vectorstore._collection.count() == 0:
+            for collection in leftovers:
+                if collection.count() > 0:
+                    client.delete_collection(name)
+                    collection.modify(name=name)
+                    self.kb.vectorstore._collection = collection
+                    logger.warning(f"⚠️ Restaurada la colección {name} de una reconstrucción interrumpida")
+                    break
+        for suffix in ("__rebuild", "__old"):
+            self._drop_collection(f"{name}{suffix}")
+
+    def _vacuum(self) -> List[str]:
+        """VACUUM del registro de documentos
+
+        Solo el registro: chroma.sqlite3 lo tiene abierto Chroma (se compacta con
+        el servidor parado, `compact_chroma_sqlite`) y el historial de sesiones
+        no es parte del índice.
+        """
+        vacuumed = []
+        for path in (self.kb.registry.db_path,):
+            name = os.path.basename(path)
+            try:
+                conn = sqlite3.connect(path, timeout=30)
+                try:
+                    conn.execute("VACUUM")
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                finally:
+                    conn.close()
+                vacuumed.append(name)
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ No se pudo ejecutar VACUUM en {name}: {e}")
+        return vacuumed
+
+    # ------------------------------------------------------------------
+    # Medición e informes
+    # ------------------------------------------------------------------
+
+    def _probe_vectors(self) -> List[List[float]]:
+        """Vectores almacenados que sirven de consultas de prueba"""
+        collection = self.kb.vectorstore._collection
+        count = collection.count()
+        if count == 0 or self.probes <= 0:
+            return []
+        offset = int(np.random.default_rng().integers(0, max(count - self.probes, 0) + 1))
+        batch = collection.get(include=["embeddings"], limit=self.probes, offset=offset)
+        return [list(vector) for vector in batch["embeddings"]]
+
+    def _measure_latency(self, vectors: List[List[float]], n_results: int = 10) -> Dict[str, Any]:
+        latencies = []
+        for vector in vectors:
+            started = time.perf_counter()
+            try:
+                self.kb._query([vector], n_results, None)
+            except Exception as e:
+                logger.warning(f"⚠️ Consulta de prueba fallida: {e}")
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+        if not latencies:
+            return {"probes": 0}
+        return {
+            "probes": len(latencies),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 2)
+        }
+
+    def _load_report(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.report_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_report(self, report: Dict[str, Any]):
+        self.last_report = report
+        if report["dry_run"]:
+            return
+        self.last_run_at = report["finished_at"]
+        with open(f"{self.report_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(f"{self.report_path}.tmp", self.report_path)
+
+
+class MaintenanceScheduler:
+    """Lanza el mantenimiento cuando el servidor lleva un rato sin peticiones"""
+
+    def __init__(self, maintenance: IndexMaintenance, interval_hours: float = 24,
+                 idle_seconds: float = 300, prune_missing: bool = False, check_seconds: float = 60):
+        self.maintenance = maintenance
+        self.interval_seconds = interval_hours * 3600
+        self.idle_seconds = idle_seconds
+        self.prune_missing = prune_missing
+        self.check_seconds = check_seconds
+        self.last_activity = time.time()
+        self._last_attempt = 0.0
+        self._worker: Optional[threading.Thread] = None
+
+    def touch(self):
+        """Registrar actividad (cada petición que no sea un sondeo de estado)"""
+        self.last_activity = time.time()
+
+    def start(self):
+        if self._worker is None and self.interval_seconds > 0:
+            self._worker = threading.Thread(target=self._run, name="index-maintenance", daemon=True)
+            self._worker.start()
+
+    def due(self) -> bool:
+        now = time.time()
+        last_run = max(self.maintenance.last_run_at, self._last_attempt)
+        return (
+            not self.maintenance.running
+            and now - last_run >= self.interval_seconds
+            and now - self.last_activity >= self.idle_seconds
+        )
+
+    def _run(self):
+        while True:
+            time.sleep(self.check_seconds)
+            if not self.due():
+                continue
+            self._last_attempt = time.time()
+            try:
+                self.maintenance.run(prune_missing=self.prune_missing)
+            except Exception as e:
+                logger.error(f"❌ Error en el mantenimiento programado: {e}")
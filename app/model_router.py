@@ -0,0 +1,138 @@
+"""
+Modelos de chat intercambiables en caliente
+Mantiene una instancia de OllamaLLM por modelo, precalienta el modelo destino
+antes de activarlo, enruta cada pregunta según su complejidad y registra
+latencia y throughput por modelo para ajustar el enrutado.
+"""
+
+import re
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_ollama import OllamaLLM
+
+logger = logging.getLogger(__name__)
+
+# Palabras que suelen indicar una pregunta que requiere razonamiento
+COMPLEX_MARKERS = [
+    "compara", "comparar", "diferencia", "diferencias", "por qué", "explica", "explicar",
+    "analiza", "analizar", "relación", "ventajas", "desventajas", "resume", "resumir",
+    "evalúa", "justifica", "cuándo conviene", "pros y contras", "paso a paso"
+]
+
+
+class ModelPool:
+    """Instancias de OllamaLLM por modelo con un modelo activo intercambiable"""
+
+    def __init__(self, models: Dict[str, Dict[str, Any]], active: str, base_url: str,
+                 system: str, temperature: float = 0.1, keep_alive: Optional[str] = None):
+        self.models = models
+        self.active = active
+        self.base_url = base_url
+        self.system = system
+        self.temperature = temperature
+        self.keep_alive = keep_alive
+        self._llms: Dict[str, OllamaLLM] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_key: Optional[str] = None) -> OllamaLLM:
+        model_key = model_key or self.active
+        if model_key not in self.models:
+            raise KeyError(model_key)
+        with self._lock:
+            llm = self._llms.get(model_key)
+            if llm is None:
+                llm = OllamaLLM(
+                    model=self.models[model_key]["model"],
+                    base_url=self.base_url,
+                    temperature=self.temperature,
+                    keep_alive=self.keep_alive,
+                    system=self.system
+                )
+                self._llms[model_key] = llm
+            return llm
+
+    def warm_up(self, model_key: str) -> float:
+        """Cargar el modelo en Ollama con una generación mínima; devuelve los ms empleados"""
+        started = time.perf_counter()
+        # Instancia aparte con num_predict=1: solo interesa que Ollama cargue el modelo
+        OllamaLLM(
+            model=self.models[model_key]["model"],
+            base_url=self.base_url,
+            keep_alive=self.keep_alive,
+            num_predict=1
+        ).invoke("Hola")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"🔥 Modelo {model_key} precalentado en {elapsed_ms:.0f} ms")
+        return elapsed_ms
+
+    def switch(self, model_key: str) -> Dict[str, Any]:
+        """Precalentar y activar un modelo; si el precalentamiento falla no hay cambio"""
+        if model_key not in self.models:
+            raise KeyError(model_key)
+        warm_up_ms = self.warm_up(model_key)
+        previous, self.active = self.active, model_key
+        logger.info(f"🔄 Modelo activo: {previous} → {model_key}")
+        return {"previous": previous, "active": model_key, "warm_up_ms": round(warm_up_ms, 1)}
+
+
+class QuestionRouter:
+    """Elegir modelo por pregunta: rápidas al modelo ligero, complejas al grande"""
+
+    def __init__(self, fast_model: str, strong_model: str, max_simple_words: int = 15):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.max_simple_words = max_simple_words
+
+    def route(self, question: str) -> Tuple[str, str]:
+        """Devuelve (clave del modelo, motivo)"""
+        text = question.lower()
+        words = len(re.findall(r"\w+", text))
+
+        if words > self.max_simple_words:
+            return self.strong_model, f"{words} palabras"
+        if text.count("?") > 1:
+            return self.strong_model, "varias preguntas"
+        for marker in COMPLEX_MARKERS:
+            if marker in text:
+                return self.strong_model, f"contiene '{marker}'"
+        return self.fast_model, "pregunta simple"
+
+
+class ModelStats:
+    """Latencia y throughput por modelo sobre una ventana de peticiones recientes"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_key: str, latency_ms: float, output_chars: int, error: bool = False):
+        with self._lock:
+            samples = self._samples.setdefault(model_key, deque(maxlen=self.window))
+            totals = self._totals.setdefault(model_key, {"requests": 0, "errors": 0})
+            totals["requests"] += 1
+            if error:
+                totals["errors"] += 1
+            else:
+                samples.append((latency_ms, output_chars))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for model_key, totals in self._totals.items():
+                samples = list(self._samples[model_key])
+                latencies = sorted(latency for latency, _ in samples)
+                seconds = sum(latencies) / 1000
+                result[model_key] = {
+                    **totals,
+                    "avg_latency_ms": round(sum(latencies) / len(latencies), 1) if latencies else None,
+                    "p50_latency_ms": round(latencies[len(latencies) // 2], 1) if latencies else None,
+                    "p95_latency_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1) if latencies else None,
+                    "chars_per_second": round(sum(chars for _, chars in samples) / seconds, 1) if seconds else None
+                }
+            return result
@@ -1,6 +1,8 @@
 # Configuración de modelos disponibles
 # Formato: nombre_modelo = "modelo_ollama"
 
+import os
+
 MODELS = {
     # Modelos ultra-ligeros (1-2GB RAM)
     "tinyllama": {
@@ -64,3 +66,14 @@ MODELS = {
 }
 
 DEFAULT_MODEL = "tinyllama"
+
+
+def embedding_model_from_env() -> str:
+    """Modelo de embeddings de Ollama (EMBEDDING_MODEL, por defecto el de OLLAMA_MODEL)
+
+    Es independiente del modelo de chat: cambiar de modelo de chat no obliga a
+    recalcular embeddings. Admite una clave de MODELS o un nombre de Ollama.
+    """
+    chat_model = os.getenv("OLLAMA_MODEL", DEFAULT_MODEL)
+    model = os.getenv("EMBEDDING_MODEL") or (chat_model if chat_model in MODELS else DEFAULT_MODEL)
+    return MODELS[model]["model"] if model in MODELS else model
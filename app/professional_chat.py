@@ -4,27 +4,35 @@ Optimizado para respuestas coherentes y precisas
 """
 
 from typing import List, Dict, Any, Optional
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langchain.memory import ConversationBufferWindowMemory
 from langchain_core.prompts import PromptTemplate
 from langchain.chains import LLMChain
 import logging
 
+from .session_store import SessionStore, SessionChatMessageHistory
+
 logger = logging.getLogger(__name__)
 
 class ProfessionalRAGChat:
     """Sistema de chat RAG profesional"""
     
-    def __init__(self, llm, retriever, memory_window: int = 10):
+    def __init__(self, llm, retriever, memory_window: int = 10,
+                 session_store: Optional[SessionStore] = None, session_id: Optional[str] = None):
         self.llm = llm
         self.retriever = retriever
         
-        # Memoria con ventana deslizante para mantener contexto relevante
+        # Memoria con ventana deslizante para mantener contexto relevante;
+        # con un SessionStore el historial persiste y se comparte entre workers
+        memory_kwargs = {}
+        if session_store is not None and session_id:
+            memory_kwargs["chat_memory"] = SessionChatMessageHistory(session_store, session_id)
         self.memory = ConversationBufferWindowMemory(
             k=memory_window,
             memory_key="chat_history",
             return_messages=True,
-            output_key="answer"
+            output_key="answer",
+            **memory_kwargs
         )
         
         # Prompt profesional optimizado
@@ -51,11 +59,11 @@ PREGUNTA: {question}
 RESPUESTA PROFESIONAL:"""
         )
         
-        # Chain para generar respuestas
+        # Chain para generar respuestas; el turno se guarda explícitamente en
+        # el historial tras responder
         self.qa_chain = LLMChain(
             llm=self.llm,
             prompt=self.prompt_template,
-            memory=self.memory,
             verbose=True
         )
     
@@ -103,6 +111,10 @@ RESPUESTA PROFESIONAL:"""
                 chat_history=chat_history
             )
             
+            self.memory.chat_memory.add_messages([
+                HumanMessage(content=question), AIMessage(content=response.strip())
+            ])
+            
             # 5. Evaluar confianza de la respuesta
             confidence = self._evaluate_confidence(response, relevant_docs)
             
@@ -128,8 +140,12 @@ RESPUESTA PROFESIONAL:"""
         if not hasattr(self.memory, 'chat_memory') or not self.memory.chat_memory.messages:
             return "No hay conversación previa."
         
+        messages = self.memory.chat_memory.messages
         history_parts = []
-        for message in self.memory.chat_memory.messages[-6:]:  # Últimos 3 intercambios
+        # Resumen de turnos antiguos compactados (solo con SessionStore)
+        if messages and isinstance(messages[0], SystemMessage):
+            history_parts.append(messages[0].content)
+        for message in messages[-6:]:  # Últimos 3 intercambios
             if isinstance(message, HumanMessage):
                 history_parts.append(f"Usuario: {message.content}")
             elif isinstance(message, AIMessage):
@@ -0,0 +1,154 @@
+"""
+Reranking con cross-encoder local (CPU)
+Puntúa por lotes un conjunto amplio de candidatos y conserva solo los mejores,
+respetando un presupuesto de tiempo por consulta: el coste por par medido en
+consultas anteriores decide si el reranking cabe antes de empezar cada lote
+"""
+
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Peso de cada medición nueva en la media móvil del coste por par
+PAIR_COST_SMOOTHING = 0.2
+# Rebaja de la estimación en cada consulta omitida, para volver a medir si la carga baja
+SKIP_DECAY = 0.9
+
+
+class CrossEncoderReranker:
+    """Reranker con presupuesto de latencia y fallback al orden vectorial"""
+
+    def __init__(self, model_name: str, top_n: int = 3, batch_size: int = 8,
+                 budget_ms: int = 400, max_length: int = 512):
+        self.model_name = model_name
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.max_length = max_length
+
+        self._model = None
+        self._load_lock = threading.Lock()
+        # Las consultas llegan desde varios hilos del threadpool
+        self._stats_lock = threading.Lock()
+        self._stats = {"queries": 0, "reranked": 0, "fallbacks": 0, "skipped": 0, "total_ms": 0.0}
+        # Segundos por par (consulta, documento); None hasta la primera medición
+        self._pair_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    def warm_up(self):
+        """Cargar el modelo y ejecutar una predicción para evitar el arranque en frío"""
+        with self._load_lock:
+            if self._model is not None:
+                return
+            try:
+                from sentence_transformers import CrossEncoder
+
+                model = CrossEncoder(self.model_name, device="cpu", max_length=self.max_length)
+                model.predict([("consulta", "documento")])
+                # Primera estimación del coste por par, ya sin el arranque en frío
+                pairs = [("consulta", "documento " * 50)] * self.batch_size
+                start = time.perf_counter()
+                model.predict(pairs, batch_size=len(pairs))
+                self._record_pair_cost(time.perf_counter() - start, len(pairs))
+                self._model = model
+                logger.info(f"✅ Reranker cargado: {self.model_name}")
+            except Exception as e:
+                logger.error(f"❌ No se pudo cargar el reranker {self.model_name}: {e}")
+
+    def warm_up_async(self):
+        threading.Thread(target=self.warm_up, daemon=True, name="reranker-warmup").start()
+
+    def _record(self, **deltas):
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self._stats[key] += value
+
+    def _record_pair_cost(self, seconds: float, pairs: int):
+        cost = seconds / pairs
+        with self._stats_lock:
+            if self._pair_seconds is None:
+                self._pair_seconds = cost
+            else:
+                self._pair_seconds += PAIR_COST_SMOOTHING * (cost - self._pair_seconds)
+
+    def _fits(self, pairs: int, remaining: float) -> bool:
+        """¿Caben `pairs` pares en `remaining` segundos según el coste medido?"""
+        with self._stats_lock:
+            return self._pair_seconds is None or self._pair_seconds * pairs <= remaining
+
+    def rerank(self, query: str, documents: List[Document]) -> List[Document]:
+        """Reordenar candidatos; si el presupuesto no alcanza se usa el orden vectorial
+
+        Un reranking parcial no sirve (se volvería al orden vectorial), así que
+        si la estimación dice que los candidatos no caben no se puntúa ninguno.
+        """
+        self._record(queries=1)
+        if len(documents) <= 1:
+            return documents[:self.top_n]
+        if self._model is None:
+            self._record(fallbacks=1)
+            return documents[:self.top_n]
+
+        budget = self.budget_ms / 1000
+        if not self._fits(len(documents), budget):
+            with self._stats_lock:
+                self._stats["fallbacks"] += 1
+                self._stats["skipped"] += 1
+                self._pair_seconds *= SKIP_DECAY
+            logger.warning(f"⏱️ Reranking de {len(documents)} candidatos no cabe en {self.budget_ms} ms, "
+                           "usando orden vectorial")
+            return documents[:self.top_n]
+
+        start = time.perf_counter()
+        scores: List[float] = []
+        for i in range(0, len(documents), self.batch_size):
+            # No seguir si lo que queda no puede terminar dentro del presupuesto
+            if scores and not self._fits(len(documents) - i, budget - (time.perf_counter() - start)):
+                break
+            batch_start = time.perf_counter()
+            pairs = [(query, doc.page_content) for doc in documents[i:i + self.batch_size]]
+            scores.extend(float(s) for s in self._model.predict(pairs, batch_size=len(pairs)))
+            self._record_pair_cost(time.perf_counter() - batch_start, len(pairs))
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._record(total_ms=elapsed_ms)
+
+        if len(scores) < len(documents):
+            self._record(fallbacks=1)
+            logger.warning(f"⏱️ Reranking excedió el presupuesto ({elapsed_ms:.0f} ms), usando orden vectorial")
+            return documents[:self.top_n]
+
+        self._record(reranked=1)
+        ranked = sorted(zip(scores, documents), key=lambda pair: pair[0], reverse=True)
+        results = []
+        for score, doc in ranked[:self.top_n]:
+            doc.metadata['rerank_score'] = score
+            results.append(doc)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+            pair_seconds = self._pair_seconds
+        queries = stats["queries"]
+        return {
+            "model": self.model_name,
+            "ready": self.ready,
+            "top_n": self.top_n,
+            "budget_ms": self.budget_ms,
+            "queries": queries,
+            "reranked": stats["reranked"],
+            "fallbacks": stats["fallbacks"],
+            # Omitidos sin puntuar porque la estimación superaba el presupuesto
+            "skipped": stats["skipped"],
+            "avg_ms": round(stats["total_ms"] / queries, 1) if queries else 0.0,
+            "pair_ms": round(pair_seconds * 1000, 2) if pair_seconds is not None else None
+        }
@@ -0,0 +1,109 @@
+"""
+Retriever sobre la base de conocimiento
+Adapta KnowledgeBase.search a la interfaz de retrievers de LangChain,
+con una etapa opcional de reranking sobre un conjunto amplio de candidatos,
+una caché de resultados que evita embeddings y búsqueda en consultas repetidas
+y respuestas a nivel de resumen para preguntas generales
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .summaries import is_summary_question
+
+logger = logging.getLogger(__name__)
+
+
+class KnowledgeBaseRetriever(BaseRetriever):
+    """Retriever MMR que lee el texto de los chunks solo para los resultados finales"""
+
+    knowledge_base: Any
+    k: int = 5
+    fetch_k: int = 10
+    lambda_mult: Optional[float] = 0.7
+    filters: Optional[Dict[str, Any]] = None
+    reranker: Any = None
+    rerank_candidates: int = 20
+    cache: Any = None
+    max_documents: Optional[int] = None
+    summary_answers: bool = False
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        # Preguntas generales ("¿de qué trata...?") se responden con los resúmenes
+        if self.summary_answers and is_summary_question(query):
+            documents = self.knowledge_base.search_summaries(query, k=self.k, filters=self.filters)
+            if documents:
+                return documents
+
+        if self.cache is None:
+            return self._search(query)[0]
+
+        # La generación se lee antes de buscar: si el índice cambia mientras
+        # tanto, la entrada nace obsoleta y no se reutiliza
+        generation = self.knowledge_base.registry.generation()
+        key = self.cache.make_key(query, self.filters, self._cache_params())
+        hits = self.cache.get(key, generation)
+        if hits is not None:
+            return self._from_cache(hits)
+
+        documents, cacheable = self._search(query)
+        # El orden vectorial de un fallback del reranker (modelo aún cargando o
+        # presupuesto agotado) no debe servirse después como si estuviera reordenado
+        if cacheable:
+            self.cache.put(key, generation, [self._to_cache(doc) for doc in documents])
+        return documents
+
+    def _search(self, query: str) -> Tuple[List[Document], bool]:
+        """Documentos recuperados y si el resultado es el definitivo (cacheable)"""
+        if self.reranker is None:
+            return self.knowledge_base.search(
+                query, k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult,
+                filters=self.filters, max_documents=self.max_documents
+            ), True
+
+        # Conjunto amplio de candidatos; el reranker conserva solo los mejores
+        candidates = self.knowledge_base.search(
+            query, k=self.rerank_candidates, fetch_k=self.rerank_candidates * 2,
+            lambda_mult=self.lambda_mult, filters=self.filters, max_documents=self.max_documents
+        )
+        documents = self.reranker.rerank(query, candidates)
+        # Con más de un candidato, solo el reranking completo asigna rerank_score
+        reranked = len(candidates) <= 1 or all('rerank_score' in doc.metadata for doc in documents)
+        return documents, reranked
+
+    def _cache_params(self) -> tuple:
+        reranking = self.reranker is not None
+        return (self.k, self.fetch_k, self.lambda_mult, reranking,
+                self.rerank_candidates if reranking else None, self.max_documents)
+
+    @staticmethod
+    def _to_cache(doc: Document) -> Dict[str, Any]:
+        """Guardar solo la dirección del chunk y sus puntuaciones, no el texto"""
+        metadata = doc.metadata
+        return {
+            "chunk_id": metadata['chunk_id'],
+            "location": {
+                'doc_id': metadata['doc_id'],
+                'page': metadata['page'],
+                'offset': metadata['offset'],
+                'length': metadata['length']
+            },
+            "score": metadata['score'],
+            "rerank_score": metadata.get('rerank_score')
+        }
+
+    def _from_cache(self, hits: List[Dict[str, Any]]) -> List[Document]:
+        documents = self.knowledge_base.hydrate(
+            [(hit["chunk_id"], hit["location"], hit["score"]) for hit in hits]
+        )
+        rerank_scores = {hit["chunk_id"]: hit["rerank_score"] for hit in hits}
+        for doc in documents:
+            if rerank_scores.get(doc.metadata['chunk_id']) is not None:
+                doc.metadata['rerank_score'] = rerank_scores[doc.metadata['chunk_id']]
+        return documents
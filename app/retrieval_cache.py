@@ -0,0 +1,73 @@
+"""
+Caché LRU de resultados de recuperación
+Asocia la consulta normalizada (y sus filtros) con los chunks recuperados.
+Cada entrada guarda la generación del índice en que se calculó: cualquier
+ingesta o borrado incrementa la generación e invalida las entradas previas.
+"""
+
+import re
+import json
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """Normalizar una consulta para que variaciones triviales compartan entrada"""
+    text = unicodedata.normalize("NFKC", query).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.strip("¿?¡!.,;: ")
+
+
+class RetrievalCache:
+    """Caché LRU con invalidación por generación del índice"""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[int, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0}
+
+    @staticmethod
+    def make_key(query: str, filters: Optional[Dict[str, Any]], params: Tuple) -> Tuple:
+        return (normalize_query(query), json.dumps(filters or {}, sort_keys=True), params)
+
+    def get(self, key: Tuple, generation: int) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[0] != generation:
+                # Calculada sobre un índice que ya cambió
+                del self._entries[key]
+                self._stats["stale"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key: Tuple, generation: int, hits: List[Dict[str, Any]]):
+        with self._lock:
+            self._entries[key] = (generation, hits)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._stats["hits"],
+                "misses": self._stats["misses"],
+                "stale": self._stats["stale"],
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0
+            }
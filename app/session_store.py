@@ -0,0 +1,249 @@
+"""
+Historial de conversación persistente por sesión
+Los mensajes se guardan en SQLite en modo solo-anexar, de modo que sobreviven
+a reinicios y se comparten entre workers. Una compactación en segundo plano
+resume los turnos antiguos: el prompt recibe el resumen y solo los mensajes
+recientes, por larga que sea la conversación.
+"""
+
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    summary TEXT,
+    summary_upto INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id);
+"""
+
+SUMMARY_PROMPT = """Resume en español la siguiente conversación entre un usuario y un asistente \
+sobre sus documentos. Conserva los temas tratados, los datos concretos mencionados y las preguntas \
+pendientes. Sé breve (máximo 10 líneas).
+
+Resumen anterior:
+{summary}
+
+Nuevos mensajes:
+{messages}
+
+Resumen actualizado:"""
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+class SessionStore:
+    """Mensajes por sesión (solo anexar) con un resumen acumulado de los turnos antiguos"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            # WAL: lecturas de otros workers sin bloquear las escrituras
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Abrir una conexión serializada y confirmar al salir"""
+        with self._lock:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+    def append(self, session_id: str, messages: Sequence[Dict[str, str]]):
+        """Anexar mensajes ({role, content}) en una transacción"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, created_at, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET updated_at = excluded.updated_at",
+                (session_id, now, now)
+            )
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                [(session_id, message["role"], message["content"], now) for message in messages]
+            )
+
+    def context(self, session_id: str) -> Dict[str, Any]:
+        """Resumen acumulado y mensajes posteriores a él"""
+        with self._connect() as conn:
+            session = conn.execute(
+                "SELECT summary, summary_upto FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if session is None:
+                return {"summary": None, "summary_upto": 0, "messages": []}
+            rows = conn.execute(
+                "SELECT id, role, content FROM messages WHERE session_id = ? AND id > ? ORDER BY id",
+                (session_id, session["summary_upto"])
+            ).fetchall()
+        return {
+            "summary": session["summary"],
+            "summary_upto": session["summary_upto"],
+            "messages": [dict(row) for row in rows]
+        }
+
+    def set_summary(self, session_id: str, summary: str, upto: int, expected_upto: int) -> bool:
+        """Guardar un resumen que cubre hasta el mensaje `upto`
+
+        Solo se aplica si nadie compactó la sesión mientras tanto.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE sessions SET summary = ?, summary_upto = ? WHERE session_id = ? AND summary_upto = ?",
+                (summary, upto, session_id, expected_upto)
+            )
+        return cursor.rowcount == 1
+
+    def info(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            session = conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if session is None:
+                return None
+            counts = conn.execute(
+                "SELECT COUNT(*) AS total, "
+                "SUM(role = 'human') AS questions, SUM(role = 'ai') AS answers, "
+                "SUM(id > ?) AS uncompacted FROM messages WHERE session_id = ?",
+                (session["summary_upto"], session_id)
+            ).fetchone()
+            last = conn.execute(
+                "SELECT content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1", (session_id,)
+            ).fetchone()
+        return {
+            "session_id": session_id,
+            "created_at": session["created_at"],
+            "updated_at": session["updated_at"],
+            "has_summary": session["summary"] is not None,
+            "message_count": counts["total"],
+            "user_questions": counts["questions"] or 0,
+            "ai_responses": counts["answers"] or 0,
+            "uncompacted_messages": counts["uncompacted"] or 0,
+            "last_activity": last["content"][:100] if last else None
+        }
+
+    def delete(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+class SessionChatMessageHistory(BaseChatMessageHistory):
+    """Historial de LangChain respaldado por el SessionStore
+
+    `messages` devuelve la vista compactada: el resumen (como SystemMessage)
+    seguido de los mensajes aún no resumidos.
+    """
+
+    def __init__(self, store: SessionStore, session_id: str):
+        self.store = store
+        self.session_id = session_id
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        context = self.store.context(self.session_id)
+        messages: List[BaseMessage] = []
+        if context["summary"]:
+            messages.append(SystemMessage(content=f"Resumen de la conversación anterior: {context['summary']}"))
+        for row in context["messages"]:
+            message_class = HumanMessage if row["role"] == "human" else AIMessage
+            messages.append(message_class(content=row["content"]))
+        return messages
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store.append(self.session_id, [
+            {"role": message.type, "content": message.content} for message in messages
+        ])
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
+
+    def clear(self) -> None:
+        self.store.delete(self.session_id)
+
+
+class SessionCompactor:
+    """Sustituye los turnos antiguos de una sesión por un resumen generado por el LLM"""
+
+    def __init__(self, store: SessionStore, keep_recent: int = 6, trigger: int = 12):
+        self.store = store
+        self.keep_recent = keep_recent
+        self.trigger = max(trigger, keep_recent + 2)
+        self._running = set()
+        self._lock = threading.Lock()
+        self.stats = {"compactions": 0, "messages_compacted": 0, "errors": 0}
+
+    def needs_compaction(self, session_id: str) -> bool:
+        return len(self.store.context(session_id)["messages"]) >= self.trigger
+
+    def compact(self, session_id: str, llm) -> bool:
+        """Resumir todo salvo los `keep_recent` mensajes más recientes
+
+        Pensado para ejecutarse en segundo plano; una sesión solo se compacta
+        una vez a la vez.
+        """
+        with self._lock:
+            if session_id in self._running:
+                return False
+            self._running.add(session_id)
+        try:
+            context = self.store.context(session_id)
+            pending = context["messages"]
+            if len(pending) < self.trigger:
+                return False
+
+            to_fold = pending[:-self.keep_recent] if self.keep_recent else pending
+            transcript = "\n".join(
+                f"{'Usuario' if row['role'] == 'human' else 'Asistente'}: {row['content']}" for row in to_fold
+            )
+            summary = llm.invoke(SUMMARY_PROMPT.format(
+                summary=context["summary"] or "(sin resumen)",
+                messages=transcript
+            )).strip()
+
+            applied = self.store.set_summary(
+                session_id, summary, upto=to_fold[-1]["id"], expected_upto=context["summary_upto"]
+            )
+            if applied:
+                self.stats["compactions"] += 1
+                self.stats["messages_compacted"] += len(to_fold)
+                logger.info(f"🗜️ Sesión {session_id[:8]}: {len(to_fold)} mensajes resumidos")
+            return applied
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"⚠️ No se pudo compactar la sesión {session_id[:8]}: {e}")
+            return False
+        finally:
+            with self._lock:
+                self._running.discard(session_id)
@@ -4,6 +4,9 @@ document.addEventListener('DOMContentLoaded', function() {
     const form = document.getElementById('chat-form');
     const messageInput = document.getElementById('message-input');
     const sendBtn = document.getElementById('send-btn');
+    const modelSelect = document.getElementById('model-select');
+    // Sesión de conversación persistente (el servidor también la guarda en una cookie)
+    let sessionId = localStorage.getItem('ragSessionId');
     const infoPanel = document.getElementById('info-panel');
     const responseInfo = document.getElementById('response-info');
 
@@ -94,12 +97,21 @@ document.addEventListener('DOMContentLoaded', function() {
                     headers: {
                         'Content-Type': 'application/x-www-form-urlencoded',
                     },
-                    body: `message=${encodeURIComponent(message)}`
+                    body: new URLSearchParams({
+                        message: message,
+                        ...(sessionId ? { session_id: sessionId } : {}),
+                        ...(modelSelect && modelSelect.value ? { model: modelSelect.value } : {})
+                    }).toString()
                 });
                 
                 if (response.ok) {
                     const result = await response.json();
                     
+                    if (result.session_id && result.session_id !== sessionId) {
+                        sessionId = result.session_id;
+                        localStorage.setItem('ragSessionId', sessionId);
+                    }
+                    
                     // Mostrar respuesta con metadata
                     addMessage(result.response || 'Respuesta recibida', false, {
                         sources: result.sources || [],
@@ -154,6 +166,9 @@ document.addEventListener('DOMContentLoaded', function() {
                         if (fileResult.status === 'success') {
                             successCount++;
                             summary += `✅ <strong>${fileResult.filename}</strong>: ${fileResult.message}<br>`;
+                        } else if (fileResult.status === 'unchanged' || fileResult.status === 'duplicate') {
+                            successCount++;
+                            summary += `ℹ️ <strong>${fileResult.filename}</strong>: ${fileResult.message}<br>`;
                         } else {
                             errorCount++;
                             summary += `❌ <strong>${fileResult.filename}</strong>: ${fileResult.message}<br>`;
@@ -0,0 +1,204 @@
+"""
+Índice de resúmenes por documento
+Cada documento indexado recibe, en segundo plano, un resumen generado por el
+LLM cuyo embedding se guarda en una colección pequeña aparte. Las consultas
+eligen primero los documentos más relevantes en esa colección y después
+buscan fragmentos solo dentro de ellos; las preguntas generales sobre los
+documentos se responden directamente con los resúmenes.
+
+Los documentos que ya estaban sin resumen al arrancar (p. ej. ingestados por
+CLI) se resumen poco a poco, solo cuando el LLM lleva un rato sin otros
+resúmenes pendientes, para no competir con el chat.
+"""
+
+import re
+import queue
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from .vector_filter import query_documents
+
+logger = logging.getLogger(__name__)
+
+# Fórmulas de cortesía que pueden preceder a la petición
+QUESTION_PREFIX = re.compile(
+    r"^[\s¿¡]*(por favor,?\s+)?((me )?(puedes|podr[ií]as)\s+|quiero\s+|necesito\s+)?"
+)
+
+# Preguntas sobre el conjunto o el contenido general de los documentos; se
+# anclan al inicio para que "resumen" o "panorama" dentro de una pregunta
+# concreta ("¿qué dosis indica el resumen de la ficha técnica?") no cuenten
+SUMMARY_QUESTION_PATTERNS = [
+    r"^(de )?qu[eé] (trata|tratan|va|van)\b",
+    r"^res[uú]m(eme|elos|elo|e|ir)\b",
+    r"^(hazme |dame |haz )?un res[uú]men (de|del|general)\b",
+    r"^qu[eé] (documentos|archivos|temas) (hay|tengo|tienes|cubren|incluyen)\b",
+    r"^(cu[aá]les son )?(los )?temas? principal(es)?\b",
+    r"^(dame |danos )?(una )?visi[oó]n general\b",
+    r"^(dame |danos )?(un )?panorama (general|de)\b",
+]
+
+
+def is_summary_question(question: str) -> bool:
+    """¿La pregunta pide una visión general y no un dato concreto?"""
+    text = QUESTION_PREFIX.sub("", question.lower(), count=1)
+    return any(re.match(pattern, text) for pattern in SUMMARY_QUESTION_PATTERNS)
+
+
+class SummaryIndex:
+    """Colección de embeddings de resúmenes y trabajo en segundo plano que la mantiene"""
+
+    def __init__(self, collection, registry, chunk_store, processor, embeddings, max_chars: int = 6000,
+                 backfill_interval: float = 60):
+        self.collection = collection
+        self.registry = registry
+        self.chunk_store = chunk_store
+        self.processor = processor
+        self.embeddings = embeddings
+        self.max_chars = max_chars
+        # Segundos sin otros resúmenes antes de cada uno de relleno (0: sin relleno)
+        self.backfill_interval = backfill_interval
+
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._queued = set()
+        # Documentos sin resumen de su versión activa: se leen del registro una
+        # vez y después los mantienen schedule, summarize y delete
+        self._pending: Set[str] = set(registry.missing_summaries())
+        self._failed: Set[str] = set()
+        self._backfilling = False
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self.stats = {"summarized": 0, "errors": 0}
+
+    # ------------------------------------------------------------------
+    # Trabajo en segundo plano
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Arrancar el hilo que genera los resúmenes pendientes"""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="summary-index", daemon=True)
+            self._worker.start()
+
+    def schedule(self, doc_id: str):
+        """Encolar un documento con una versión nueva; si ya está en cola no se duplica"""
+        with self._lock:
+            self._pending.add(doc_id)
+            self._failed.discard(doc_id)
+            if doc_id in self._queued:
+                return
+            self._queued.add(doc_id)
+        self._queue.put(doc_id)
+
+    def backfill(self) -> int:
+        """Resumir poco a poco los documentos que ya estaban sin resumen (p. ej. ingesta por CLI)"""
+        with self._lock:
+            pending = len(self._pending)
+            self._backfilling = self.backfill_interval > 0
+        if pending:
+            logger.info(f"🧾 {pending} documentos pendientes de resumen"
+                        + ("" if self._backfilling else " (relleno desactivado)"))
+        return pending
+
+    def pending(self, allowed: Optional[set] = None) -> Set[str]:
+        """Documentos sin resumen de su versión activa, entre `allowed` si se indica"""
+        with self._lock:
+            if allowed is None:
+                return set(self._pending)
+            return {doc_id for doc_id in self._pending if doc_id in allowed}
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _next_backfill(self) -> Optional[str]:
+        with self._lock:
+            if not self._backfilling:
+                return None
+            for doc_id in self._pending:
+                if doc_id not in self._queued and doc_id not in self._failed:
+                    return doc_id
+            self._backfilling = False
+        logger.info("🧾 Relleno de resúmenes terminado")
+        return None
+
+    def _run(self):
+        while True:
+            try:
+                # Los documentos recién indexados tienen prioridad; el relleno
+                # solo avanza tras `backfill_interval` segundos sin ellos
+                doc_id = self._queue.get(timeout=self.backfill_interval or None)
+                with self._lock:
+                    self._queued.discard(doc_id)
+            except queue.Empty:
+                doc_id = self._next_backfill()
+                if doc_id is None:
+                    continue
+            try:
+                if not self.summarize(doc_id):
+                    with self._lock:
+                        self._failed.add(doc_id)
+            except Exception as e:
+                self.stats["errors"] += 1
+                with self._lock:
+                    self._failed.add(doc_id)
+                logger.warning(f"⚠️ No se pudo resumir {doc_id}: {e}")
+
+    def summarize(self, doc_id: str) -> bool:
+        """Generar, embeber y guardar el resumen de la versión activa de un documento"""
+        record = self.registry.get(doc_id)
+        if record is None:
+            with self._lock:
+                self._pending.discard(doc_id)
+            return False
+        texts = self.chunk_store.read_segment(doc_id, record["version"])
+        summary = self.processor.summarize(texts, record["filename"], self.max_chars)
+        if not summary:
+            return False
+
+        embedding = self.embeddings.embed_documents([summary])[0]
+        # Si entretanto llegó otra versión, este resumen ya no vale
+        if not self.registry.set_summary(doc_id, record["version"], summary):
+            return False
+        self.collection.upsert(
+            ids=[doc_id],
+            embeddings=[embedding],
+            metadatas=[{"doc_id": doc_id, "version": record["version"]}]
+        )
+        with self._lock:
+            # Si ya se volvió a encolar, hay una versión más nueva sin resumir
+            if doc_id not in self._queued:
+                self._pending.discard(doc_id)
+        self.stats["summarized"] += 1
+        return True
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    def top_documents(self, query_embedding: List[float], n: int,
+                      doc_ids: Optional[set] = None) -> List[Dict[str, Any]]:
+        """Los `n` documentos cuyo resumen está más cerca de la consulta, entre `doc_ids` si se indican"""
+        try:
+            results = query_documents(self.collection, [query_embedding], n, doc_ids, include=["distances"])
+        except Exception as e:
+            logger.warning(f"⚠️ Búsqueda de resúmenes fallida: {e}")
+            return []
+        return [
+            {"doc_id": doc_id, "distance": distance}
+            for doc_id, distance in zip(results["ids"][0], results["distances"][0])
+        ]
+
+    def delete(self, doc_id: str):
+        with self._lock:
+            self._pending.discard(doc_id)
+        self.collection.delete(ids=[doc_id])
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "indexed": self.collection.count(),
+            "pending": self.pending_count(),
+            "queued": self._queue.qsize(),
+            "backfilling": self._backfilling
+        }
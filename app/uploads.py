@@ -0,0 +1,380 @@
+"""
+Recepción de archivos en streaming
+Escribe a disco por bloques con aiofiles calculando el hash al vuelo, aplica
+límites de tamaño y gestiona cargas reanudables por partes. Los formularios
+multipart se parsean directamente del cuerpo de la petición, sin volcarlos
+antes a un archivo temporal.
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+from typing import Dict, Any, Optional, AsyncIterator, Callable, List, Tuple
+
+import aiofiles
+from starlette.responses import JSONResponse
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+    from python_multipart.exceptions import MultipartParseError
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+    from multipart.exceptions import MultipartParseError
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """El archivo o la petición superan el límite configurado"""
+
+
+class UploadOffsetMismatch(Exception):
+    """Una parte no continúa donde terminó la anterior"""
+
+
+class UploadMalformed(Exception):
+    """El cuerpo no es un formulario multipart válido"""
+
+
+class RequestSizeLimit:
+    """Middleware ASGI que limita el cuerpo de cualquier petición
+
+    Con Content-Length se rechaza antes de leer nada (400 si es inválido, 413
+    si lo supera). Sin él (chunked) se cuentan los bytes a medida que el
+    endpoint los lee, sea con `request.stream()`, `request.body()` o
+    `request.form()`, y se corta con 413 al superar el límite.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def _too_large(self) -> str:
+        return f"La petición supera el límite de {self.max_bytes // (1024 * 1024)} MB"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None:
+            if not content_length.strip().isdigit():
+                await JSONResponse(status_code=400, content={"detail": "Content-Length inválido"})(scope, receive, send)
+                return
+            if int(content_length) > self.max_bytes:
+                await JSONResponse(status_code=413, content={"detail": self._too_large()})(scope, receive, send)
+                return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise UploadTooLarge(self._too_large())
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except UploadTooLarge as e:
+            if started:
+                raise
+            await JSONResponse(status_code=413, content={"detail": str(e)})(scope, receive, send)
+
+
+async def stream_to_file(chunks: AsyncIterator[bytes], dest_path: str, max_bytes: int,
+                         hasher=None, mode: str = "wb", written: int = 0) -> Tuple[str, int]:
+    """Volcar bloques a disco calculando SHA-256 y cortando al superar `max_bytes`
+
+    Devuelve (hash hexadecimal, bytes totales). Si se supera el límite en una
+    escritura nueva, el archivo parcial se elimina.
+    """
+    hasher = hasher or hashlib.sha256()
+    size = written
+    try:
+        async with aiofiles.open(dest_path, mode) as out:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Se superó el límite de {max_bytes // (1024 * 1024)} MB")
+                hasher.update(chunk)
+                await out.write(chunk)
+    except UploadTooLarge:
+        if mode == "wb" and os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return hasher.hexdigest(), size
+
+
+def discard_uploads(uploads: List[Dict[str, Any]]):
+    """Eliminar los archivos temporales de una recepción multipart"""
+    for upload in uploads:
+        path = upload.get("staged_path")
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+async def receive_multipart(chunks: AsyncIterator[bytes], content_type: str,
+                            staging_path: Callable[[str], str], max_file_bytes: int, max_request_bytes: int,
+                            accept: Optional[Callable[[str], Optional[str]]] = None,
+                            max_field_bytes: int = 64 * 1024) -> Tuple[Dict[str, str], List[Dict[str, Any]]]:
+    """Parsear un formulario multipart a medida que llega, escribiendo cada archivo al área temporal
+
+    Devuelve (campos de texto, archivos). Cada archivo es un dict con
+    `filename`, `staged_path`, `content_hash` y `size`, o con `filename`,
+    `error` y `status_code` si `accept` lo rechazó por su nombre (no se escribe
+    nada) o superó `max_file_bytes` (se deja de escribir y se borra). Superar
+    `max_request_bytes` corta la lectura con UploadTooLarge.
+    """
+    media_type, params = parse_options_header(content_type or "")
+    if media_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise UploadMalformed("Se esperaba un formulario multipart/form-data")
+
+    events: List[Tuple[str, bytes]] = []
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": lambda: events.append(("begin", b"")),
+        "on_header_field": lambda data, start, end: events.append(("header_field", data[start:end])),
+        "on_header_value": lambda data, start, end: events.append(("header_value", data[start:end])),
+        "on_header_end": lambda: events.append(("header_end", b"")),
+        "on_headers_finished": lambda: events.append(("headers_finished", b"")),
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", b"")),
+        "on_end": lambda: events.append(("finished", b"")),
+    })
+
+    fields: Dict[str, str] = {}
+    uploads: List[Dict[str, Any]] = []
+    part: Dict[str, Any] = {}
+    received = 0
+    finished = False
+    try:
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > max_request_bytes:
+                raise UploadTooLarge(f"La petición supera el límite de {max_request_bytes // (1024 * 1024)} MB")
+            try:
+                parser.write(chunk)
+            except MultipartParseError as e:
+                raise UploadMalformed(f"Formulario multipart inválido: {e}")
+
+            for kind, data in events:
+                if kind == "begin":
+                    part = {"headers": {}, "field": b"", "value": b""}
+                elif kind == "header_field":
+                    part["field"] += data
+                elif kind == "header_value":
+                    part["value"] += data
+                elif kind == "header_end":
+                    part["headers"][part["field"].lower()] = part["value"]
+                    part["field"] = part["value"] = b""
+                elif kind == "headers_finished":
+                    _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+                    part["name"] = options.get(b"name", b"").decode("utf-8", "replace")
+                    filename = options.get(b"filename")
+                    if filename is None:
+                        part["buffer"] = bytearray()
+                        continue
+                    filename = os.path.basename(filename.decode("utf-8", "replace"))
+                    upload = {"filename": filename}
+                    part["upload"] = upload
+                    if not filename:
+                        continue  # Campo de archivo vacío en el formulario
+                    error = accept(filename) if accept else None
+                    if error:
+                        upload.update(error=error, status_code=400)
+                        continue
+                    upload.update(staged_path=staging_path(filename), size=0)
+                    part["hasher"] = hashlib.sha256()
+                    part["out"] = await aiofiles.open(upload["staged_path"], "wb")
+                elif kind == "data":
+                    if "buffer" in part:
+                        part["buffer"].extend(data)
+                        if len(part["buffer"]) > max_field_bytes:
+                            raise UploadMalformed(f"El campo {part['name']} es demasiado largo")
+                        continue
+                    out = part.get("out")
+                    if out is None:
+                        continue  # Archivo rechazado: se descarta lo que queda de la parte
+                    upload = part["upload"]
+                    upload["size"] += len(data)
+                    if upload["size"] > max_file_bytes:
+                        await out.close()
+                        part["out"] = None
+                        discard_uploads([upload])
+                        upload.pop("staged_path")
+                        upload.update(error=f"Se superó el límite de {max_file_bytes // (1024 * 1024)} MB",
+                                      status_code=413)
+                        continue
+                    part["hasher"].update(data)
+                    await out.write(data)
+                elif kind == "finished":
+                    finished = True
+                elif kind == "end":
+                    if "buffer" in part:
+                        fields[part["name"]] = part["buffer"].decode("utf-8", "replace")
+                        continue
+                    upload = part.get("upload")
+                    if not upload or not upload["filename"]:
+                        continue
+                    if part.get("out") is not None:
+                        await part["out"].close()
+                        part["out"] = None
+                        upload["content_hash"] = part["hasher"].hexdigest()
+                    uploads.append(upload)
+            events.clear()
+        parser.finalize()
+        if not finished:
+            raise UploadMalformed("El formulario multipart está incompleto")
+    except BaseException:
+        if part.get("out") is not None:
+            await part["out"].close()
+        discard_uploads(uploads + ([part["upload"]] if "upload" in part else []))
+        raise
+    return fields, uploads
+
+
+class ResumableUploads:
+    """Cargas por partes que sobreviven a reintentos y reinicios
+
+    Cada carga tiene un archivo `.part` y un `.json` de estado en el área
+    temporal. El hash incremental se mantiene en memoria; tras un reinicio se
+    recalcula a partir de lo ya recibido.
+    """
+
+    def __init__(self, staging_dir: str, max_file_bytes: int, max_age_hours: int = 24):
+        self.staging_dir = staging_dir
+        self.max_file_bytes = max_file_bytes
+        self.max_age_hours = max_age_hours
+        self._hashers: Dict[str, Any] = {}
+        os.makedirs(staging_dir, exist_ok=True)
+
+    def _state_path(self, upload_id: str) -> str:
+        return os.path.join(self.staging_dir, f"{upload_id}.json")
+
+    def part_path(self, upload_id: str) -> str:
+        return os.path.join(self.staging_dir, f"{upload_id}.part")
+
+    def _save(self, state: Dict[str, Any]):
+        tmp_path = f"{self._state_path(state['upload_id'])}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._state_path(state["upload_id"]))
+
+    def create(self, filename: str, total_size: int, tags: Optional[list] = None) -> Dict[str, Any]:
+        if total_size > self.max_file_bytes:
+            raise UploadTooLarge(f"Se superó el límite de {self.max_file_bytes // (1024 * 1024)} MB")
+        state = {
+            "upload_id": uuid.uuid4().hex,
+            "filename": filename,
+            "total_size": total_size,
+            "received": 0,
+            "tags": tags,
+            "created_at": time.time()
+        }
+        open(self.part_path(state["upload_id"]), "wb").close()
+        self._hashers[state["upload_id"]] = hashlib.sha256()
+        self._save(state)
+        return state
+
+    def get(self, upload_id: str) -> Dict[str, Any]:
+        path = self._state_path(upload_id)
+        if not os.path.exists(path):
+            raise KeyError(upload_id)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _hasher(self, upload_id: str, received: int):
+        """Recuperar el hash incremental, recalculándolo si se perdió"""
+        hasher = self._hashers.get(upload_id)
+        if hasher is None:
+            hasher = hashlib.sha256()
+            with open(self.part_path(upload_id), "rb") as f:
+                remaining = received
+                while remaining > 0:
+                    block = f.read(min(CHUNK_SIZE, remaining))
+                    if not block:
+                        break
+                    hasher.update(block)
+                    remaining -= len(block)
+            self._hashers[upload_id] = hasher
+        return hasher
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Agregar una parte que empieza en `offset`"""
+        state = self.get(upload_id)
+        if offset != state["received"]:
+            raise UploadOffsetMismatch(f"Se esperaba offset {state['received']}, se recibió {offset}")
+
+        part_path = self.part_path(upload_id)
+        # Descartar bytes de una parte anterior que no llegó a confirmarse
+        if os.path.getsize(part_path) != state["received"]:
+            with open(part_path, "r+b") as f:
+                f.truncate(state["received"])
+
+        hasher = self._hasher(upload_id, state["received"])
+        try:
+            _, size = await stream_to_file(
+                chunks, part_path, min(self.max_file_bytes, state["total_size"]),
+                hasher=hasher, mode="ab", written=state["received"]
+            )
+        except Exception:
+            # El hash en memoria pudo incluir bytes no confirmados
+            self._hashers.pop(upload_id, None)
+            raise
+
+        state["received"] = size
+        self._save(state)
+        return state
+
+    def finish(self, upload_id: str, dest_path: str) -> Tuple[Dict[str, Any], str]:
+        """Cerrar una carga completa: mover el archivo y devolver (estado, hash)"""
+        state = self.get(upload_id)
+        if state["received"] != state["total_size"]:
+            raise UploadOffsetMismatch(
+                f"Carga incompleta: {state['received']} de {state['total_size']} bytes"
+            )
+        content_hash = self._hasher(upload_id, state["received"]).hexdigest()
+        os.replace(self.part_path(upload_id), dest_path)
+        self.discard(upload_id)
+        return state, content_hash
+
+    def discard(self, upload_id: str):
+        self._hashers.pop(upload_id, None)
+        for path in (self._state_path(upload_id), self.part_path(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def cleanup(self) -> int:
+        """Eliminar cargas abandonadas más antiguas que `max_age_hours`"""
+        removed = 0
+        limit = time.time() - self.max_age_hours * 3600
+        for name in os.listdir(self.staging_dir):
+            if not name.endswith(".json"):
+                continue
+            upload_id = name[:-len(".json")]
+            try:
+                if self.get(upload_id)["created_at"] < limit:
+                    self.discard(upload_id)
+                    removed += 1
+            except (KeyError, ValueError, OSError):
+                continue
+        if removed:
+            logger.info(f"🧹 {removed} cargas abandonadas eliminadas")
+        return removed
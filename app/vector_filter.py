@@ -0,0 +1,70 @@
+"""
+Consultas vectoriales restringidas a un conjunto de documentos
+Los filtros se resuelven en el registro a una lista de doc_ids. Si es corta se
+pasa a Chroma como pre-filtro `$in`; si es larga no se envía (cada ID sería una
+variable SQL y la consulta crecería con el corpus): se consulta el índice
+completo pidiendo más candidatos y se descartan los de otros documentos.
+"""
+
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Máximo de doc_ids que se envían a Chroma en un `$in`
+MAX_WHERE_IDS = 500
+
+# Candidatos pedidos por resultado al post-filtrar, y crecimiento si no bastan
+OVERFETCH_FACTOR = 4
+
+
+def doc_where(doc_ids: Optional[Iterable[str]]) -> Optional[Dict[str, Any]]:
+    """Pre-filtro de Chroma para unos documentos; None si no hay que filtrar o son demasiados"""
+    if doc_ids is None:
+        return None
+    doc_ids = list(doc_ids)
+    if not doc_ids or len(doc_ids) > MAX_WHERE_IDS:
+        return None
+    return {"doc_id": doc_ids[0]} if len(doc_ids) == 1 else {"doc_id": {"$in": doc_ids}}
+
+
+def query_documents(collection, query_embeddings: List[List[float]], n_results: int,
+                    doc_ids: Optional[set], include: List[str]) -> Dict[str, Any]:
+    """`collection.query` limitado a `doc_ids` (None: todos), con la misma forma de resultado"""
+    where = doc_where(doc_ids)
+    if doc_ids is None or where is not None:
+        return collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=include
+        )
+
+    keys = ["ids"] + [key for key in include if key != "ids"]
+    if "metadatas" not in include:
+        include = include + ["metadatas"]
+    empty = {key: [[] for _ in query_embeddings] for key in keys}
+
+    total = collection.count()
+    if not total or not doc_ids:
+        return empty
+
+    fetch = n_results * OVERFETCH_FACTOR
+    while True:
+        fetch = min(fetch, total)
+        results = collection.query(query_embeddings=query_embeddings, n_results=fetch, include=include)
+
+        filtered = {key: [] for key in keys}
+        for position, metadatas in enumerate(results["metadatas"]):
+            kept = [
+                i for i, metadata in enumerate(metadatas)
+                if metadata and metadata.get("doc_id") in doc_ids
+            ][:n_results]
+            for key in keys:
+                filtered[key].append([results[key][position][i] for i in kept])
+
+        if fetch >= total or all(len(ids) >= n_results for ids in filtered["ids"]):
+            if fetch > n_results * OVERFETCH_FACTOR:
+                logger.debug(f"🔎 Post-filtro de {len(doc_ids)} documentos: {fetch} candidatos leídos")
+            return filtered
+        fetch *= OVERFETCH_FACTOR
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Envía un lote de preguntas en JSONL a /api/batch y guarda las respuestas
+
+Cada línea de entrada es {"id": ..., "question": ..., "filters": {...}} o
+una cadena con la pregunta. Las respuestas se escriben en JSONL a medida que
+el servidor las termina, con los tiempos de cada pregunta.
+
+Uso:
+    python scripts/batch_qa.py preguntas.jsonl [-o respuestas.jsonl] [--concurrency N]
+"""
+import os
+import sys
+import json
+import argparse
+import urllib.error
+import urllib.request
+
+from dotenv import load_dotenv
+
+
+def run_batch(input_path: str, output, api_url: str, concurrency: int, timeout: int) -> int:
+    """Enviar el lote y volcar los resultados; devuelve el número de preguntas con error"""
+    with open(input_path, "rb") as f:
+        body = f.read()
+
+    request = urllib.request.Request(
+        f"{api_url.rstrip('/')}/api/batch?concurrency={concurrency}",
+        data=body,
+        headers={"Content-Type": "application/x-ndjson"},
+        method="POST"
+    )
+    errors = 0
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        for line in response:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+
+            if "summary" in result:
+                summary = result["summary"]
+                print(
+                    f"✅ {summary['questions']} preguntas, {summary['errors']} errores "
+                    f"en {summary.get('total_ms', 0) / 1000:.1f}s "
+                    f"(embeddings {summary.get('embed_ms', 0):.0f} ms, búsqueda {summary.get('search_ms', 0):.0f} ms)",
+                    file=sys.stderr
+                )
+                errors = summary["errors"]
+            else:
+                timings = result.get("timings", {})
+                status = "❌" if "error" in result else "✓"
+                print(f"{status} [{result.get('id')}] {timings.get('generation_ms', 0):.0f} ms", file=sys.stderr)
+    return errors
+
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Archivo JSONL con las preguntas")
+    parser.add_argument("-o", "--output", help="Archivo JSONL de salida (por defecto stdout)")
+    parser.add_argument("--api-url", default=os.getenv("API_URL", "http://localhost:8000"))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "2")),
+                        help="Generaciones simultáneas (limitado por BATCH_CONCURRENCY en el servidor)")
+    parser.add_argument("--timeout", type=int, default=3600, help="Tiempo máximo sin respuesta, en segundos")
+    args = parser.parse_args()
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        failed = run_batch(args.input, output, args.api_url, args.concurrency, args.timeout)
+    except urllib.error.HTTPError as e:
+        print(f"❌ {e.code}: {e.read().decode('utf-8', 'replace')}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if args.output:
+            output.close()
+    sys.exit(1 if failed else 0)
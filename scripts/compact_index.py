@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Migra una colección Chroma al formato compacto y reporta el tamaño del índice
+
+- Los datos por documento pasan al registro (registry.sqlite3)
+- Cada chunk conserva solo su vector y (doc_id, página, offset, longitud)
+- El texto se mueve al almacén comprimido (vectorstore/chunks)
+- Los chunks duplicados de un mismo archivo se descartan
+- Los chunks heredados de documentos ya registrados se descartan: sus
+  vectores compactos ya están en la colección
+
+Los embeddings existentes se reutilizan: no se llama al modelo.
+
+Reescribe la colección y ejecuta VACUUM en chroma.sqlite3, así que el servidor
+debe estar parado (docker-compose stop app); si está en marcha, el script se
+niega a ejecutarse.
+"""
+import os
+import sys
+import sqlite3
+import argparse
+import logging
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chromadb
+from dotenv import load_dotenv
+
+from app.chunk_store import ChunkStore
+from app.document_registry import DocumentRegistry
+from app.knowledge_base import document_id, file_hash, collection_for_model
+from app.maintenance import IndexInUse, directory_size, lock_index
+from app.models_config import embedding_model_from_env
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def size_report(vector_dir: str) -> dict:
+    sqlite_path = os.path.join(vector_dir, "chroma.sqlite3")
+    return {
+        "chroma.sqlite3": os.path.getsize(sqlite_path) if os.path.exists(sqlite_path) else 0,
+        "chunks": directory_size(os.path.join(vector_dir, "chunks")),
+        "total": directory_size(vector_dir)
+    }
+
+
+def read_collection(collection):
+    """Leer la colección completa por lotes"""
+    offset = 0
+    while True:
+        batch = collection.get(
+            include=["embeddings", "metadatas", "documents"],
+            limit=BATCH_SIZE,
+            offset=offset
+        )
+        if not batch["ids"]:
+            break
+        for i, chunk_id in enumerate(batch["ids"]):
+            yield chunk_id, batch["embeddings"][i], batch["metadatas"][i] or {}, batch["documents"][i]
+        offset += len(batch["ids"])
+
+
+def flush(collection, chunks: list) -> int:
+    """Copiar un lote de chunks ya compactos y vaciar el búfer"""
+    if not chunks:
+        return 0
+    collection.upsert(
+        ids=[c[0] for c in chunks],
+        embeddings=[c[1] for c in chunks],
+        metadatas=[c[2] for c in chunks]
+    )
+    count = len(chunks)
+    chunks.clear()
+    return count
+
+
+def compact_collection(vector_dir: str, data_dir: str, collection_name: str):
+    before = size_report(vector_dir)
+
+    client = chromadb.PersistentClient(path=vector_dir)
+    source = client.get_collection(collection_name)
+    target_name = f"{collection_name}__compact"
+    target = client.get_or_create_collection(target_name, metadata=source.metadata)
+
+    registry = DocumentRegistry(os.path.join(vector_dir, "registry.sqlite3"))
+    chunk_store = ChunkStore(os.path.join(vector_dir, "chunks"))
+
+    # Agrupar chunks heredados por archivo; los ya compactos se copian tal cual
+    legacy = defaultdict(list)
+    compact = []
+    copied = 0
+    for chunk_id, embedding, metadata, text in read_collection(source):
+        if 'offset' in metadata:
+            compact.append((chunk_id, embedding, metadata))
+        elif text:
+            legacy[metadata.get('filename', 'desconocido')].append((embedding, metadata, text))
+
+        if len(compact) >= BATCH_SIZE:
+            copied += flush(target, compact)
+    copied += flush(target, compact)
+
+    migrated = duplicates = superseded = 0
+    for filename, chunks in legacy.items():
+        doc_id = document_id(filename)
+        # Registrarlo como nueva versión dejaría huérfanos los vectores de la activa
+        if registry.get(doc_id):
+            superseded += len(chunks)
+            continue
+        chunks.sort(key=lambda c: (c[1].get('page', 0), c[1].get('chunk_id', 0)))
+
+        unique, seen = [], set()
+        for chunk in chunks:
+            if chunk[2] in seen:
+                duplicates += 1
+                continue
+            seen.add(chunk[2])
+            unique.append(chunk)
+
+        version = registry.next_version(doc_id)
+        locations = chunk_store.write_segment(doc_id, version, [c[2] for c in unique])
+        for start in range(0, len(unique), BATCH_SIZE):
+            batch = unique[start:start + BATCH_SIZE]
+            target.upsert(
+                ids=[f"{doc_id}:v{version}:{start + i}" for i in range(len(batch))],
+                embeddings=[c[0] for c in batch],
+                metadatas=[
+                    {
+                        'doc_id': doc_id,
+                        'page': int(c[1].get('page', 0)),
+                        'offset': offset,
+                        'length': length
+                    }
+                    for c, (offset, length) in zip(batch, locations[start:start + len(batch)])
+                ]
+            )
+
+        # Un archivo ausente queda registrado sin hash para que una nueva carga lo reindexe
+        file_path = os.path.join(data_dir, filename)
+        exists = os.path.exists(file_path)
+        registry.register(
+            doc_id=doc_id,
+            filename=filename,
+            file_type=os.path.splitext(filename)[1].lower(),
+            file_size=os.path.getsize(file_path) if exists else 0,
+            content_hash=file_hash(file_path) if exists else "",
+            version=version,
+            chunk_count=len(unique)
+        )
+        migrated += len(unique)
+
+    client.delete_collection(collection_name)
+    target.modify(name=collection_name)
+    del client
+
+    # Recuperar el espacio liberado en SQLite
+    try:
+        conn = sqlite3.connect(os.path.join(vector_dir, "chroma.sqlite3"))
+        conn.execute("VACUUM")
+        conn.close()
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ No se pudo ejecutar VACUUM: {e}")
+
+    after = size_report(vector_dir)
+
+    logger.info(f"✅ {migrated} chunks migrados, {copied} ya compactos, {duplicates} duplicados descartados, "
+                f"{superseded} de documentos ya registrados descartados")
+    logger.info(f"{'componente':<16}{'antes (MB)':>12}{'después (MB)':>14}")
+    for key in before:
+        logger.info(f"{key:<16}{before[key] / 1048576:>12.2f}{after[key] / 1048576:>14.2f}")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    model = embedding_model_from_env()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vector-dir", default=os.getenv("VECTOR_DIR", "vectorstore"))
+    parser.add_argument("--data-dir", default=os.getenv("DATA_DIR", "data"))
+    parser.add_argument("--collection", default=collection_for_model(model))
+    args = parser.parse_args()
+
+    try:
+        index_lock = lock_index(args.vector_dir)
+    except IndexInUse as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+    try:
+        compact_collection(args.vector_dir, args.data_dir, args.collection)
+    finally:
+        index_lock.close()
@@ -1,35 +1,331 @@
 #!/usr/bin/env python3
+"""
+Ingesta masiva de documentos con el mismo pipeline que la aplicación
+
+- Parseo y chunking en paralelo en procesos (DocumentProcessor)
+- Embeddings en paralelo en hilos contra Ollama
+- Escritura serializada en la base de conocimiento (KnowledgeBase.commit)
+- Checkpoint en disco: una ejecución interrumpida se reanuda donde quedó
+- Los .zip se leen miembro a miembro en memoria, sin extraerlos a disco
+- Cada archivo se identifica por su ruta relativa a la carpeta indicada
+  (`sub/informe.pdf`, `sub/lote.zip/miembro.pdf`); dos archivos de la misma
+  ejecución con el mismo nombre relativo se rechazan
+- El contenido ya indexado bajo otro nombre no se vuelve a indexar
+
+Chroma no admite varios procesos escribiendo el mismo directorio: el servidor
+debe estar parado mientras se ejecuta (docker-compose stop app); si está en
+marcha, el script se niega a ejecutarse.
+
+Uso:
+    python scripts/ingest.py [rutas ...] [--parse-workers N] [--embed-workers N]
+"""
 import os
+import sys
+import json
+import time
+import hashlib
 import zipfile
-from pathlib import Path
-from langchain.document_loaders import UnstructuredFileLoader
-from langchain_community.embeddings import OllamaEmbeddings
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+from langchain_ollama import OllamaEmbeddings
 from langchain_community.vectorstores import Chroma
 
-def extract_zip(folder_path):
-    for zip_path in Path(folder_path).rglob("*.zip"):
-        try:
-            with zipfile.ZipFile(zip_path, 'r') as z:
-                z.extractall(folder_path)
-        except Exception as e:
-            print(f"[WARN] No se pudo extraer {zip_path}: {e}")
-
-
-def ingest_folder(folder_path: str, vector_dir: str):
-    extract_zip(folder_path)
-    embeddings = OllamaEmbeddings(model="llama3")
-    docs = []
-    for file_path in Path(folder_path).rglob("*"):
-        ext = file_path.suffix.lower()
-        if ext in ['.pdf', '.docx', '.txt', '.md', '.csv', '.pptx', '.html', '.json', '.png', '.jpg', '.jpeg', '.tiff']:
-            try:
-                loader = UnstructuredFileLoader(str(file_path))
-                docs.extend(loader.load())
-            except Exception as e:
-                print(f"[WARN] Falló cargar {file_path}: {e}")
-    db = Chroma.from_documents(docs, embeddings)
-    db.save_local(vector_dir)
-    print(f"[INFO] Ingestión completada. {len(docs)} documentos indexados.")
+from app.document_processor import DocumentProcessor
+from app.extraction import extractor_from_env
+from app.knowledge_base import (
+    KnowledgeBase, SUPPORTED_EXTENSIONS, collection_for_model, file_hash, prepare_document
+)
+from app.maintenance import IndexInUse, lock_index
+from app.models_config import embedding_model_from_env
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Los .doc necesitan un archivo en disco; dentro de un zip solo se admiten estos
+ZIP_MEMBER_EXTENSIONS = ['.pdf', '.txt', '.docx']
+
+# ----------------------------------------------------------------------
+# Trabajo en procesos de parseo
+# ----------------------------------------------------------------------
+
+_processor = None
+
+
+def init_parse_worker(chunk_size: int, chunk_overlap: int, data_dir: str):
+    global _processor
+    logging.getLogger().setLevel(logging.WARNING)
+    # Cada proceso ya trabaja en paralelo: el OCR/transcripción se ejecuta en línea
+    _processor = DocumentProcessor(
+        None, None, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+        extractor=extractor_from_env(data_dir, workers=0)
+    )
+
+
+def parse_task(path: str, member: str, filename: str, known_hash: str) -> dict:
+    """Leer, comparar hash y dividir en chunks un archivo o un miembro de zip"""
+    start = time.perf_counter()
+
+    if member is None:
+        content_hash = file_hash(path)
+        if content_hash == known_hash:
+            return {"status": "unchanged", "filename": filename}
+        documents = _processor.load_document(path)
+        file_size, source_path = os.path.getsize(path), path
+    else:
+        with zipfile.ZipFile(path) as archive:
+            data = archive.read(member)
+        content_hash = hashlib.sha256(data).hexdigest()
+        if content_hash == known_hash:
+            return {"status": "unchanged", "filename": filename}
+        documents = _processor.load_bytes(data, filename)
+        file_size, source_path = len(data), None
+
+    chunks = _processor.process_documents(documents)
+    if not chunks:
+        return {"status": "error", "filename": filename, "message": "sin fragmentos"}
+
+    prepared = prepare_document(filename, content_hash, file_size, chunks, source_path)
+    prepared["status"] = "ready"
+    prepared["parse_seconds"] = time.perf_counter() - start
+    return prepared
+
+# ----------------------------------------------------------------------
+# Descubrimiento y checkpoint
+# ----------------------------------------------------------------------
+
+
+def relative_name(path: str, root_path: str) -> str:
+    """Nombre del documento: ruta relativa a la carpeta de ingesta, con `/`"""
+    if os.path.isfile(root_path):
+        return os.path.basename(path)
+    return os.path.relpath(path, root_path).replace(os.sep, "/")
+
+
+def discover(paths: list, skip_dirs: set):
+    """Generar tareas (ruta, miembro, clave, firma, nombre) para archivos y miembros de zip"""
+    for root_path in paths:
+        if os.path.isfile(root_path):
+            candidates = [root_path]
+        else:
+            candidates = []
+            for root, dirs, files in os.walk(root_path):
+                dirs[:] = sorted(
+                    d for d in dirs
+                    if not d.startswith(".") and os.path.abspath(os.path.join(root, d)) not in skip_dirs
+                )
+                candidates.extend(os.path.join(root, name) for name in sorted(files))
+
+        for path in candidates:
+            extension = os.path.splitext(path)[1].lower()
+            stat = os.stat(path)
+            filename = relative_name(path, root_path)
+            if extension == ".zip":
+                try:
+                    with zipfile.ZipFile(path) as archive:
+                        members = archive.infolist()
+                except zipfile.BadZipFile as e:
+                    logger.warning(f"⚠️ Zip inválido {path}: {e}")
+                    continue
+                for info in members:
+                    if info.is_dir() or os.path.splitext(info.filename)[1].lower() not in ZIP_MEMBER_EXTENSIONS:
+                        continue
+                    yield (path, info.filename, f"{path}::{info.filename}", f"{info.file_size}:{info.CRC}",
+                           f"{filename}/{info.filename}")
+            elif extension in SUPPORTED_EXTENSIONS:
+                yield path, None, path, f"{stat.st_size}:{int(stat.st_mtime)}", filename
+
+
+class Checkpoint:
+    """Registro append-only de tareas completadas"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.done[entry["key"]] = entry["signature"]
+                    except (ValueError, KeyError):
+                        continue  # Línea truncada por una interrupción
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_done(self, key: str, signature: str) -> bool:
+        return self.done.get(key) == signature
+
+    def mark(self, key: str, signature: str, status: str):
+        self._file.write(json.dumps({"key": key, "signature": signature, "status": status}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.done[key] = signature
+
+    def close(self):
+        self._file.close()
+
+# ----------------------------------------------------------------------
+# Pipeline
+# ----------------------------------------------------------------------
+
+
+def timed_embed(knowledge_base: KnowledgeBase, prepared: dict) -> dict:
+    start = time.perf_counter()
+    knowledge_base.embed(prepared)
+    prepared["embed_seconds"] = time.perf_counter() - start
+    return prepared
+
+
+def run_ingestion(knowledge_base: KnowledgeBase, paths: list, parse_workers: int, embed_workers: int,
+                  checkpoint: Checkpoint, tags: list = None, chunk_size: int = 1000, chunk_overlap: int = 200):
+    stats = {"indexed": 0, "unchanged": 0, "duplicates": 0, "resumed": 0, "failed": 0, "chunks": 0, "bytes": 0,
+             "parse_seconds": 0.0, "embed_seconds": 0.0}
+    known_hashes = {doc["filename"]: doc["content_hash"] for doc in knowledge_base.registry.list_documents()}
+    skip_dirs = {os.path.abspath(knowledge_base.staging_dir)}
+
+    tasks = discover(paths, skip_dirs)
+    claimed = {}  # nombre del documento -> clave del archivo que lo usa en esta ejecución
+    exhausted = False
+    parsing, embedding = {}, {}
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(parse_workers, initializer=init_parse_worker,
+                             initargs=(chunk_size, chunk_overlap, knowledge_base.data_dir)) as parse_pool, \
+            ThreadPoolExecutor(embed_workers) as embed_pool:
+        while True:
+            # Mantener acotado el trabajo en vuelo para no cargar todo en memoria
+            while not exhausted and len(parsing) < parse_workers * 2 and len(embedding) < embed_workers * 2:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                path, member, key, signature, filename = task
+                if claimed.setdefault(filename, key) != key:
+                    logger.error(f"❌ {key} se omite: se indexaría como {filename}, "
+                                 f"igual que {claimed[filename]}")
+                    stats["failed"] += 1
+                    continue
+                if checkpoint.is_done(key, signature):
+                    stats["resumed"] += 1
+                    continue
+                future = parse_pool.submit(parse_task, path, member, filename, known_hashes.get(filename))
+                parsing[future] = (key, signature)
+
+            if not parsing and not embedding:
+                break
+
+            done, _ = wait(list(parsing) + list(embedding), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in parsing:
+                    key, signature = parsing.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"❌ Error parseando {key}: {e}")
+                        stats["failed"] += 1
+                        continue
+                    if result["status"] == "unchanged":
+                        stats["unchanged"] += 1
+                        checkpoint.mark(key, signature, "unchanged")
+                    elif result["status"] == "error":
+                        logger.warning(f"⚠️ {result['filename']}: {result['message']}")
+                        stats["failed"] += 1
+                    elif knowledge_base.find_duplicate(result["doc_id"], result["filename"], result["content_hash"]):
+                        # Sin calcular embeddings; commit lo vuelve a comprobar bajo el lock
+                        stats["duplicates"] += 1
+                        checkpoint.mark(key, signature, "duplicate")
+                    else:
+                        stats["parse_seconds"] += result["parse_seconds"]
+                        embedding[embed_pool.submit(timed_embed, knowledge_base, result)] = (key, signature)
+                else:
+                    key, signature = embedding.pop(future)
+                    try:
+                        prepared = future.result()
+                        committed = knowledge_base.commit(prepared, tags)
+                    except Exception as e:
+                        logger.error(f"❌ Error indexando {key}: {e}")
+                        stats["failed"] += 1
+                        continue
+                    if committed["status"] == "duplicate":
+                        stats["duplicates"] += 1
+                        checkpoint.mark(key, signature, "duplicate")
+                        continue
+                    checkpoint.mark(key, signature, "indexed")
+                    stats["indexed"] += 1
+                    stats["chunks"] += len(prepared["texts"])
+                    stats["bytes"] += prepared["file_size"]
+                    stats["embed_seconds"] += prepared["embed_seconds"]
+
+    stats["elapsed_seconds"] = time.perf_counter() - start
+    return stats
+
+
+def print_summary(stats: dict):
+    elapsed = max(stats["elapsed_seconds"], 1e-9)
+    logger.info("📊 Resumen de ingesta")
+    logger.info(f"   Indexados: {stats['indexed']}  Sin cambios: {stats['unchanged']}  "
+                f"Duplicados: {stats['duplicates']}  "
+                f"Ya en checkpoint: {stats['resumed']}  Fallidos: {stats['failed']}")
+    logger.info(f"   Fragmentos: {stats['chunks']}  Datos: {stats['bytes'] / 1048576:.1f} MB  "
+                f"Tiempo: {elapsed:.1f} s")
+    logger.info(f"   Throughput: {stats['indexed'] / elapsed:.2f} docs/s, {stats['chunks'] / elapsed:.1f} chunks/s, "
+                f"{stats['bytes'] / 1048576 / elapsed:.2f} MB/s")
+    logger.info(f"   Tiempo acumulado por etapa: parseo {stats['parse_seconds']:.1f} s, "
+                f"embeddings {stats['embed_seconds']:.1f} s")
+
+
+def build_knowledge_base(data_dir: str, vector_dir: str) -> KnowledgeBase:
+    """Crear la base de conocimiento con la misma configuración que la aplicación"""
+    embedding_model = embedding_model_from_env()
+    embeddings = OllamaEmbeddings(model=embedding_model, base_url=os.getenv("OLLAMA_HOST", "http://ollama:11434"))
+    vectorstore = Chroma(
+        persist_directory=vector_dir,
+        embedding_function=embeddings,
+        collection_name=collection_for_model(embedding_model)
+    )
+    processor = DocumentProcessor(None, embeddings)
+    return KnowledgeBase(
+        vectorstore, processor, data_dir=data_dir, vector_dir=vector_dir,
+        max_versions=int(os.getenv("MAX_DOCUMENT_VERSIONS", "5"))
+    )
+
 
 if __name__ == '__main__':
-    ingest_folder('data', 'vectorstore')
+    load_dotenv()
+    data_dir = os.getenv("DATA_DIR", "data")
+    vector_dir = os.getenv("VECTOR_DIR", "vectorstore")
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", default=[data_dir], help="Archivos o carpetas (por defecto DATA_DIR)")
+    parser.add_argument("--parse-workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--checkpoint", default=os.path.join(vector_dir, "ingest_checkpoint.jsonl"))
+    parser.add_argument("--restart", action="store_true", help="Ignorar el checkpoint existente")
+    parser.add_argument("--tags", default=None, help="Etiquetas separadas por comas para los documentos indexados")
+    args = parser.parse_args()
+
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(vector_dir, exist_ok=True)
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    tags = sorted({t.strip().lower() for t in args.tags.split(",") if t.strip()}) if args.tags else None
+
+    try:
+        index_lock = lock_index(vector_dir)
+    except IndexInUse as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+    knowledge_base = build_knowledge_base(data_dir, vector_dir)
+    checkpoint = Checkpoint(args.checkpoint)
+    try:
+        stats = run_ingestion(knowledge_base, args.paths, args.parse_workers, args.embed_workers, checkpoint, tags)
+    finally:
+        checkpoint.close()
+        index_lock.close()
+    print_summary(stats)
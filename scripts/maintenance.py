@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Mantenimiento del índice: huérfanos, duplicados, compactación y VACUUM
+
+- Vectores sin documento registrado (chunks heredados duplicados, versiones
+  de ingestas interrumpidas, restos de documentos borrados)
+- Segmentos de texto, snapshots y resúmenes de versiones que ya no existen
+- Directorios HNSW de colecciones borradas
+- Documentos cuyo archivo ya no está en DATA_DIR (solo se eliminan con --prune-missing)
+- Documentos con contenido idéntico bajo nombres distintos (solo se informan)
+
+El índice ANN solo se reconstruye si las entradas borradas superan
+MAINTENANCE_REBUILD_THRESHOLD (--rebuild/--no-rebuild lo fuerzan o lo evitan).
+
+Con el servidor en marcha usa --api-url: el mantenimiento se ejecuta dentro del
+servidor, que sigue respondiendo. Sin --api-url se abre el índice en este
+proceso, lo que solo es posible con el servidor parado (salvo con --dry-run);
+entonces --compact-sqlite compacta además chroma.sqlite3 con VACUUM.
+
+Uso:
+    python scripts/maintenance.py [--dry-run] [--prune-missing] [--rebuild | --no-rebuild] [--no-vacuum]
+    python scripts/maintenance.py --compact-sqlite
+    python scripts/maintenance.py --api-url http://localhost:8000 [--dry-run]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def run_local(data_dir: str, vector_dir: str, options: dict, compact_sqlite: bool = False) -> dict:
+    """Abrir el índice en este proceso con la configuración de la aplicación y mantenerlo
+
+    Salvo en simulación, el índice se bloquea en exclusiva: falla si el
+    servidor está en marcha.
+    """
+    from langchain_ollama import OllamaEmbeddings
+    from langchain_community.vectorstores import Chroma
+
+    from app.document_processor import DocumentProcessor
+    from app.knowledge_base import KnowledgeBase, collection_for_model
+    from app.maintenance import IndexMaintenance, compact_chroma_sqlite, lock_index
+    from app.models_config import embedding_model_from_env
+
+    index_lock = None if options["dry_run"] else lock_index(vector_dir)
+    embedding_model = embedding_model_from_env()
+    embeddings = OllamaEmbeddings(model=embedding_model, base_url=os.getenv("OLLAMA_HOST", "http://ollama:11434"))
+    vectorstore = Chroma(
+        persist_directory=vector_dir,
+        embedding_function=embeddings,
+        collection_name=collection_for_model(embedding_model)
+    )
+    knowledge_base = KnowledgeBase(
+        vectorstore, DocumentProcessor(None, embeddings), data_dir=data_dir, vector_dir=vector_dir,
+        max_versions=int(os.getenv("MAX_DOCUMENT_VERSIONS", "5")),
+        summaries=os.getenv("ENABLE_SUMMARIES", "false").lower() == "true"
+    )
+    maintenance = IndexMaintenance(
+        knowledge_base, rebuild_threshold=float(os.getenv("MAINTENANCE_REBUILD_THRESHOLD", "0.2"))
+    )
+    try:
+        report = maintenance.run(**options)
+        if report is not None and compact_sqlite and not options["dry_run"]:
+            report["chroma_sqlite_compacted"] = compact_chroma_sqlite(vector_dir)
+        return report
+    finally:
+        if index_lock is not None:
+            index_lock.close()
+
+
+def run_remote(api_url: str, options: dict, poll_seconds: float = 5) -> dict:
+    """Lanzar el mantenimiento en el servidor y esperar a que termine"""
+    base = f"{api_url.rstrip('/')}/api/maintenance"
+
+    def status() -> dict:
+        with urllib.request.urlopen(base, timeout=30) as response:
+            return json.load(response)
+
+    previous = (status().get("last_report") or {}).get("started_at")
+    query = urllib.parse.urlencode({key: str(value).lower() for key, value in options.items() if value is not None})
+    urllib.request.urlopen(urllib.request.Request(f"{base}?{query}", data=b"", method="POST"), timeout=30).close()
+
+    while True:
+        time.sleep(poll_seconds)
+        current = status()
+        if current["running"]:
+            continue
+        report = current.get("last_report") or {}
+        if report.get("started_at") == previous:
+            raise RuntimeError("El mantenimiento terminó sin informe; revisa los logs del servidor")
+        return report
+
+
+def print_report(report: dict):
+    findings = report["findings"]
+    print(f"\n🔎 Hallazgos ({findings['vectors']} vectores en el índice)")
+    for key, value in findings.items():
+        if key != "vectors" and not key.endswith("_sample"):
+            print(f"   {key:<22}{str(value):>10}")
+    for key in ("missing_files", "duplicate_documents"):
+        for item in findings.get(f"{key}_sample", [])[:10]:
+            print(f"   · {key}: {item}")
+
+    if report["dry_run"]:
+        print("\n(simulación: no se modificó nada)")
+        return
+
+    print("\n🧹 Acciones")
+    for key, value in report["actions"].items():
+        print(f"   {key:<22}{str(value):>10}")
+
+    print(f"\n{'componente':<20}{'antes (MB)':>12}{'después (MB)':>14}")
+    for key, before in report["size_before"].items():
+        print(f"{key:<20}{before / 1048576:>12.2f}{report['size_after'][key] / 1048576:>14.2f}")
+    print(f"💾 Recuperado: {report['reclaimed_mb']} MB (sin contar chroma.sqlite3, "
+          f"{report['chroma_sqlite_growth_mb']:+} MB)")
+    compacted = report.get("chroma_sqlite_compacted")
+    if compacted:
+        print(f"🗜️ chroma.sqlite3 compactado: {compacted['before'] / 1048576:.2f} → "
+              f"{compacted['after'] / 1048576:.2f} MB")
+    elif report.get("compaction_recommended"):
+        print(f"⚠️ chroma.sqlite3 tiene {report['chroma_sqlite_free_mb']} MB libres: "
+              "compáctalo con el servidor parado (--compact-sqlite)")
+
+    before, after = report["latency_before"], report["latency_after"]
+    if before.get("probes") and after.get("probes"):
+        print(f"⏱️ Latencia de búsqueda p50 {before['p50_ms']} → {after['p50_ms']} ms, "
+              f"p95 {before['p95_ms']} → {after['p95_ms']} ms ({after['probes']} consultas)")
+    print(f"✅ Terminado en {report['duration_s']} s")
+
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default=os.getenv("DATA_DIR", "data"))
+    parser.add_argument("--vector-dir", default=os.getenv("VECTOR_DIR", "vectorstore"))
+    parser.add_argument("--api-url", default=None, help="Ejecutar en el servidor en marcha (p. ej. http://localhost:8000)")
+    parser.add_argument("--dry-run", action="store_true", help="Solo detectar e informar")
+    parser.add_argument("--prune-missing", action="store_true",
+                        help="Eliminar del índice los documentos cuyo archivo ya no está en DATA_DIR")
+    rebuild_group = parser.add_mutually_exclusive_group()
+    rebuild_group.add_argument("--rebuild", dest="rebuild", action="store_const", const=True, default=None,
+                               help="Reconstruir el índice ANN aunque no se alcance el umbral")
+    rebuild_group.add_argument("--no-rebuild", dest="rebuild", action="store_const", const=False,
+                               help="No reconstruir el índice ANN")
+    parser.add_argument("--no-vacuum", action="store_true", help="No ejecutar VACUUM en el registro de documentos")
+    parser.add_argument("--compact-sqlite", action="store_true",
+                        help="Compactar chroma.sqlite3 con VACUUM (solo sin --api-url, con el servidor parado)")
+    parser.add_argument("--json", action="store_true", help="Imprimir el informe completo en JSON")
+    args = parser.parse_args()
+
+    run_options = {
+        "dry_run": args.dry_run,
+        "prune_missing": args.prune_missing,
+        "rebuild": args.rebuild,
+        "vacuum": not args.no_vacuum
+    }
+    if args.api_url and args.compact_sqlite:
+        parser.error("--compact-sqlite necesita el servidor parado: ejecútalo sin --api-url")
+    try:
+        if args.api_url:
+            result = run_remote(args.api_url, run_options)
+        else:
+            result = run_local(args.data_dir, args.vector_dir, run_options, args.compact_sqlite)
+    except urllib.error.HTTPError as e:
+        print(f"❌ {e.code}: {e.read().decode('utf-8', 'replace')}", file=sys.stderr)
+        sys.exit(1)
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if result is None:
+        print("❌ Ya hay un mantenimiento en curso", file=sys.stderr)
+        sys.exit(1)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
@@ -0,0 +1,164 @@
+"""
+Pruebas del parser multipart en streaming y del límite de tamaño de las peticiones
+"""
+
+import os
+import asyncio
+import hashlib
+
+import pytest
+
+from app.uploads import (
+    RequestSizeLimit, UploadMalformed, UploadTooLarge, receive_multipart
+)
+
+BOUNDARY = "----limite-de-prueba"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+MB = 1024 * 1024
+
+
+def multipart_body(fields=None, files=None) -> bytes:
+    parts = []
+    for name, value in (fields or {}).items():
+        parts.append(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode() + value.encode()
+        )
+    for filename, content in (files or {}).items():
+        parts.append(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode() + content
+        )
+    return b"\r\n".join(parts) + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def in_chunks(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def receive(body: bytes, staging_dir, chunk_size: int, max_file_bytes: int = MB, max_request_bytes: int = 10 * MB,
+            accept=None):
+    return asyncio.run(receive_multipart(
+        in_chunks(body, chunk_size), CONTENT_TYPE,
+        lambda filename: os.path.join(staging_dir, f"staged_{filename}"),
+        max_file_bytes=max_file_bytes, max_request_bytes=max_request_bytes, accept=accept
+    ))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, len(BOUNDARY) + 1, 4096])
+def test_boundaries_split_across_chunks(tmp_path, chunk_size):
+    # El contenido incluye un prefijo del boundary que no debe cortar la parte
+    content = b"inicio\r\n--" + BOUNDARY[:10].encode() + b" medio\r\n" + os.urandom(300) + b"\r\nfin"
+    body = multipart_body({"tags": "cardiologia, guias"}, {"informe.pdf": content, "nota.txt": b"hola"})
+
+    fields, uploads = receive(body, tmp_path, chunk_size)
+
+    assert fields == {"tags": "cardiologia, guias"}
+    assert [upload["filename"] for upload in uploads] == ["informe.pdf", "nota.txt"]
+    first = uploads[0]
+    assert first["size"] == len(content)
+    assert first["content_hash"] == hashlib.sha256(content).hexdigest()
+    with open(first["staged_path"], "rb") as f:
+        assert f.read() == content
+
+
+def test_oversize_part_is_rejected_and_removed(tmp_path):
+    body = multipart_body(files={"grande.pdf": b"x" * 5000, "normal.txt": b"ok"})
+
+    _, uploads = receive(body, tmp_path, 512, max_file_bytes=4096)
+
+    large, normal = uploads
+    assert large["status_code"] == 413 and "staged_path" not in large
+    assert normal["size"] == 2
+    assert sorted(os.listdir(tmp_path)) == ["staged_normal.txt"]
+
+
+def test_rejected_filename_writes_nothing(tmp_path):
+    body = multipart_body(files={"virus.exe": b"MZ" * 100})
+
+    _, uploads = receive(body, tmp_path, 64, accept=lambda filename: "Tipo de archivo no soportado")
+
+    assert uploads[0]["status_code"] == 400
+    assert os.listdir(tmp_path) == []
+
+
+def test_request_over_limit_discards_staged_files(tmp_path):
+    body = multipart_body(files={"a.txt": b"a" * 3000, "b.txt": b"b" * 3000})
+
+    with pytest.raises(UploadTooLarge):
+        receive(body, tmp_path, 1000, max_request_bytes=4000)
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("cut", [10, 80, -40, -3])
+def test_truncated_body_is_malformed(tmp_path, cut):
+    body = multipart_body({"tags": "x"}, {"informe.pdf": b"contenido" * 20})
+
+    with pytest.raises(UploadMalformed):
+        receive(body[:cut], tmp_path, 16)
+    assert os.listdir(tmp_path) == []
+
+
+def test_oversize_text_field_is_malformed(tmp_path):
+    body = multipart_body({"tags": "t" * (70 * 1024)})
+
+    with pytest.raises(UploadMalformed):
+        receive(body, tmp_path, 4096)
+
+
+def test_non_multipart_content_type(tmp_path):
+    with pytest.raises(UploadMalformed):
+        asyncio.run(receive_multipart(
+            in_chunks(b"{}", 2), "application/json", lambda name: str(tmp_path / name),
+            max_file_bytes=MB, max_request_bytes=MB
+        ))
+
+
+def call_limited(body_chunks, headers, max_bytes=1000):
+    """Ejecutar RequestSizeLimit sobre una app que lee el cuerpo entero"""
+    received = []
+
+    async def app(scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        received.append(body)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(body_chunks) - 1}
+        for i, chunk in enumerate(body_chunks)
+    ]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/api/batch", "headers": headers}
+    asyncio.run(RequestSizeLimit(app, max_bytes)(scope, receive, send))
+    return sent[0]["status"], received
+
+
+def test_chunked_body_over_limit_is_cut():
+    status, received = call_limited([b"x" * 600, b"x" * 600, b"x" * 600], [(b"transfer-encoding", b"chunked")])
+    assert status == 413
+    assert received == []
+
+
+def test_chunked_body_within_limit_passes():
+    status, received = call_limited([b"x" * 400, b"x" * 400], [(b"transfer-encoding", b"chunked")])
+    assert status == 200
+    assert received == [b"x" * 800]
+
+
+@pytest.mark.parametrize("content_length, expected", [(b"5000", 413), (b"abc", 400), (b"10", 200)])
+def test_content_length_checked_before_reading(content_length, expected):
+    status, _ = call_limited([b"x" * 10], [(b"content-length", content_length)])
+    assert status == expected